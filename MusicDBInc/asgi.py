@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MusicDBInc.settings')
+# Settings keep database connections per request under ASGI
+os.environ.setdefault('DOTTIFY_ASGI', '1')
 
 application = get_asgi_application()
@@ -13,8 +13,15 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import atexit
+import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
+from dottify.sqlite import CONN_MAX_AGE, production_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -29,7 +36,13 @@ SECRET_KEY = 'django-insecure-session-key'
 
 # For our API, we will explicitly allow unauthenticated users
 REST_FRAMEWORK = {
-    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny']}
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    # List endpoints are keyset paginated; clients may ask for ?page_size= up to the class cap
+    'DEFAULT_PAGINATION_CLASS': 'dottify.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # Errors for list payloads (e.g. bulk track uploads) are keyed by row index
+    'LIST_SERIALIZER_ERRORS_AS_DICT': True,
+}
 
 # Application definition
 
@@ -49,11 +62,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dottify.metrics.MetricsMiddleware',
+    'dottify.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'dottify.middleware.IdentityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,13 +97,30 @@ WSGI_APPLICATION = 'MusicDBInc.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# MusicDBInc.asgi sets DOTTIFY_ASGI: persistent connections are only reused
+# under WSGI, and would pile up on ASGI's per-request threads
+SERVING_ASGI = bool(os.environ.get('DOTTIFY_ASGI'))
+
 DATABASES = {
-    'default': {
+    # WAL, immediate transactions, a busy timeout and (under WSGI) persistent
+    # connections, so concurrent writes queue instead of failing; see dottify.sqlite
+    'default': production_database(BASE_DIR / 'db.sqlite3', conn_max_age=0 if SERVING_ASGI else CONN_MAX_AGE),
+    # A read-only copy of db.sqlite3 (e.g. kept up to date by Litestream);
+    # only used once listed in DOTTIFY_READ_REPLICAS
+    'replica': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+    },
 }
 
+# Safe requests read from one of these aliases; see dottify.routers
+DATABASE_ROUTERS = ['dottify.routers.ReplicaRouter']
+DOTTIFY_READ_REPLICAS = []
+
+# Seconds a replica may trail the primary: after a write, that client reads
+# from the primary for this long
+DOTTIFY_REPLICA_LAG_TOLERANCE = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -139,9 +172,20 @@ LOCALE_PATHS = [BASE_DIR / 'dottify' / 'locale']
 STATIC_ROOT = BASE_DIR / 'static/'
 STATIC_URL = 'static/'
 
-# Media for uploaded files
+# manage.py test or pytest
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
+# Media for uploaded files; test runs write theirs to a scratch directory
 MEDIA_ROOT = BASE_DIR / 'media/'
 MEDIA_URL = 'media/'
+if TESTING:
+    MEDIA_ROOT = Path(tempfile.mkdtemp(prefix='dottify-test-media-'))
+    atexit.register(shutil.rmtree, MEDIA_ROOT, True)
+
+# Album cover thumbnails/WebP copies are generated after commit on worker
+# threads, or inline in tests so none outlives its test database
+DOTTIFY_COVER_VARIANTS_ASYNC = not TESTING
+DOTTIFY_COVER_WORKERS = 2
 
 # Set up for simple Bootstrap theming
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
@@ -154,6 +198,41 @@ MESSAGE_TAGS = {
     messages.ERROR: 'alert-danger'
 }
 
+# Seconds a cached identity version token lives. Group changes reach other
+# workers only through a shared cache; with the per-process default they take
+# up to this long to apply everywhere
+DOTTIFY_IDENTITY_MAX_AGE = 60
+
+# Seconds /api/statistics/ may serve a cached snapshot before re-reading it
+DOTTIFY_STATISTICS_MAX_AGE = 30
+
+# Ratings a song or album needs within a chart window to be ranked by average,
+# and seconds /api/charts/ may go between incremental refreshes
+DOTTIFY_CHART_MIN_VOTES = 5
+DOTTIFY_CHART_MAX_AGE = 300
+# Stale charts are refreshed on a background thread, not by the read that
+# notices; inline in tests
+DOTTIFY_CHART_REFRESH_ASYNC = not TESTING
+
+# POST /api/ratings/ buffers ratings in memory and writes them in batches of
+# up to this many, at least every this many seconds, from a writer thread
+DOTTIFY_RATING_BUFFER_SIZE = 200
+DOTTIFY_RATING_BUFFER_DELAY = 1.0
+DOTTIFY_RATING_BUFFER_ASYNC = True
+# Failed batches are retried with backoff this many times before being dropped,
+# and at most this many ratings wait at once before posts get 503
+DOTTIFY_RATING_BUFFER_RETRIES = 5
+DOTTIFY_RATING_BUFFER_LIMIT = 10000
+
+# Rendered album page fragments (tracklist, comments); entries are keyed by the
+# album's version, so the timeout only bounds how long superseded ones linger
+DOTTIFY_FRAGMENT_CACHE = 'default'
+DOTTIFY_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Per-view query/timing histograms are served at /metrics; this also sends
+# each response's numbers to the client in a Server-Timing header
+DOTTIFY_METRICS_SERVER_TIMING = True
+
 # Account redirects
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_REDIRECT_URL = '/'
@@ -0,0 +1,222 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Rating, RatingBucket, Song, SongRatingSummary
+
+# Length of the "recent" rating average shown on the song page
+RECENT_WINDOW_DAYS = 90
+
+
+def recent_window_start(today=None):
+    """First day that still counts towards the recent average."""
+    today = today or timezone.localdate()
+    return today - timedelta(days=RECENT_WINDOW_DAYS)
+
+
+def normalise_stars(stars):
+    return Decimal(str(stars)).quantize(Decimal('0.1'))
+
+
+def rating_day(created_at):
+    if timezone.is_aware(created_at):
+        return timezone.localdate(created_at)
+    return created_at.date()
+
+
+def apply_ratings(ratings, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) ratings from the stored aggregates.
+    Each rating is a (song_id, stars, created_at) tuple, so this can be fed
+    model instances, values_list() rows or a buffered batch alike.
+    """
+    buckets = defaultdict(int)
+    for song_id, stars, created_at in ratings:
+        buckets[(song_id, rating_day(created_at), normalise_stars(stars))] += 1
+
+    if not buckets:
+        return
+
+    with transaction.atomic():
+        per_song = defaultdict(list)
+        for (song_id, day, stars), count in buckets.items():
+            _apply_bucket(song_id, day, stars, sign * count)
+            per_song[song_id].append((day, stars, sign * count))
+
+        for song_id, changes in per_song.items():
+            _apply_summary(song_id, changes)
+
+        # Song representations include the averages
+        Song.touch(pk__in=per_song)
+
+
+def _apply_bucket(song_id, day, stars, delta):
+    bucket, _created = RatingBucket.objects.get_or_create(song_id=song_id, day=day, stars=stars)
+    RatingBucket.objects.filter(pk=bucket.pk).update(
+        count=F('count') + delta,
+        stars_sum=F('stars_sum') + stars * delta,
+    )
+    # Empty buckets carry no information, so keep the table small
+    RatingBucket.objects.filter(pk=bucket.pk, count__lte=0).delete()
+
+
+def _apply_summary(song_id, changes):
+    summary, _created = SongRatingSummary.objects.get_or_create(
+        song_id=song_id,
+        defaults={'window_start': recent_window_start()}
+    )
+    summary = roll_window(summary)
+
+    count_delta = sum(delta for _day, _stars, delta in changes)
+    sum_delta = sum(stars * delta for _day, stars, delta in changes)
+    recent = [(stars, delta) for day, stars, delta in changes if day >= summary.window_start]
+
+    SongRatingSummary.objects.filter(pk=song_id).update(
+        rating_count=F('rating_count') + count_delta,
+        stars_sum=F('stars_sum') + sum_delta,
+        recent_count=F('recent_count') + sum(delta for _stars, delta in recent),
+        recent_stars_sum=F('recent_stars_sum') + sum(stars * delta for stars, delta in recent),
+    )
+
+
+def roll_window(summary, today=None):
+    """
+    Moves the recent window forward to today, subtracting only the buckets
+    of the days that fell out of it. Returns the up to date summary.
+    """
+    new_start = recent_window_start(today)
+    if summary.window_start >= new_start:
+        return summary
+
+    expired = RatingBucket.objects.filter(
+        song_id=summary.song_id,
+        day__gte=summary.window_start,
+        day__lt=new_start
+    ).aggregate(count=Sum('count'), total=Sum('stars_sum'))
+
+    # Guard on the old window_start so two concurrent readers don't both subtract
+    SongRatingSummary.objects.filter(pk=summary.pk, window_start=summary.window_start).update(
+        window_start=new_start,
+        recent_count=F('recent_count') - (expired['count'] or 0),
+        recent_stars_sum=F('recent_stars_sum') - (expired['total'] or Decimal('0.0')),
+    )
+    summary.refresh_from_db()
+    return summary
+
+
+def get_rating_summary(song):
+    """The song's summary with an up to date window, or None if it has no ratings."""
+    try:
+        summary = song.rating_summary
+    except SongRatingSummary.DoesNotExist:
+        return None
+    return roll_window(summary)
+
+
+# --- Rebuild / verification from the raw Rating table ---
+
+def compute_from_ratings(today=None):
+    """
+    Recomputes buckets and summaries from Rating without touching the stored ones.
+    Returns ({(song_id, day, stars): (count, sum)}, {song_id: summary field dict}).
+    """
+    window_start = recent_window_start(today)
+    rows = (
+        Rating.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('song_id', 'day', 'stars')
+        .annotate(count=Count('id'), total=Sum('stars'))
+        .order_by()
+    )
+
+    buckets = {}
+    summaries = {}
+    for row in rows:
+        stars = normalise_stars(row['stars'])
+        key = (row['song_id'], row['day'], stars)
+        total = normalise_stars(row['total'])
+        buckets[key] = (row['count'], total)
+
+        summary = summaries.setdefault(row['song_id'], {
+            'rating_count': 0,
+            'stars_sum': Decimal('0.0'),
+            'window_start': window_start,
+            'recent_count': 0,
+            'recent_stars_sum': Decimal('0.0'),
+        })
+        summary['rating_count'] += row['count']
+        summary['stars_sum'] += total
+        if row['day'] >= window_start:
+            summary['recent_count'] += row['count']
+            summary['recent_stars_sum'] += total
+
+    return buckets, summaries
+
+
+def rebuild(today=None, batch_size=1000):
+    """Replaces all stored aggregates with ones computed from Rating."""
+    buckets, summaries = compute_from_ratings(today)
+
+    with transaction.atomic():
+        RatingBucket.objects.all().delete()
+        SongRatingSummary.objects.all().delete()
+
+        RatingBucket.objects.bulk_create(
+            [
+                RatingBucket(song_id=song_id, day=day, stars=stars, count=count, stars_sum=total)
+                for (song_id, day, stars), (count, total) in buckets.items()
+            ],
+            batch_size=batch_size
+        )
+        SongRatingSummary.objects.bulk_create(
+            [SongRatingSummary(song_id=song_id, **fields) for song_id, fields in summaries.items()],
+            batch_size=batch_size
+        )
+
+    return len(buckets), len(summaries)
+
+
+def verify(today=None):
+    """
+    Compares the stored aggregates against Rating.
+    Returns a list of human readable differences, empty when they agree.
+    """
+    expected_buckets, expected_summaries = compute_from_ratings(today)
+    problems = []
+
+    stored_buckets = {
+        (b.song_id, b.day, normalise_stars(b.stars)): (b.count, normalise_stars(b.stars_sum))
+        for b in RatingBucket.objects.all()
+    }
+    for key in expected_buckets.keys() | stored_buckets.keys():
+        if expected_buckets.get(key) != stored_buckets.get(key):
+            problems.append(
+                f"bucket song={key[0]} day={key[1]} stars={key[2]}: "
+                f"expected {expected_buckets.get(key)}, stored {stored_buckets.get(key)}"
+            )
+
+    for summary in SongRatingSummary.objects.all():
+        summary = roll_window(summary, today)
+        expected = expected_summaries.pop(summary.song_id, None)
+        stored = {
+            'rating_count': summary.rating_count,
+            'stars_sum': normalise_stars(summary.stars_sum),
+            'window_start': summary.window_start,
+            'recent_count': summary.recent_count,
+            'recent_stars_sum': normalise_stars(summary.recent_stars_sum),
+        }
+        # A summary whose ratings were all deleted is equivalent to no summary
+        if expected is None and not stored['rating_count']:
+            continue
+        if expected != stored:
+            problems.append(f"summary song={summary.song_id}: expected {expected}, stored {stored}")
+
+    for song_id, expected in expected_summaries.items():
+        problems.append(f"summary song={song_id}: expected {expected}, stored None")
+
+    return problems
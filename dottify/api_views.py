@@ -1,72 +1,218 @@
 # Use this file for your API viewsets only
 
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework import filters
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.utils.translation import gettext_lazy as _
 
-from .models import Album, DottifyUser, Song, Playlist
-from .serializers import AlbumSerializer, PlaylistSerializer, SongSerializer
-from django.db.models import Avg
-
-
-class AlbumViewSet(viewsets.ModelViewSet):
+from . import charts, ingest, stats
+from .conditional import (
+    ConditionalGetMixin, album_validators, collection_validators, playlist_validators,
+    representation_parts, song_validators
+)
+from .filters import FullTextSearchFilter
+from .identity import get_identity
+from .models import Album, Comment, Song, Playlist
+from .pagination import CommentPagination, KeysetPagination, PlaylistPagination, SongPagination
+from .serializers import (
+    AlbumSerializer, CommentSerializer, PlaylistSerializer, RatingIngestSerializer, SongSerializer,
+    TrackSerializer
+)
+
+
+class SparseQuerysetMixin:
+    """Narrows the query to the columns a ?fields= / ?omit= response needs."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # The pagination key is read from each page's boundary rows
+        ordering = [name.lstrip('-') for name in getattr(self.pagination_class, 'ordering', ())]
+        return self.get_serializer_class().sparse_queryset(queryset, self.request, *ordering)
+
+
+class AlbumViewSet(SparseQuerysetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    """
+    Albums, paged by id. ?search= narrows the list to albums whose title,
+    artist name or track titles match the words as prefixes; matches stay in
+    id order so the cursor pages through them. For results ranked best match
+    first, use the album search page.
+    """
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
+    pagination_class = KeysetPagination
+
+    filter_backends = [FullTextSearchFilter]
 
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['title']
+    def get_object_validators(self):
+        return album_validators(self.kwargs['pk'], *representation_parts(self.request))
 
 
-class NestedSongViewSet(viewsets.ReadOnlyModelViewSet):
+class NestedSongViewSet(SparseQuerysetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = SongSerializer
+    pagination_class = SongPagination
 
     def get_queryset(self):
         # drf-nested-routers' should auto pass the parents
         # primary key - kwargs dict - parent_lookup[value]
-        return Song.objects.filter(album__pk=self.kwargs['album_pk'])
+        return Song.objects.filter(album__pk=self.kwargs['album_pk']).select_related('rating_summary')
+
+    def get_object_validators(self):
+        return song_validators(self.kwargs['pk'], *representation_parts(self.request))
+
+    def get_list_validators(self):
+        # Songs carry their rating averages, and the recent one rolls over daily
+        return collection_validators(
+            Song.objects.filter(album__pk=self.kwargs['album_pk']),
+            timezone.localdate(), *representation_parts(self.request)
+        )
+
+    def create(self, request, album_pk=None):
+        """
+        Adds a whole tracklist (a JSON list of {title, length}) to the album in one
+        transaction. Nothing is inserted unless every row is valid.
+        """
+        album = get_object_or_404(Album, pk=album_pk)
+
+        # Ownership is checked once for the whole list (Route 7 rules)
+        identity = get_identity(request)
+        is_owner = identity.profile is not None and album.artist_account_id == identity.profile.pk
+        if not (identity.is_admin or is_owner):
+            raise ValidationError({"album": _("You are not authorized to add a song to this album.")})
+
+        rows = request.data if isinstance(request.data, list) else [request.data]
+        serializer = TrackSerializer(data=rows, many=True, context={'album': album, 'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class NestedCommentViewSet(SparseQuerysetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """An album's comments, newest first, one keyset page at a time."""
+    serializer_class = CommentSerializer
+    pagination_class = CommentPagination
+
+    def get_queryset(self):
+        return Comment.objects.filter(album__pk=self.kwargs['album_pk']).with_authors()
 
+    # Comment changes bump their album's version
+    def get_object_validators(self):
+        return album_validators(self.kwargs['album_pk'], 'comment', *representation_parts(self.request))
 
-class SongViewSet(viewsets.ModelViewSet):
-    queryset = Song.objects.all()
+    def get_list_validators(self):
+        return album_validators(self.kwargs['album_pk'], 'comments', *representation_parts(self.request))
+
+
+class SongViewSet(SparseQuerysetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Song.objects.select_related('rating_summary')
     serializer_class = SongSerializer
+    pagination_class = SongPagination
 
+    def get_object_validators(self):
+        return song_validators(self.kwargs['pk'], *representation_parts(self.request))
 
-class PlaylistViewSet(viewsets.ReadOnlyModelViewSet):
+
+class PlaylistViewSet(SparseQuerysetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = PlaylistSerializer
     queryset = Playlist.objects.all()
+    pagination_class = PlaylistPagination
 
     def get_queryset(self):
         # only public ones are returned
-        return Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC)
+        return PlaylistSerializer.prepare_queryset(
+            Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC), self.request
+        )
 
+    def get_object_validators(self):
+        return playlist_validators(self.kwargs['pk'], *representation_parts(self.request))
 
-class StatisticsAPIView(APIView):
-    def get(self, request, format=None):
-
-        user_count = DottifyUser.objects.count()
-
-        album_count = Album.objects.count()
-
-        public_playlist_count = Playlist.objects.filter(
-            visibility=Playlist.Visibility.PUBLIC
-        ).count()
+    def get_list_validators(self):
+        return collection_validators(self.get_queryset(), *representation_parts(self.request))
 
-        avg_length_result = Song.objects.aggregate(average_length=Avg('length'))
-        song_length_average = avg_length_result.get('average_length')
 
-        if song_length_average is not None:
-            song_length_average = float(song_length_average)
-        else:
-            song_length_average = 0.0
-
-        data = {
-            'user_count': user_count,
-            'album_count': album_count,
-            'public_playlist_count': public_playlist_count,
-            'song_length_average': song_length_average,
-        }
+class StatisticsAPIView(APIView):
+    def get(self, request, format=None):
+        # Served from the maintained snapshot; see dottify.stats for the staleness bound
+        response = Response(stats.get_statistics())
+        patch_cache_control(response, max_age=stats.get_max_age())
+        return response
+
+
+class RatingIngestAPIView(APIView):
+    """
+    Accepts one rating ({song, stars}) or a list of them. They are validated
+    here and written in batches by dottify.ingest, hence 202 Accepted; 503
+    when the buffer is full.
+    """
+
+    def post(self, request, format=None):
+        rows = request.data if isinstance(request.data, list) else [request.data]
+        serializer = RatingIngestSerializer(data=rows, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.save()
+        except ingest.BufferFull:
+            # The writer has fallen behind; the client should send them again later
+            return Response(
+                {'detail': _("Too many ratings are waiting to be written. Try again later.")},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(max(int(ingest.get_max_delay()), 1))},
+            )
+        return Response({'accepted': len(rows)}, status=status.HTTP_202_ACCEPTED)
+
+
+class ChartAPIView(APIView):
+    """
+    Top songs or albums over the last ?window= days (7, 30 or 90), ranked
+    ?by=average (among those with DOTTIFY_CHART_MIN_VOTES ratings) or by
+    rating volume, read from the rollups that dottify.charts maintains.
+    """
+    kind = None
+    default_limit = 10
+    max_limit = 100
 
-        return Response(data)
-    
\ No newline at end of file
+    def get(self, request, format=None):
+        window = self.get_window(request)
+        by = request.query_params.get('by', 'average')
+        if by not in charts.ORDERINGS:
+            raise ValidationError({'by': _('Rank by one of: %(orderings)s.') % {
+                'orderings': ', '.join(charts.ORDERINGS)
+            }})
+        limit = self.get_limit(request)
+
+        # Refreshed off the request; until the first refresh there is no day
+        charts.schedule_refresh_if_stale()
+        state = charts.load_state()
+        response = Response({
+            'window': window,
+            'by': by,
+            'min_votes': charts.get_min_votes() if by == 'average' else None,
+            'day': state.day if state is not None else None,
+            'results': charts.CHARTS[self.kind](window, by, limit),
+        })
+        patch_cache_control(response, max_age=charts.get_max_age())
+        return response
+
+    @staticmethod
+    def get_window(request):
+        try:
+            window = int(request.query_params.get('window', charts.WINDOWS[0]))
+        except ValueError:
+            window = None
+        if window not in charts.WINDOWS:
+            raise ValidationError({'window': _('Window must be one of: %(windows)s days.') % {
+                'windows': ', '.join(map(str, charts.WINDOWS))
+            }})
+        return window
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= self.max_limit:
+            raise ValidationError({'limit': _('Limit must be between 1 and %(max)d.') % {'max': self.max_limit}})
+        return limit
@@ -0,0 +1,169 @@
+# Async versions of the read-only API endpoints, served under /api/async/.
+# They return the same JSON as the DRF viewsets, but load everything through
+# Django's async ORM so an ASGI worker isn't held on a thread per request.
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import require_safe
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import search, stats
+from .aggregates import recent_window_start, roll_window
+from .models import Album, Playlist, Song, SongRatingSummary
+from .pagination import (
+    KeysetPagination, PlaylistPagination, SongPagination, akeyset_page, link_header, requested_page_size
+)
+from .serializers import AlbumSerializer, PlaylistSerializer, SongSerializer, aload_track_titles
+
+
+def _json(data, status=200, headers=None):
+    # DRF's encoder, so lazy strings, decimals and dates come out as they do there
+    return JsonResponse(data, encoder=JSONEncoder, safe=False, status=status, headers=headers)
+
+
+def _not_found():
+    return _json({'detail': _('Not found.')}, status=404)
+
+
+def _sparse(serializer_class, queryset, request, pagination_class):
+    """The ?fields= / ?omit= column narrowing of the sync viewsets."""
+    ordering = [name.lstrip('-') for name in pagination_class.ordering]
+    return serializer_class.sparse_queryset(queryset, request, *ordering)
+
+
+async def _paginated(request, queryset, pagination_class, serialize):
+    """
+    One keyset page of queryset, paged exactly like pagination_class does for
+    the sync views. serialize is awaited with the rows and returns the body.
+    """
+    page_size = requested_page_size(
+        request.GET, pagination_class.page_size_query_param,
+        pagination_class.page_size, pagination_class.max_page_size
+    )
+    try:
+        rows, next_cursor, previous_cursor = await akeyset_page(
+            queryset, pagination_class.ordering, page_size,
+            request.GET.get(pagination_class.cursor_query_param)
+        )
+    except ValueError:
+        return _json({'detail': pagination_class.invalid_cursor_message}, status=404)
+
+    link = link_header(
+        request.build_absolute_uri(), pagination_class.cursor_query_param, next_cursor, previous_cursor
+    )
+    return _json(await serialize(rows), headers={'Link': link} if link else None)
+
+
+# --- Statistics ---
+
+@require_safe
+async def statistics(request):
+    response = _json(await stats.aget_statistics())
+    patch_cache_control(response, max_age=stats.get_max_age())
+    return response
+
+
+# --- Albums ---
+
+@require_safe
+async def album_list(request):
+    queryset = Album.objects.all()
+    text = request.GET.get(api_settings.SEARCH_PARAM, '').strip()
+    if text:
+        queryset = search.filter_albums(queryset, text)
+
+    async def serialize(albums):
+        serializer = AlbumSerializer(context={'request': request})
+        if 'song_set' in serializer.fields:
+            serializer.track_titles = await aload_track_titles([album.pk for album in albums])
+        return [serializer.to_representation(album) for album in albums]
+
+    queryset = _sparse(AlbumSerializer, queryset, request, KeysetPagination)
+    return await _paginated(request, queryset, KeysetPagination, serialize)
+
+
+@require_safe
+async def album_detail(request, pk):
+    serializer = AlbumSerializer(context={'request': request})
+    album_query = _sparse(AlbumSerializer, Album.objects.filter(pk=pk), request, KeysetPagination).afirst()
+    if 'song_set' in serializer.fields:
+        # The album row and its track titles don't depend on each other
+        album, serializer.track_titles = await asyncio.gather(album_query, aload_track_titles([pk]))
+    else:
+        album = await album_query
+    if album is None:
+        return _not_found()
+    return _json(serializer.to_representation(album))
+
+
+# --- Songs ---
+
+async def _roll_rating_windows(request, songs):
+    """
+    Brings stale 90-day windows up to date before serialising, which would
+    otherwise write to the database from inside the event loop.
+    """
+    if not SongSerializer.requested_fields(request) & {'all_time_rating', 'recent_rating'}:
+        # The summaries weren't loaded and won't be shown
+        return
+    window_start = recent_window_start()
+    for song in songs:
+        try:
+            summary = song.rating_summary
+        except SongRatingSummary.DoesNotExist:
+            continue
+        if summary.window_start < window_start:
+            await sync_to_async(roll_window)(summary)
+
+
+def _album_songs(request, album_pk):
+    queryset = Song.objects.filter(album_id=album_pk).select_related('rating_summary')
+    return _sparse(SongSerializer, queryset, request, SongPagination)
+
+
+@require_safe
+async def album_song_list(request, album_pk):
+    async def serialize(songs):
+        await _roll_rating_windows(request, songs)
+        return SongSerializer(songs, many=True, context={'request': request}).data
+
+    return await _paginated(request, _album_songs(request, album_pk), SongPagination, serialize)
+
+
+@require_safe
+async def album_song_detail(request, album_pk, pk):
+    song = await _album_songs(request, album_pk).filter(pk=pk).afirst()
+    if song is None:
+        return _not_found()
+    await _roll_rating_windows(request, [song])
+    return _json(SongSerializer(song, context={'request': request}).data)
+
+
+# --- Playlists ---
+
+def _public_playlists(request):
+    queryset = PlaylistSerializer.prepare_queryset(
+        Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC), request
+    )
+    return _sparse(PlaylistSerializer, queryset, request, PlaylistPagination)
+
+
+@require_safe
+async def playlist_list(request):
+    async def serialize(playlists):
+        return PlaylistSerializer(playlists, many=True, context={'request': request}).data
+
+    return await _paginated(request, _public_playlists(request), PlaylistPagination, serialize)
+
+
+@require_safe
+async def playlist_detail(request, pk):
+    playlist = await _public_playlists(request).filter(pk=pk).afirst()
+    if playlist is None:
+        return _not_found()
+    return _json(PlaylistSerializer(playlist, context={'request': request}).data)
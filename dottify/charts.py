@@ -0,0 +1,341 @@
+# Top rated songs and albums over sliding windows, served from rollup tables.
+#
+# SongChartEntry holds each song's rating count and sum for the last 7, 30
+# and 90 days. refresh() moves the windows forward incrementally: it adds
+# the Rating rows created since the last refresh (above the id watermark)
+# and subtracts the days that fell out of each window, read from the
+# per-day RatingBucket rows that dottify.aggregates keeps. Edits and
+# deletes of ratings already counted are applied as they happen (see
+# signals). AlbumChartEntry takes the same deltas, summed per album, and
+# songs that move between albums or are deleted take their counts along.
+#
+# Reads never refresh inline: a chart request that finds the charts stale
+# starts a refresh on a background thread (DOTTIFY_CHART_REFRESH_ASYNC), and
+# manage.py refresh_charts can run it on a schedule instead.
+#
+# The watermark relies on Rating ids being committed in order, as they are
+# on SQLite, whose writers take the lock one at a time.
+
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, FloatField, Max, Sum
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from .aggregates import normalise_stars, rating_day
+from .models import AlbumChartEntry, ChartState, Rating, RatingBucket, Song, SongChartEntry
+
+# Lengths of the chart windows, in days
+WINDOWS = (7, 30, 90)
+
+ORDERINGS = ('average', 'volume')
+
+logger = logging.getLogger(__name__)
+
+# Held while a background refresh runs, so stale reads start only one
+_refreshing = threading.Lock()
+
+
+def get_min_votes():
+    """Ratings a song or album needs in the window to be ranked by average."""
+    return getattr(settings, 'DOTTIFY_CHART_MIN_VOTES', 5)
+
+
+def get_max_age():
+    """Seconds the charts may go without a refresh before a read triggers one."""
+    return getattr(settings, 'DOTTIFY_CHART_MAX_AGE', 300)
+
+
+def window_start(window, day):
+    """First day of the window ending on (and including) day."""
+    return day - timedelta(days=window - 1)
+
+
+def load_state():
+    return ChartState.objects.filter(pk=ChartState.SINGLETON_PK).first()
+
+
+# --- Maintenance ---
+
+def daily_counts(ratings, since):
+    """(song_id, day, count, stars sum) for the ratings created on or after the day since."""
+    return (
+        ratings
+        .annotate(day=TruncDate('created_at'))
+        .filter(day__gte=since)
+        .values_list('song_id', 'day')
+        .annotate(count=Count('id'), total=Sum('stars'))
+        .order_by()
+    )
+
+
+def add_to_windows(deltas, rows, day, windows=WINDOWS, sign=1):
+    """Adds (song_id, day, count, stars sum) rows to the windows ending on day that they fall in."""
+    for song_id, rated_on, count, total in rows:
+        for window in windows:
+            if window_start(window, day) <= rated_on <= day:
+                entry = deltas[(song_id, window)]
+                entry[0] += sign * count
+                entry[1] += sign * normalise_stars(total)
+
+
+def compute_from_ratings(day, watermark):
+    """{(song_id, window): [count, stars sum]} for the ratings up to watermark, as of day."""
+    deltas = defaultdict(lambda: [0, Decimal('0.0')])
+    rows = daily_counts(Rating.objects.filter(pk__lte=watermark), window_start(max(WINDOWS), day))
+    add_to_windows(deltas, rows, day)
+    return deltas
+
+
+def _apply(model, field, deltas):
+    """Adds {(object id, window): (count, stars sum)} to model's entries, dropping emptied ones."""
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+    existing = {
+        (getattr(entry, f'{field}_id'), entry.window): entry
+        for entry in model.objects.filter(**{f'{field}_id__in': {object_id for object_id, _window in deltas}})
+    }
+
+    created, updated, emptied = [], [], []
+    for (object_id, window), (count, total) in deltas.items():
+        entry = existing.get((object_id, window))
+        if entry is None:
+            entry = model(**{f'{field}_id': object_id}, window=window)
+            created.append(entry)
+        else:
+            updated.append(entry)
+        entry.rating_count += count
+        entry.stars_sum += total
+        if entry.rating_count <= 0 and entry.pk is not None:
+            emptied.append(entry.pk)
+
+    model.objects.bulk_create([entry for entry in created if entry.rating_count > 0])
+    model.objects.bulk_update([entry for entry in updated if entry.rating_count > 0], ['rating_count', 'stars_sum'])
+    model.objects.filter(pk__in=emptied).delete()
+
+
+def _album_deltas(deltas):
+    """Sums {(song_id, window): [count, stars sum]} deltas per album."""
+    albums = dict(Song.objects.filter(pk__in={song_id for song_id, _window in deltas}).values_list('pk', 'album_id'))
+    album_deltas = defaultdict(lambda: [0, Decimal('0.0')])
+    for (song_id, window), (count, total) in deltas.items():
+        if albums.get(song_id) is not None:
+            entry = album_deltas[(albums[song_id], window)]
+            entry[0] += count
+            entry[1] += total
+    return album_deltas
+
+
+def _rebuild_albums():
+    """Replaces the album entries with sums of their songs' entries."""
+    AlbumChartEntry.objects.all().delete()
+    rows = (
+        SongChartEntry.objects
+        .values_list('song__album_id', 'window')
+        .annotate(count=Sum('rating_count'), total=Sum('stars_sum'))
+        .order_by()
+    )
+    AlbumChartEntry.objects.bulk_create(
+        AlbumChartEntry(album_id=album_id, window=window, rating_count=count, stars_sum=total)
+        for album_id, window, count, total in rows
+    )
+
+
+def _save_state(day, watermark):
+    ChartState.objects.update_or_create(
+        pk=ChartState.SINGLETON_PK,
+        defaults={'day': day, 'rating_watermark': watermark, 'refreshed_at': timezone.now()}
+    )
+
+
+def rebuild(today=None):
+    """Replaces all chart entries with ones computed from Rating. Returns the number of song entries."""
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        watermark = Rating.objects.aggregate(last=Max('pk'))['last'] or 0
+        SongChartEntry.objects.all().delete()
+        _apply(SongChartEntry, 'song', compute_from_ratings(today, watermark))
+        _rebuild_albums()
+        _save_state(today, watermark)
+    return SongChartEntry.objects.count()
+
+
+def refresh(today=None):
+    """
+    Brings the charts up to today: subtracts the days that left each window
+    and adds the ratings created since the last refresh.
+    """
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        state = ChartState.objects.select_for_update().filter(pk=ChartState.SINGLETON_PK).first()
+        if state is None or state.day > today:
+            return rebuild(today)
+
+        watermark = Rating.objects.aggregate(last=Max('pk'))['last'] or 0
+        deltas = defaultdict(lambda: [0, Decimal('0.0')])
+        moved = [window for window in WINDOWS if window_start(window, today) > window_start(window, state.day)]
+        # Windows the last refresh is entirely out of share no days with it
+        restarted = [window for window in moved if (today - state.day).days >= window]
+        expiring = [window for window in moved if window not in restarted]
+
+        if restarted:
+            SongChartEntry.objects.filter(window__in=restarted).delete()
+            AlbumChartEntry.objects.filter(window__in=restarted).delete()
+            since = window_start(max(restarted), today)
+            rows = daily_counts(Rating.objects.filter(pk__lte=state.rating_watermark), since)
+            add_to_windows(deltas, rows, today, restarted)
+
+        for window in expiring:
+            expired = (
+                RatingBucket.objects
+                .filter(day__gte=window_start(window, state.day), day__lt=window_start(window, today))
+                .values_list('song_id')
+                .annotate(count=Sum('count'), total=Sum('stars_sum'))
+                .order_by()
+            )
+            for song_id, count, total in expired:
+                entry = deltas[(song_id, window)]
+                entry[0] -= count
+                entry[1] -= normalise_stars(total)
+
+        new_ratings = Rating.objects.filter(pk__gt=state.rating_watermark, pk__lte=watermark)
+        add_to_windows(deltas, daily_counts(new_ratings, window_start(max(WINDOWS), today)), today)
+
+        _apply(SongChartEntry, 'song', deltas)
+        _apply(AlbumChartEntry, 'album', _album_deltas(deltas))
+        _save_state(today, watermark)
+
+
+def is_stale():
+    state = load_state()
+    return (
+        state is None
+        or state.day != timezone.localdate()
+        or (timezone.now() - state.refreshed_at).total_seconds() > get_max_age()
+    )
+
+
+def refresh_if_stale():
+    if is_stale():
+        refresh()
+
+
+def _refresh_in_background():
+    try:
+        refresh_if_stale()
+    except Exception:
+        logger.exception('Refreshing the charts failed')
+    finally:
+        _refreshing.release()
+        # The thread's own connections
+        connections.close_all()
+
+
+def schedule_refresh_if_stale():
+    """
+    Starts a refresh if the charts are stale, on a background thread so the
+    read asking doesn't wait for the write lock; inline when
+    DOTTIFY_CHART_REFRESH_ASYNC is off. A refresh already running is left to finish.
+    """
+    if not is_stale():
+        return
+    if not getattr(settings, 'DOTTIFY_CHART_REFRESH_ASYNC', True):
+        refresh()
+    elif _refreshing.acquire(blocking=False):
+        threading.Thread(target=_refresh_in_background, name='dottify-charts', daemon=True).start()
+
+
+def apply_rating_change(rating_id, previous=None, current=None):
+    """
+    Takes an edited or deleted rating that the charts already count out of
+    them (previous) and back in (current); (song_id, stars, created_at)
+    tuples as aggregates.apply_ratings takes. Ratings above the watermark
+    are left to the next refresh.
+    """
+    state = load_state()
+    if state is None or rating_id > state.rating_watermark:
+        return
+
+    deltas = defaultdict(lambda: [0, Decimal('0.0')])
+    for rating, sign in ((previous, -1), (current, 1)):
+        if rating is not None:
+            song_id, stars, created_at = rating
+            add_to_windows(deltas, [(song_id, rating_day(created_at), 1, stars)], state.day, sign=sign)
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        _apply(SongChartEntry, 'song', deltas)
+        _apply(AlbumChartEntry, 'album', _album_deltas(deltas))
+
+
+def move_song(song_id, from_album_id, to_album_id=None):
+    """
+    Moves a song's counts from one album's entries to another's, or only
+    takes them out of the first when to_album_id is None (the song is being
+    deleted).
+    """
+    album_deltas = defaultdict(lambda: [0, Decimal('0.0')])
+    for window, count, total in SongChartEntry.objects.filter(song_id=song_id).values_list(
+        'window', 'rating_count', 'stars_sum'
+    ):
+        for album_id, sign in ((from_album_id, -1), (to_album_id, 1)):
+            if album_id is not None:
+                entry = album_deltas[(album_id, window)]
+                entry[0] += sign * count
+                entry[1] += sign * total
+    _apply(AlbumChartEntry, 'album', album_deltas)
+
+
+# --- Reading ---
+
+def top_entries(model, window, by, limit, min_votes=None):
+    """The window's top entries of model, best first, by average (with min_votes) or by volume."""
+    entries = model.objects.filter(window=window).annotate(
+        average_stars=Cast('stars_sum', FloatField()) / F('rating_count')
+    )
+    if by == 'average':
+        min_votes = get_min_votes() if min_votes is None else min_votes
+        entries = entries.filter(rating_count__gte=min_votes).order_by('-average_stars', '-rating_count', 'pk')
+    else:
+        entries = entries.order_by('-rating_count', '-average_stars', 'pk')
+    return entries[:limit]
+
+
+def song_chart(window, by, limit):
+    entries = top_entries(SongChartEntry, window, by, limit).select_related('song__album').only(
+        'rating_count', 'stars_sum', 'song__id', 'song__title', 'song__album__id', 'song__album__title',
+        'song__album__artist_name'
+    )
+    return [
+        {
+            'rank': rank, 'id': entry.song.pk, 'title': entry.song.title,
+            'album': entry.song.album.pk, 'album_title': entry.song.album.title,
+            'artist_name': entry.song.album.artist_name,
+            'rating_count': entry.rating_count, 'average': entry.average_stars,
+        }
+        for rank, entry in enumerate(entries, 1)
+    ]
+
+
+def album_chart(window, by, limit):
+    entries = top_entries(AlbumChartEntry, window, by, limit).select_related('album').only(
+        'rating_count', 'stars_sum', 'album__id', 'album__title', 'album__artist_name'
+    )
+    return [
+        {
+            'rank': rank, 'id': entry.album.pk, 'title': entry.album.title, 'artist_name': entry.album.artist_name,
+            'rating_count': entry.rating_count, 'average': entry.average_stars,
+        }
+        for rank, entry in enumerate(entries, 1)
+    ]
+
+
+CHARTS = {'songs': song_chart, 'albums': album_chart}
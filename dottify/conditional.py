@@ -0,0 +1,130 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.translation import get_language
+
+from .models import Album, Playlist, Song
+
+
+class Validators:
+    """The ETag and Last-Modified time a response would carry."""
+
+    def __init__(self, etag, last_modified=None):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def not_modified(self, request):
+        """A 304 when the client's copy is still current, otherwise None."""
+        timestamp = int(self.last_modified.timestamp()) if self.last_modified else None
+        response = get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+        if response is not None:
+            self.apply(response)
+        return response
+
+    def apply(self, response):
+        response.headers['ETag'] = self.etag
+        if self.last_modified is not None:
+            response.headers['Last-Modified'] = http_date(self.last_modified.timestamp())
+        return response
+
+
+def build_etag(*parts):
+    """A strong ETag from whatever the representation depends on."""
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'"{digest}"'
+
+
+def representation_parts(request):
+    """
+    What varies a response besides the rows themselves: the URL (cursors, page
+    sizes, filters) and the negotiated format.
+    """
+    django_request = getattr(request, '_request', request)
+    renderer = getattr(request, 'accepted_renderer', None)
+    return (django_request.get_full_path(), getattr(renderer, 'format', None), get_language())
+
+
+def page_parts(request):
+    """
+    HTML pages also show who is logged in and carry a CSRF token, so the
+    same page differs per user and per CSRF secret.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return (*representation_parts(request), request.user.pk, csrf_cookie)
+
+
+# --- Version lookups, one small query each ---
+
+def album_validators(pk, *extra):
+    row = Album.objects.filter(pk=pk).values_list('version', 'updated_at').first()
+    if row is None:
+        return None
+    return Validators(build_etag('album', pk, row[0], *extra), row[1])
+
+
+def song_validators(pk, *extra):
+    row = Song.objects.filter(pk=pk).values_list('version', 'updated_at').first()
+    if row is None:
+        return None
+    # The recent average moves as the window rolls over, without any write
+    return Validators(build_etag('song', pk, row[0], timezone.localdate(), *extra))
+
+
+def playlist_validators(pk, *extra):
+    row = Playlist.objects.filter(pk=pk, visibility=Playlist.Visibility.PUBLIC).values_list(
+        'version', 'updated_at'
+    ).first()
+    if row is None:
+        return None
+    return Validators(build_etag('playlist', pk, row[0], *extra), row[1])
+
+
+def collection_validators(queryset, *extra):
+    """
+    Validators for a listing of versioned rows. Adding, removing or editing any
+    row changes the count, the version sum or the latest modification time.
+    """
+    summary = queryset.order_by().aggregate(
+        count=Count('pk'), versions=Sum('version'), last_modified=Max('updated_at')
+    )
+    etag = build_etag(queryset.model._meta.label, summary['count'], summary['versions'],
+                      summary['last_modified'], *extra)
+    return Validators(etag, summary['last_modified'])
+
+
+class ConditionalGetMixin:
+    """
+    For API viewsets: answers GET retrieve/list with a 304 from a version lookup,
+    before any row is loaded or serialised, when the client's copy is current.
+    """
+
+    def get_object_validators(self):
+        """Validators for the object being retrieved, or None to skip the check."""
+        return None
+
+    def get_list_validators(self):
+        # Only worth it for listings whose summary query stays cheap
+        return None
+
+    def _conditional(self, validators, handler, request, *args, **kwargs):
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        response = handler(request, *args, **kwargs)
+        # Validators are read before the body, so a concurrent write can only
+        # make the client fetch again, never keep a stale copy
+        if response.status_code == 200:
+            validators.apply(response)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(self.get_object_validators(), super().retrieve, request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(self.get_list_validators(), super().list, request, *args, **kwargs)
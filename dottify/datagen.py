@@ -0,0 +1,259 @@
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .identity import ADMIN_GROUP, ARTIST_GROUP
+from .models import Album, Comment, DottifyUser, Playlist, Rating, Song
+from .signals import after_bulk_insert
+from .utils import chunks
+
+# Rows generated per unit of scale; --scale 20000 gives a million users
+PER_SCALE = {
+    'users': 50,
+    'albums': 20,
+    'playlists': 30,
+    'ratings': 1000,
+    'comments': 200,
+}
+
+# Average sizes, independent of scale
+SONGS_PER_ALBUM = 10
+SONGS_PER_PLAYLIST = 15
+
+# Every generated account shares this password
+PASSWORD = 'password'
+
+# Song and album popularity follow Zipf's law with this exponent
+ZIPF_EXPONENT = 1.1
+
+# Share of ratings that arrive in bursts (a release, a viral moment)
+BURST_SHARE = 0.3
+
+# How far back ratings, playlists and comments are spread
+HISTORY_DAYS = 365
+
+WORDS = (
+    'midnight', 'echo', 'river', 'neon', 'velvet', 'static', 'golden', 'hollow', 'summer', 'signal',
+    'paper', 'glass', 'wild', 'electric', 'silent', 'ocean', 'broken', 'crimson', 'northern', 'fading',
+)
+
+# Star values and how often listeners give them
+STARS = [Decimal(value) / 2 for value in range(0, 11)]
+STAR_WEIGHTS = (1, 1, 2, 2, 3, 5, 8, 12, 14, 10, 7)
+
+
+def zipf_cum_weights(count, exponent=ZIPF_EXPONENT):
+    """Cumulative weights for random.choices: rank r is picked with weight 1/r^exponent."""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class DatasetGenerator:
+    """
+    Builds a deterministic catalogue: the same scale, seed and anchor date
+    always give the same rows. Rows are generated lazily and inserted with
+    bulk_create, one transaction per batch, bypassing Song.save(); the derived
+    data the signals would maintain is updated per batch by after_bulk_insert.
+
+    Popularity is skewed: songs and albums are drawn from a Zipf distribution,
+    and a share of the ratings arrive in bursts on a few days.
+    """
+
+    def __init__(self, scale=1, seed=0, batch_size=1000, anchor=None, log=None):
+        self.scale = scale
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.anchor = anchor or timezone.localdate()
+        self.log = log or (lambda message: None)
+
+    def count(self, name):
+        return max(1, int(PER_SCALE[name] * self.scale))
+
+    def title(self, words=2):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words)).title()
+
+    def moment(self, days_ago, spread_hours=24):
+        """An aware datetime days_ago days before the anchor, at a random time."""
+        start = timezone.make_aware(datetime.combine(self.anchor - timedelta(days=days_ago), time()))
+        return start + timedelta(seconds=self.random.randrange(spread_hours * 3600))
+
+    def insert(self, model, rows, label=None, keep=()):
+        """
+        Bulk inserts rows batch by batch. Returns the primary keys, in order.
+        keep names auto_now(_add) fields whose generated values are written
+        back after the insert, which would otherwise have stamped them now.
+        """
+        pks = []
+        for batch in chunks(rows, self.batch_size):
+            chosen = [[getattr(obj, name) for name in keep] for obj in batch]
+            with transaction.atomic():
+                created = model.objects.bulk_create(batch)
+                if keep:
+                    for obj, values in zip(created, chosen):
+                        for name, value in zip(keep, values):
+                            setattr(obj, name, value)
+                    model.objects.bulk_update(created, keep)
+                after_bulk_insert(model, created)
+            pks += [obj.pk for obj in created]
+            self.log(f'{label or model._meta.verbose_name_plural}: {len(pks)}')
+        return pks
+
+    def generate(self):
+        """Inserts the dataset and returns the number of rows created per model."""
+        counts = {}
+        profiles = self.create_users()
+        counts['users'] = len(profiles)
+        albums = self.create_albums()
+        counts['albums'] = len(albums)
+        songs = self.create_songs(albums)
+        counts['songs'] = len(songs)
+
+        # Popularity ranks are shuffled so hits are spread over the catalogue
+        self.popular_songs = self.random.sample(songs, len(songs))
+        self.song_weights = zipf_cum_weights(len(songs))
+        self.popular_albums = self.random.sample(albums, len(albums))
+        self.album_weights = zipf_cum_weights(len(albums))
+
+        counts['playlists'], counts['playlist_songs'] = self.create_playlists(profiles)
+        counts['ratings'] = self.create_ratings()
+        counts['comments'] = self.create_comments(profiles)
+        return counts
+
+    def pick_song(self):
+        return self.random.choices(self.popular_songs, cum_weights=self.song_weights)[0]
+
+    def pick_album(self):
+        return self.random.choices(self.popular_albums, cum_weights=self.album_weights)[0]
+
+    # --- Rows ---
+
+    def username(self, index):
+        return f'seed{self.seed}-{index}'
+
+    def create_users(self):
+        """Returns [(profile id, user id, display name)] of the created accounts."""
+        # Hashing is deliberately slow, so every account shares one hash
+        password = make_password(PASSWORD)
+        user_ids = self.insert(User, (
+            User(username=self.username(index), password=password) for index in range(self.count('users'))
+        ))
+        profile_ids = self.insert(DottifyUser, (
+            DottifyUser(user_id=user_id, display_name=f'User {self.seed}-{index}')
+            for index, user_id in enumerate(user_ids)
+        ))
+        profiles = [
+            (profile_id, user_id, f'User {self.seed}-{index}')
+            for index, (profile_id, user_id) in enumerate(zip(profile_ids, user_ids))
+        ]
+
+        # The first account administers; roughly one in five of the rest is an artist
+        admin_group, _created = Group.objects.get_or_create(name=str(ADMIN_GROUP))
+        artist_group, _created = Group.objects.get_or_create(name=str(ARTIST_GROUP))
+        artist_flags = [self.random.random() < 0.2 for _ in profiles[1:]]
+        self.artists = [profile for profile, is_artist in zip(profiles[1:], artist_flags) if is_artist]
+        self.artists = self.artists or profiles[:1]
+        memberships = [User.groups.through(user_id=user_ids[0], group_id=admin_group.pk)]
+        memberships += (
+            User.groups.through(user_id=user_id, group_id=artist_group.pk)
+            for _profile_id, user_id, _name in self.artists
+        )
+        self.insert(User.groups.through, memberships, 'group memberships')
+        return profiles
+
+    def create_albums(self):
+        def rows():
+            for index in range(self.count('albums')):
+                profile_id, _user_id, display_name = self.random.choice(self.artists)
+                title = f'{self.title()} {index}'
+                yield Album(
+                    title=title,
+                    slug=slugify(title),
+                    artist_name=display_name,
+                    artist_account_id=profile_id,
+                    format=self.random.choice(Album.Format.values),
+                    retail_price=Decimal(self.random.randint(100, 2999)) / 100,
+                    release_date=date(2000, 1, 1) + timedelta(days=self.random.randint(0, 9000)),
+                    cover_image=None,
+                )
+        return self.insert(Album, rows())
+
+    def create_songs(self, album_ids):
+        # Positions are numbered here rather than looked up per row by Song.save()
+        def rows():
+            for album_id in album_ids:
+                tracks = self.random.randint(SONGS_PER_ALBUM // 2, SONGS_PER_ALBUM + SONGS_PER_ALBUM // 2)
+                for position in range(1, tracks + 1):
+                    yield Song(
+                        album_id=album_id, title=f'{self.title(3)} {position}',
+                        length=self.random.randint(60, 600), position=position
+                    )
+        return self.insert(Song, rows())
+
+    def create_playlists(self, profiles):
+        def rows():
+            for _ in range(self.count('playlists')):
+                yield Playlist(
+                    name=self.title(), owner_id=self.random.choice(profiles)[0],
+                    visibility=self.random.choice(Playlist.Visibility.values),
+                    created_at=self.moment(self.random.randrange(HISTORY_DAYS)),
+                )
+
+        playlist_ids = self.insert(Playlist, rows(), keep=['created_at'])
+
+        def memberships():
+            for playlist_id in playlist_ids:
+                size = min(len(self.popular_songs), self.random.randint(1, SONGS_PER_PLAYLIST * 2))
+                chosen = set()
+                # Popular songs repeat; give up on duplicates after a few draws
+                for _ in range(size * 3):
+                    chosen.add(self.pick_song())
+                    if len(chosen) == size:
+                        break
+                for song_id in sorted(chosen):
+                    yield Playlist.songs.through(playlist_id=playlist_id, song_id=song_id)
+
+        return len(playlist_ids), len(self.insert(Playlist.songs.through, memberships(), 'playlist songs'))
+
+    def ratings(self):
+        """Single ratings spread over the history, interleaved with bursts on one song."""
+        remaining = self.count('ratings')
+        while remaining > 0:
+            if self.random.random() < BURST_SHARE:
+                song_id = self.pick_song()
+                days_ago = self.random.randrange(HISTORY_DAYS)
+                # A burst leans towards one opinion
+                bias = self.random.choice((STAR_WEIGHTS, STAR_WEIGHTS[::-1]))
+                size = min(remaining, self.random.randint(20, 200))
+                for _ in range(size):
+                    yield Rating(
+                        song_id=song_id, stars=self.random.choices(STARS, bias)[0],
+                        created_at=self.moment(days_ago, spread_hours=48)
+                    )
+                remaining -= size
+            else:
+                yield Rating(
+                    song_id=self.pick_song(), stars=self.random.choices(STARS, STAR_WEIGHTS)[0],
+                    created_at=self.moment(self.random.randrange(HISTORY_DAYS))
+                )
+                remaining -= 1
+
+    def create_ratings(self):
+        return len(self.insert(Rating, self.ratings(), keep=['created_at']))
+
+    def create_comments(self, profiles):
+        def rows():
+            for _ in range(self.count('comments')):
+                yield Comment(
+                    album_id=self.pick_album(), user_id=self.random.choice(profiles)[1],
+                    comment_text=f'{self.title(4)}!',
+                    created_at=self.moment(self.random.randrange(HISTORY_DAYS)),
+                )
+
+        return len(self.insert(Comment, rows(), keep=['created_at']))
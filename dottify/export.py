@@ -0,0 +1,165 @@
+# Streaming catalogue export for partners, at /api/export/albums/ and
+# /api/export/playlists/, as NDJSON (the default) or CSV (?format=csv).
+#
+# Parents and children are read with two ordered iterator() queries and
+# joined in a single merge pass, so however large the catalogue, only one
+# chunk of each is held in memory and no query runs per album or playlist.
+
+import csv
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import require_safe
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Album, Playlist, Song
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def get_chunk_size():
+    return getattr(settings, 'DOTTIFY_EXPORT_CHUNK_SIZE', 2000)
+
+
+def merge_join(parents, children):
+    """
+    Pairs each parent row with its child rows, given parents sorted by their
+    key (first column) and children by their parent's key (first column).
+    Yields (parent, [child, ...]); children without a parent are dropped.
+    """
+    children = iter(children)
+    child = next(children, None)
+    for parent in parents:
+        group = []
+        while child is not None and child[0] < parent[0]:
+            child = next(children, None)
+        while child is not None and child[0] == parent[0]:
+            group.append(child)
+            child = next(children, None)
+        yield parent, group
+
+
+# --- Rows ---
+
+ALBUM_FIELDS = ('id', 'title', 'artist_name', 'format', 'release_date', 'retail_price', 'slug')
+TRACK_FIELDS = ('id', 'title', 'length', 'position')
+
+
+def albums_with_tracks():
+    """(album values, [track values, ...]) for every album, by id."""
+    chunk_size = get_chunk_size()
+    albums = Album.objects.order_by('pk').values_list(*ALBUM_FIELDS).iterator(chunk_size=chunk_size)
+    tracks = (
+        Song.objects.order_by('album_id', 'position', 'pk')
+        .values_list('album_id', *TRACK_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    for album, album_tracks in merge_join(albums, tracks):
+        yield album, [track[1:] for track in album_tracks]
+
+
+PLAYLIST_FIELDS = ('id', 'name', 'created_at', 'owner__display_name')
+
+
+def public_playlists_with_songs():
+    """(playlist values, [song id, ...]) for every public playlist, by id."""
+    chunk_size = get_chunk_size()
+    public = Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC)
+    playlists = public.order_by('pk').values_list(*PLAYLIST_FIELDS).iterator(chunk_size=chunk_size)
+    memberships = (
+        Playlist.songs.through.objects
+        .filter(playlist__in=public)
+        .order_by('playlist_id', 'pk')
+        .values_list('playlist_id', 'song_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    for playlist, songs in merge_join(playlists, memberships):
+        yield playlist, [song_id for _playlist_id, song_id in songs]
+
+
+# --- Encodings ---
+
+def album_document(album, tracks):
+    document = dict(zip(ALBUM_FIELDS, album))
+    # As the API serialises prices
+    document['retail_price'] = str(document['retail_price'])
+    document['tracks'] = [dict(zip(TRACK_FIELDS, track)) for track in tracks]
+    return document
+
+
+def playlist_document(playlist, song_ids):
+    playlist_id, name, created_at, owner = playlist
+    return {'id': playlist_id, 'name': name, 'created_at': created_at, 'owner': owner, 'songs': song_ids}
+
+
+def album_csv_rows(albums):
+    """One row per track; albums without tracks get one row with the track columns empty."""
+    yield [*ALBUM_FIELDS, *(f'track_{name}' for name in TRACK_FIELDS)]
+    for album, tracks in albums:
+        for track in tracks or [('',) * len(TRACK_FIELDS)]:
+            yield [*album, *track]
+
+
+def playlist_csv_rows(playlists):
+    """One row per playlist, its song ids separated by spaces."""
+    yield ['id', 'name', 'created_at', 'owner', 'song_ids']
+    for playlist, song_ids in playlists:
+        yield [*playlist, ' '.join(map(str, song_ids))]
+
+
+class Echo:
+    """A file-like object csv.writer can write a single row to and hand back."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(documents):
+    encoder = JSONEncoder(ensure_ascii=False)
+    for document in documents:
+        yield encoder.encode(document) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORTS = {
+    'albums': (albums_with_tracks, album_document, album_csv_rows),
+    'playlists': (public_playlists_with_songs, playlist_document, playlist_csv_rows),
+}
+
+
+def export_response(request, name):
+    rows, to_document, to_csv_rows = EXPORTS[name]
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in FORMATS:
+        return JsonResponse(
+            {'detail': _('Unsupported export format; use one of: %(formats)s.') % {'formats': ', '.join(FORMATS)}},
+            status=400
+        )
+
+    if export_format == 'csv':
+        lines = csv_lines(to_csv_rows(rows()))
+    else:
+        lines = ndjson_lines(to_document(*row) for row in rows())
+
+    response = StreamingHttpResponse(lines, content_type=FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+    return response
+
+
+@require_safe
+def album_export(request):
+    return export_response(request, 'albums')
+
+
+@require_safe
+def playlist_export(request):
+    return export_response(request, 'playlists')
@@ -0,0 +1,33 @@
+from rest_framework import filters
+from rest_framework.settings import api_settings
+from django.utils.translation import gettext_lazy as _
+
+from . import search
+
+
+class FullTextSearchFilter(filters.BaseFilterBackend):
+    """
+    ?search= over album titles, artist names and track titles using the FTS5 index.
+    Results keep the view's keyset order (by id) so they can be paginated: the
+    FTS5 rank differs per query, so it can't be part of a stable cursor. The
+    HTML search page (search.search_albums) is the one ordered by rank.
+    """
+    search_param = api_settings.SEARCH_PARAM
+    search_description = _(
+        'Prefix match on album titles, artist names and track titles. Matches are returned in id order, not by rank.'
+    )
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').strip()
+        if not text:
+            return queryset
+        return search.filter_albums(queryset, text)
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': str(self.search_description),
+            'schema': {'type': 'string'},
+        }]
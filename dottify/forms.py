@@ -1,6 +1,5 @@
 from django import forms
-from django.utils.translation import gettext_lazy as _
-from .models import Album, Song, DottifyUser
+from .models import Album, Song
 
 
 # --- Album Form (For Routes 3 and 5) ---
@@ -26,21 +25,18 @@ class SongForm(forms.ModelForm):
         fields = ['album', 'title', 'length']
 
     def __init__(self, *args, **kwargs):
-        self.user = kwargs.pop('user', None)
+        self.identity = kwargs.pop('identity', None)
         super().__init__(*args, **kwargs)
 
         # Filters albums based on user’s permissions
-        if self.user:
-            is_artist = self.user.groups.filter(name=_('Artist')).exists()
-            is_admin = self.user.groups.filter(name=_('DottifyAdmin')).exists()
-
-            if is_artist:
-                try:
-                    dottify_user = DottifyUser.objects.get(user=self.user)
+        if self.identity:
+            if self.identity.is_artist:
+                dottify_user = self.identity.profile
+                if dottify_user is not None:
                     self.fields['album'].queryset = Album.objects.filter(artist_account=dottify_user)
-                except DottifyUser.DoesNotExist:
+                else:
                     # If the user is an artist but has no profile, show no albums
                     self.fields['album'].queryset = Album.objects.none()
-            elif not is_admin:
+            elif not self.identity.is_admin:
                 # Should not be possible but as a fall case
                 self.fields['album'].queryset = Album.objects.none()
@@ -0,0 +1,64 @@
+import hashlib
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'DOTTIFY_FRAGMENT_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'DOTTIFY_FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def fragment_key(album, name, variant=''):
+    """
+    Keys include the album's version, which Song and Comment changes bump, so
+    an edit makes only that album's entries unreachable. The modification time
+    guards against a reused primary key meeting an old entry.
+    """
+    variant = hashlib.md5(
+        f'{album.updated_at.isoformat()}:{get_language()}:{variant}'.encode(), usedforsecurity=False
+    ).hexdigest()
+    return f'dottify:fragment:album:{album.pk}:{album.version}:{name}:{variant}'
+
+
+def _count(outcome):
+    with _lock:
+        _counters[outcome] += 1
+
+
+def get_counters():
+    """Hits and misses counted by this process since start (or the last reset)."""
+    with _lock:
+        return {'hits': _counters['hits'], 'misses': _counters['misses']}
+
+
+def reset_counters():
+    with _lock:
+        _counters.clear()
+
+
+def album_fragment(album, name, render, variant=''):
+    """
+    The cached HTML of one album page fragment, calling render() (which
+    returns a string) only on a miss.
+    """
+    cache = get_cache()
+    key = fragment_key(album, name, variant)
+    html = cache.get(key)
+    if html is None:
+        _count('misses')
+        html = str(render())
+        cache.set(key, html, get_timeout())
+    else:
+        _count('hits')
+    return mark_safe(html)
@@ -0,0 +1,147 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from .models import DottifyUser
+
+SESSION_KEY = '_dottify_identity'
+
+ADMIN_GROUP = _('DottifyAdmin')
+ARTIST_GROUP = _('Artist')
+
+
+class Identity:
+    """
+    Who is making the request: the auth user, their DottifyUser profile
+    (or None) and the names of their groups, resolved once per request.
+    """
+
+    def __init__(self, user, profile=None, group_names=()):
+        self.user = user
+        self.profile = profile
+        self.group_names = frozenset(group_names)
+
+    @property
+    def user_id(self):
+        return self.user.pk if self.user.is_authenticated else None
+
+    def in_group(self, name):
+        # Group names are stored translated, as the checks always compared them
+        return str(name) in self.group_names
+
+    @property
+    def is_admin(self):
+        return self.in_group(ADMIN_GROUP)
+
+    @property
+    def is_artist(self):
+        return self.in_group(ARTIST_GROUP)
+
+    def to_session(self, version):
+        profile = [self.profile.pk, self.profile.display_name] if self.profile else None
+        return {
+            'user_id': self.user_id,
+            'version': version,
+            'profile': profile,
+            'groups': sorted(self.group_names),
+        }
+
+    @classmethod
+    def from_session(cls, user, data):
+        profile = _build_profile(user, *data['profile']) if data['profile'] else None
+        return cls(user, profile, data['groups'])
+
+
+def _build_profile(user, profile_id, display_name):
+    """A DottifyUser instance from already known values, without a query."""
+    profile = DottifyUser.from_db(
+        DottifyUser.objects.db, ['id', 'user_id', 'display_name'], [profile_id, user.pk, display_name]
+    )
+    profile.user = user
+    return profile
+
+
+def load_identity(user):
+    """Reads the profile and all group names of user in a single query."""
+    if not user.is_authenticated:
+        return Identity(user)
+
+    rows = User.objects.filter(pk=user.pk).values_list(
+        'dottify_profile__id', 'dottify_profile__display_name', 'groups__name'
+    )
+    profile = None
+    group_names = set()
+    for profile_id, display_name, group_name in rows:
+        if profile_id is not None and profile is None:
+            profile = _build_profile(user, profile_id, display_name)
+        if group_name is not None:
+            group_names.add(group_name)
+    return Identity(user, profile, group_names)
+
+
+# --- Session caching ---
+# Each user has a version token in the cache; changing their groups or profile
+# replaces it, which makes every session copy of their identity stale.
+#
+# Tokens expire after DOTTIFY_IDENTITY_MAX_AGE seconds. With a shared cache an
+# invalidation reaches every worker at once; with a per-process one (the
+# LocMemCache default) other workers only pick up the change once their own
+# token expires, so the timeout bounds how long revoked roles can linger.
+
+def _max_age():
+    return getattr(settings, 'DOTTIFY_IDENTITY_MAX_AGE', 60)
+
+
+def _version_key(user_id):
+    return f'dottify:identity-version:{user_id}'
+
+
+def current_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, _max_age())
+        version = cache.get(key)
+    return version
+
+
+def invalidate_identity(*user_ids):
+    keys = [_version_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # Requests in between may have cached the old roles under a fresh token
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def resolve_identity(request):
+    """The identity for request.user, from the session when it is still current."""
+    user = request.user
+    if not user.is_authenticated:
+        return Identity(user)
+
+    session = getattr(request, 'session', None)
+    version = current_version(user.pk)
+    cached = session.get(SESSION_KEY) if session is not None else None
+    if cached and cached['user_id'] == user.pk and cached['version'] == version:
+        return Identity.from_session(user, cached)
+
+    identity = load_identity(user)
+    if session is not None:
+        session[SESSION_KEY] = identity.to_session(version)
+    return identity
+
+
+def get_identity(request):
+    """
+    The request's identity as set up by IdentityMiddleware. Works with DRF
+    requests too, whose user may come from a different authenticator.
+    """
+    django_request = getattr(request, '_request', request)
+    identity = getattr(django_request, 'identity', None)
+    if identity is None or identity.user_id != getattr(request.user, 'pk', None):
+        identity = load_identity(request.user)
+        django_request.identity = identity
+    return identity
@@ -0,0 +1,123 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Album
+
+logger = logging.getLogger(__name__)
+
+# Widths the templates and API offer in srcset
+COVER_WIDTHS = (160, 320, 640)
+
+# srcset key -> (Pillow format, file extension, save options)
+COVER_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def variant_name(source_name, width, extension):
+    """Variants sit next to the original: covers/a.png -> covers/a.320w.webp"""
+    stem, _ext = os.path.splitext(source_name)
+    return f'{stem}.{width}w.{extension}'
+
+
+def has_own_cover(cover_name):
+    """Whether a cover gets variants: it is set and isn't the shared default one."""
+    return bool(cover_name) and cover_name != Album._meta.get_field('cover_image').default
+
+
+def _render(image, width, pillow_format, options):
+    resized = image.copy()
+    resized.thumbnail((width, width * 10), Image.Resampling.LANCZOS)
+    if pillow_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+        resized = resized.convert('RGB')
+    buffer = BytesIO()
+    resized.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def generate_cover_variants(album_id, force=False):
+    """
+    Writes the resized WebP/JPEG copies of an album's cover and records them on
+    the album. Existing files are reused unless force is set, so albums that
+    share a cover (e.g. the default one) only render it once.
+    """
+    album = Album.objects.filter(pk=album_id).only('id', 'cover_image').first()
+    if album is None:
+        return None
+    if not album.cover_image:
+        Album.objects.filter(pk=album_id).update(
+            cover_variants={}, version=F('version') + 1, updated_at=timezone.now()
+        )
+        return {}
+
+    source_name = album.cover_image.name
+    storage = album.cover_image.storage
+    with storage.open(source_name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+
+    # Never upscale; a small cover just gets fewer variants
+    widths = [width for width in COVER_WIDTHS if width < image.width] or [image.width]
+
+    variants = {'source': source_name}
+    for key, (pillow_format, extension, options) in COVER_FORMATS.items():
+        variants[key] = []
+        for width in widths:
+            name = variant_name(source_name, width, extension)
+            if force or not storage.exists(name):
+                if storage.exists(name):
+                    storage.delete(name)
+                name = storage.save(name, ContentFile(_render(image, width, pillow_format, options)))
+            variants[key].append([width, name])
+
+    # Only record them if the cover hasn't been replaced in the meantime
+    Album.objects.filter(pk=album_id, cover_image=source_name).update(
+        cover_variants=variants, version=F('version') + 1, updated_at=timezone.now()
+    )
+    return variants
+
+
+def _generate_in_background(album_id):
+    try:
+        generate_cover_variants(album_id)
+    except Exception:
+        logger.exception('Generating cover variants for album %s failed', album_id)
+    finally:
+        # Worker threads get their own connections; don't leave them open
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'DOTTIFY_COVER_WORKERS', 2),
+            thread_name_prefix='dottify-covers'
+        )
+    return _executor
+
+
+def schedule_cover_variants(album_id):
+    """
+    Generates the variants once the current transaction commits, on a worker
+    thread unless DOTTIFY_COVER_VARIANTS_ASYNC is off.
+    """
+    def run():
+        if getattr(settings, 'DOTTIFY_COVER_VARIANTS_ASYNC', True):
+            _get_executor().submit(_generate_in_background, album_id)
+        else:
+            generate_cover_variants(album_id)
+
+    transaction.on_commit(run)
@@ -0,0 +1,390 @@
+# Bulk import for the data wizard registrations in dottify/wizard.py.
+#
+# data_wizard's own import step validates each row through a serializer and
+# saves it on its own, so every row costs a handful of queries (foreign key
+# lookups, uniqueness checks, Song.save()'s position lookup, the signal
+# receivers). This backend replaces that step: rows are read from the source
+# as they are needed and handled a chunk at a time, with one lookup per chunk
+# for each foreign key and unique constraint and one bulk_create per chunk.
+# The derived data the signals would have maintained is updated per chunk too.
+
+import codecs
+import json
+
+from data_wizard import registry, wizard_task
+from data_wizard.loaders import FileLoader
+from data_wizard.models import Identifier, Record
+from data_wizard.signals import import_complete
+from data_wizard.tasks import get_columns, import_data, save_value
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import Max
+from django.utils.text import slugify
+from html_json_forms import parse_json_form
+from itertable import CsvFileIter
+from itertable.util import guess_type
+
+from .models import Album, Comment, DottifyUser, Rating, Song
+from .signals import after_bulk_insert
+from .utils import chunks
+
+# The steps of an automatic import, with data_wizard's import step swapped for ours
+BULK_IMPORT_TASKS = (
+    'data_wizard.tasks.check_serializer',
+    'data_wizard.tasks.check_iter',
+    'data_wizard.tasks.check_columns',
+    'data_wizard.tasks.check_row_identifiers',
+    'dottify.importer.bulk_import_data',
+)
+
+
+def get_chunk_size():
+    return getattr(settings, 'DOTTIFY_IMPORT_CHUNK_SIZE', 500)
+
+
+class StreamingCsvFileIter(CsvFileIter):
+    """
+    itertable's CSV table, but reading rows as they are iterated rather than
+    all at once when the file is opened. Can only be iterated once.
+    """
+
+    def refresh(self):
+        # BaseIter.refresh() would close the file as soon as it was parsed
+        if not self.parsed:
+            self.parse()
+            self.parsed = True
+
+    def parse(self):
+        # As CsvParser.parse(), minus reading every row into a list
+        self.start_row = 1 if self.start_row is None else self.start_row
+        self.header_row = 0 if self.header_row is None else self.header_row
+        self.csvdata = self.reader_class()(self.file, None, delimiter=self.delimiter, quotechar=self.quotechar)
+        self.field_names = self.csvdata.fieldnames
+        self.header_row = self.csvdata.header_row
+        self.data = self.csvdata
+        self.extra_data = {}
+
+
+def stream_table(run):
+    """A streaming table for a run's CSV file, or None for other sources."""
+    Loader = registry.get_loader(run.loader)
+    if not issubclass(Loader, FileLoader):
+        return None
+    loader = Loader(run)
+    file = getattr(loader.content_object, loader.file_attr)
+    if guess_type(file.name) != 'text/csv':
+        return None
+    # Reopened, as earlier steps closed it; decoded as itertable.load_file does, a line at a time
+    text = codecs.getreader('utf-8')(file.open('rb'))
+    return StreamingCsvFileIter(filename=file.name, file=text, loaded=True, **loader.load_iter_options())
+
+
+def iter_records(run):
+    """
+    data_wizard.tasks.get_rows(), with the mapped identifiers of lookup
+    columns loaded up front instead of queried for every row.
+    """
+    table = run.load_iter()
+    matched = get_columns(run)
+
+    run_globals = {}
+    for col in matched:
+        if 'meta_value' in col:
+            save_value(col, col['meta_value'], run_globals)
+
+    meta_fields = {col['field_name'] for col in matched if col['type'] == 'meta'}
+    mapped = {}
+    identifiers = Identifier.objects.filter(
+        serializer=run.serializer, field__in=meta_fields
+    ).exclude(value=None).exclude(value='').order_by('pk')
+    for name, value in identifiers.values_list('name', 'value'):
+        mapped.setdefault(name.lower(), value)
+
+    for row in table:
+        record = dict(run_globals)
+        for col in matched:
+            if 'colnum' in col and 'meta_value' not in col:
+                save_value(col, row[col['colnum']], record)
+        for field_name in meta_fields:
+            value = mapped.get(str(record.get(field_name)).lower())
+            if value:
+                record[field_name] = value
+        record.pop('_attr_index', None)
+        yield parse_json_form(record)
+
+
+# --- Per-model importers ---
+
+class BulkImporter:
+    """
+    Turns chunks of data wizard records into saved rows of one model. Rows
+    are validated with the model's field validators, not a serializer, so
+    validating a chunk runs no queries besides the batch lookups.
+    """
+    model = None
+
+    # Foreign keys given by primary key: field name -> related model
+    relations = {}
+
+    # Field groups that must be unique together; duplicates are skipped
+    unique_together = ()
+
+    # Fields set by before_insert() rather than read from the source
+    computed_fields = ()
+
+    def __init__(self):
+        self.fields = [
+            field for field in self.model._meta.concrete_fields
+            if field.editable and not field.primary_key
+            and field.name not in self.relations and field.name not in self.computed_fields
+        ]
+
+    def build(self, record):
+        """An unsaved instance from one record. Raises ValidationError."""
+        instance = self.model()
+        for field in self.fields:
+            value = record.get(field.name)
+            if value is None or value == '':
+                if field.name not in record or field.has_default():
+                    continue
+                value = None if field.null else value
+            setattr(instance, field.attname, value)
+        instance.clean_fields(exclude=[*self.relations, *self.computed_fields])
+        return instance
+
+    def resolve_relations(self, records, instances, errors):
+        """Sets each foreign key after one existence query per relation for the chunk."""
+        def reject(index, name, message):
+            errors[index] = {name: [str(message)]}
+            instances[index] = None
+
+        for name, related_model in self.relations.items():
+            field = self.model._meta.get_field(name)
+            values = {}
+            for index, record in enumerate(records):
+                if instances[index] is None:
+                    continue
+                raw = record.get(name)
+                if raw is None or raw == '':
+                    if not field.null:
+                        reject(index, name, field.error_messages['null'])
+                    continue
+                try:
+                    values[index] = related_model._meta.pk.to_python(raw)
+                except ValidationError as exc:
+                    reject(index, name, exc.messages[0])
+
+            existing = set(
+                related_model._default_manager.filter(pk__in=set(values.values())).values_list('pk', flat=True)
+            )
+            for index, value in values.items():
+                if value in existing:
+                    setattr(instances[index], field.attname, value)
+                else:
+                    reject(index, name, field.error_messages['invalid'] % {
+                        'model': related_model._meta.verbose_name, 'field': 'id', 'value': value,
+                    })
+
+    def skip_duplicates(self, instances, errors):
+        """Drops rows clashing with existing rows or earlier rows, one query per constraint."""
+        for group in self.unique_together:
+            attnames = [self.model._meta.get_field(name).attname for name in group]
+            keys = {}
+            for index, instance in enumerate(instances):
+                if instance is not None:
+                    key = tuple(getattr(instance, attname) for attname in attnames)
+                    # NULLs never clash in a unique constraint
+                    if None not in key:
+                        keys[index] = key
+
+            taken = set(
+                self.model._default_manager
+                .filter(**{f'{attnames[0]}__in': {key[0] for key in keys.values()}})
+                .order_by()
+                .values_list(*attnames)
+            )
+            for index, key in keys.items():
+                if key in taken:
+                    error = instances[index].unique_error_message(self.model, group)
+                    errors[index] = {NON_FIELD_ERRORS: error.messages}
+                    instances[index] = None
+                taken.add(key)
+
+    def before_insert(self, instances):
+        """Fills in computed_fields."""
+
+    def after_insert(self, instances):
+        """Updates what the skipped signal receivers would have; see signals.after_bulk_insert."""
+        after_bulk_insert(self.model, instances)
+
+    def insert(self, instances):
+        """Saves instances with one bulk_create, in a transaction that is rolled back if it fails."""
+        try:
+            with transaction.atomic():
+                self.before_insert(instances)
+                self.model._default_manager.bulk_create(instances)
+                self.after_insert(instances)
+        except DatabaseError:
+            # bulk_create may have numbered some of them before the rollback
+            for instance in instances:
+                instance.pk = None
+                instance._state.adding = True
+            raise
+
+    def import_chunk(self, records):
+        """[(instance or None, error or None)] for a chunk of records, in order."""
+        instances, errors = [], {}
+        for index, record in enumerate(records):
+            try:
+                instances.append(self.build(record))
+            except ValidationError as exc:
+                instances.append(None)
+                errors[index] = exc.message_dict
+
+        self.resolve_relations(records, instances, errors)
+        self.skip_duplicates(instances, errors)
+
+        valid = [instance for instance in instances if instance is not None]
+        if valid:
+            try:
+                self.insert(valid)
+            except DatabaseError:
+                # e.g. a row inserted concurrently since the duplicate check;
+                # retry row by row so only the offending rows fail
+                for index, instance in enumerate(instances):
+                    if instance is None:
+                        continue
+                    try:
+                        self.insert([instance])
+                    except DatabaseError as exc:
+                        errors[index] = {NON_FIELD_ERRORS: [str(exc)]}
+                        instances[index] = None
+
+        return [
+            (instance, json.dumps(errors[index]) if index in errors else None)
+            for index, instance in enumerate(instances)
+        ]
+
+
+class DottifyUserImporter(BulkImporter):
+    model = DottifyUser
+    relations = {'user': User}
+    unique_together = (('user',), ('display_name',))
+
+
+class AlbumImporter(BulkImporter):
+    model = Album
+    relations = {'artist_account': DottifyUser}
+    unique_together = (('title', 'artist_name', 'format'),)
+    computed_fields = ('slug',)
+
+    def before_insert(self, instances):
+        # As Album.save() does
+        for album in instances:
+            album.slug = slugify(album.title)
+
+
+class SongImporter(BulkImporter):
+    model = Song
+    relations = {'album': Album}
+    unique_together = (('title', 'album'),)
+
+    def before_insert(self, instances):
+        # Song.save() looks up the last position once per song
+        album_ids = {song.album_id for song in instances}
+        last_positions = dict(
+            Song.objects.filter(album_id__in=album_ids).order_by()
+            .values_list('album_id').annotate(Max('position'))
+        )
+        for song in instances:
+            position = (last_positions.get(song.album_id) or 0) + 1
+            song.position = last_positions[song.album_id] = position
+
+
+class RatingImporter(BulkImporter):
+    model = Rating
+    relations = {'song': Song}
+
+
+class CommentImporter(BulkImporter):
+    model = Comment
+    relations = {'album': Album, 'user': User}
+
+
+IMPORTERS = {
+    importer.model: importer
+    for importer in (DottifyUserImporter, AlbumImporter, SongImporter, RatingImporter, CommentImporter)
+}
+
+
+def _import_chunks(run, importer, first_row, total):
+    """Imports every record of a run; returns (rows read, rows imported, skipped rows)."""
+    content_type = ContentType.objects.get_for_model(importer.model)
+    current, imported, skipped = 0, 0, []
+    for chunk in chunks(enumerate(iter_records(run)), get_chunk_size()):
+        results = importer.import_chunk([record for _index, record in chunk])
+
+        records = []
+        for (index, _record), (instance, error) in zip(chunk, results):
+            row = index + first_row
+            if error:
+                skipped.append({'row': row + 1, 'reason': error})
+            else:
+                imported += 1
+            records.append(Record(
+                run=run, row=row, success=error is None, fail_reason=error,
+                content_type=content_type if instance else None, object_id=instance.pk if instance else None,
+            ))
+        Record.objects.bulk_create(records)
+
+        current += len(chunk)
+        run.send_progress({
+            'message': 'Importing Data...',
+            'stage': 'data',
+            'current': current,
+            'total': total or current,
+            'skipped': skipped,
+        })
+
+    return current, imported, skipped
+
+
+@wizard_task(label='Importing Data...', url_path=False, use_async=True)
+def bulk_import_data(run):
+    """
+    data_wizard.tasks.import_data for dottify models, a chunk of rows at a
+    time. Reports the same progress, records and completion signal.
+    """
+    importer_class = IMPORTERS.get(run.get_serializer().Meta.model)
+    if importer_class is None:
+        return import_data(run)
+    importer = importer_class()
+
+    run.add_event('do_import')
+    table = stream_table(run)
+    if table is not None:
+        run._iter_data = table
+    else:
+        table = run.load_iter()
+
+    # The column step recorded how many data rows the source has
+    total = run.range_set.filter(type='list').values_list('start_row', 'end_row').first()
+    total = total[1] - total[0] + 1 if total else None
+    first_row = table.start_row if table.tabular else 0
+
+    try:
+        current, imported, skipped = _import_chunks(run, importer, first_row, total)
+    finally:
+        if isinstance(table, StreamingCsvFileIter):
+            table.file.close()
+
+    status = {'current': current, 'total': total or current, 'skipped': skipped}
+    run.add_event('import_complete')
+    run.record_count = imported
+    run.save()
+    run.send_progress(status, state='SUCCESS')
+    import_complete.send(sender=import_data, run=run, status=status)
+    return status
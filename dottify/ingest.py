@@ -0,0 +1,227 @@
+# Buffered rating ingestion behind POST /api/ratings/.
+#
+# A burst of ratings (say, after a release) would otherwise be a burst of
+# single-row write transactions, each queuing for SQLite's write lock.
+# Instead, ratings are validated on the request, appended to an in-process
+# buffer and written in batches: one bulk_create plus the aggregate updates,
+# in one transaction, once DOTTIFY_RATING_BUFFER_SIZE ratings are waiting or
+# the oldest has waited DOTTIFY_RATING_BUFFER_DELAY seconds, and at exit.
+#
+# Until its batch is written a rating lives only in this process's memory,
+# so clients are answered 202 Accepted: a crash loses at most the ratings
+# of the last DOTTIFY_RATING_BUFFER_DELAY seconds. Ratings are timestamped
+# when written, as created_at is auto_now_add.
+#
+# A batch that fails to write goes back to the front of the buffer and is
+# retried with exponential backoff; only after DOTTIFY_RATING_BUFFER_RETRIES
+# failed attempts in a row is it dropped, and counted in RatingBuffer.dropped.
+# The buffer holds at most DOTTIFY_RATING_BUFFER_LIMIT ratings: past that,
+# add() raises BufferFull and the API answers 503 Service Unavailable.
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Rating, Song
+from .signals import after_bulk_insert
+
+logger = logging.getLogger(__name__)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_max_size():
+    return getattr(settings, 'DOTTIFY_RATING_BUFFER_SIZE', 200)
+
+
+def get_max_delay():
+    return getattr(settings, 'DOTTIFY_RATING_BUFFER_DELAY', 1.0)
+
+
+def get_max_pending():
+    return getattr(settings, 'DOTTIFY_RATING_BUFFER_LIMIT', 10000)
+
+
+def get_max_retries():
+    return getattr(settings, 'DOTTIFY_RATING_BUFFER_RETRIES', 5)
+
+
+class BufferFull(Exception):
+    """The buffer holds too many unwritten ratings to accept more."""
+
+
+def write_ratings(ratings):
+    """
+    Inserts (song_id, stars) pairs with one bulk_create and updates the rating
+    aggregates in the same transaction. Ratings of songs deleted since they
+    were validated are dropped. Returns the number written.
+    """
+    ratings = list(ratings)
+    with transaction.atomic():
+        song_ids = {song_id for song_id, _stars in ratings}
+        songs = set(Song.objects.filter(pk__in=song_ids).values_list('pk', flat=True))
+        created = Rating.objects.bulk_create(
+            Rating(song_id=song_id, stars=stars) for song_id, stars in ratings if song_id in songs
+        )
+        # bulk_create skips the signals that maintain them
+        after_bulk_insert(Rating, created)
+    return len(created)
+
+
+class RatingBuffer:
+    """
+    Validated (song_id, stars) pairs waiting to be written. With
+    DOTTIFY_RATING_BUFFER_ASYNC on (the default) a daemon thread writes the
+    batches, so requests never wait for the write lock; otherwise the request
+    that fills the buffer, or finds its oldest rating overdue, writes it.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Batches are written one at a time, in the order they were taken
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # Consecutive failed writes, and when the next attempt may be made
+        self._failures = 0
+        self._retry_at = 0.0
+        # Ratings given up on after their batch kept failing
+        self.dropped = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, ratings):
+        """
+        Queues (song_id, stars) pairs for the next batch. Raises BufferFull,
+        queuing none of them, if they would take it past its limit.
+        """
+        ratings = list(ratings)
+        run_async = getattr(settings, 'DOTTIFY_RATING_BUFFER_ASYNC', True)
+        with self._lock:
+            if len(self._pending) + len(ratings) > get_max_pending():
+                raise BufferFull()
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.extend(ratings)
+            if run_async and not self._closed:
+                self._start_writer()
+                self._wakeup.notify()
+                return
+            # Once closed (at exit), nothing else will write them
+            due = self._closed or self._due()
+        if due:
+            self.flush()
+
+    def _due(self):
+        now = time.monotonic()
+        return bool(self._pending) and now >= self._retry_at and (
+            len(self._pending) >= get_max_size() or now - self._oldest >= get_max_delay()
+        )
+
+    def _next_attempt(self):
+        """Seconds until the pending ratings are due, or None when there are none."""
+        if not self._pending:
+            return None
+        due_at = self._oldest + get_max_delay()
+        if len(self._pending) >= get_max_size():
+            due_at = 0.0
+        return max(due_at, self._retry_at) - time.monotonic()
+
+    def flush(self):
+        """Writes everything buffered so far as one batch. Returns the number of ratings written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                written = write_ratings(batch)
+            except Exception:
+                self._failed(batch)
+                return 0
+            with self._lock:
+                self._failures = 0
+                self._retry_at = 0.0
+            return written
+
+    def _failed(self, batch):
+        """Puts a batch that failed to write back in front, or drops it once out of retries."""
+        with self._lock:
+            self._failures += 1
+            if self._failures > get_max_retries():
+                logger.exception(
+                    'Dropping a batch of %d buffered ratings after %d failed writes', len(batch), self._failures
+                )
+                self.dropped += len(batch)
+                self._failures = 0
+                self._retry_at = 0.0
+                return
+            logger.warning(
+                'Writing a batch of %d buffered ratings failed, retrying', len(batch), exc_info=True
+            )
+            if self._pending:
+                batch.extend(self._pending)
+            else:
+                self._oldest = time.monotonic()
+            self._pending = batch
+            self._retry_at = time.monotonic() + get_max_delay() * 2 ** (self._failures - 1)
+
+    def _start_writer(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._write_batches, name='dottify-ratings', daemon=True)
+            self._thread.start()
+
+    def _write_batches(self):
+        try:
+            while True:
+                with self._lock:
+                    while not self._closed and not self._due():
+                        timeout = self._next_attempt()
+                        self._wakeup.wait(None if timeout is None else max(timeout, 0))
+                    if self._closed:
+                        return
+                try:
+                    self.flush()
+                    connections[DEFAULT_DB_ALIAS].close_if_unusable_or_obsolete()
+                except Exception:
+                    # Keep the writer alive for the batches still to come
+                    logger.exception('The rating writer failed')
+        finally:
+            # The writer thread has its own connections
+            connections.close_all()
+
+    def close(self):
+        """Stops the writer thread and writes what is left; later ratings are written as they come."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+        # Failed batches come back until written or dropped, so this ends
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                retry_at = self._retry_at
+            time.sleep(max(retry_at - time.monotonic(), 0))
+            self.flush()
+
+
+def get_buffer():
+    """The process's rating buffer, flushed when the interpreter exits."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = RatingBuffer()
+            atexit.register(_buffer.close)
+        return _buffer
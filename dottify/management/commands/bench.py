@@ -0,0 +1,182 @@
+import json
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.shortcuts import resolve_url
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils.text import slugify
+
+from dottify.datagen import DatasetGenerator
+from dottify.models import Album, Comment, DottifyUser, Playlist, Song
+
+# Which object a path parameter refers to, by the path segment before it
+SEGMENT_MODELS = {
+    'albums': 'album',
+    'songs': 'song',
+    'playlists': 'playlist',
+    'users': 'user',
+    'comments': 'comment',
+}
+
+# Query strings for routes that do nothing useful without one
+QUERY_STRINGS = {
+    'album_search': '?q=midnight',
+}
+
+# Path parameters (<int:pk> or (?P<pk>...)) and the literal segments between them
+TOKEN = re.compile(r'<(?:\w+:)?(?P<route>\w+)>|\(\?P<(?P<regex>\w+)>[^)]*\)|(?P<literal>[\w-]+)')
+
+
+def collect_routes(resolver, prefix=''):
+    """
+    (pattern, name) for every named GET-able route of the project's own URLconf.
+    Included URLconfs of other apps (data wizard, auth) are skipped, as are
+    DRF's format-suffix duplicates.
+    """
+    routes = []
+    for entry in resolver.url_patterns:
+        pattern = prefix + str(entry.pattern).lstrip('^').rstrip('$')
+        if isinstance(entry, URLResolver):
+            if isinstance(entry.urlconf_name, (list, tuple)):
+                routes += collect_routes(entry, pattern)
+        elif isinstance(entry, URLPattern) and entry.name and 'format' not in entry.pattern.regex.groupindex:
+            routes.append((pattern, entry.name))
+    return routes
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every HTML and API route of dottify/urls.py against a generated dataset '
+        'in a temporary test database, reporting p50/p95/p99 latency and query counts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help='Dataset size multiplier (see dottify.datagen)')
+        parser.add_argument('--seed', type=int, default=0, help='Dataset random seed')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per route')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['scale'] <= 0:
+            raise CommandError('--iterations and --scale must be positive')
+
+        verbosity = options['verbosity']
+        old_config = setup_databases(verbosity=max(verbosity - 1, 0), interactive=False)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            counts = DatasetGenerator(scale=options['scale'], seed=options['seed']).generate()
+            results = self.bench_routes(options['iterations'])
+        finally:
+            teardown_databases(old_config, verbosity=max(verbosity - 1, 0))
+
+        report = {
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'iterations': options['iterations'],
+            'dataset': counts,
+            'routes': results,
+        }
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    def sample_objects(self):
+        """Representative rows to fill path parameters with: ones that have children."""
+        album = Album.objects.filter(tracks__isnull=False, comments__isnull=False).order_by('pk').first()
+        album = album or Album.objects.order_by('pk').first()
+        return {
+            'album': album,
+            'song': Song.objects.filter(album=album).order_by('pk').first(),
+            'playlist': Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC).order_by('pk').first(),
+            'user': DottifyUser.objects.order_by('pk').first(),
+            'comment': Comment.objects.filter(album=album).order_by('pk').first(),
+        }
+
+    def route_url(self, pattern, name, objects):
+        """The URL of a route, its parameters filled from objects, or None if one is missing."""
+        kwargs = {}
+        model = None
+        for token in TOKEN.finditer(pattern):
+            param = token.group('route') or token.group('regex')
+            if param is None:
+                model = SEGMENT_MODELS.get(token.group('literal'), model)
+                continue
+            obj = objects.get(param[:-3] if param.endswith('_pk') else model)
+            if obj is None:
+                return None
+            kwargs[param] = (getattr(obj, 'slug', None) or slugify(obj.display_name)) if param == 'slug' else obj.pk
+        return reverse(name, kwargs=kwargs) + QUERY_STRINGS.get(name, '')
+
+    def bench_routes(self, iterations):
+        objects = self.sample_objects()
+        anonymous = Client()
+        admin = Client()
+        admin.force_login(User.objects.order_by('pk').first())
+
+        results = []
+        seen = set()
+        for pattern, name in collect_routes(get_resolver('dottify.urls')):
+            url = self.route_url(pattern, name, objects)
+            if url is None or url in seen:
+                continue
+            seen.add(url)
+
+            # Pages that turn anonymous visitors away are timed as the admin
+            client, user = anonymous, 'anonymous'
+            if self.turns_away(anonymous.get(url)):
+                client, user = admin, 'admin'
+
+            timings, query_counts = [], []
+            for _ in range(iterations):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    # A streaming body (e.g. /api/export/) runs its queries as it is read
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    timings.append((time.perf_counter() - started) * 1000)
+                status = response.status_code
+                query_counts.append(len(queries))
+
+            results.append({
+                'name': name,
+                'url': url,
+                'user': user,
+                'status': status,
+                'p50_ms': round(self.percentile(timings, 50), 3),
+                'p95_ms': round(self.percentile(timings, 95), 3),
+                'p99_ms': round(self.percentile(timings, 99), 3),
+                'queries': max(query_counts),
+            })
+        return results
+
+    @staticmethod
+    def turns_away(response):
+        if response.status_code in (401, 403):
+            return True
+        return response.status_code == 302 and response['Location'].startswith(resolve_url(settings.LOGIN_URL))
+
+    @staticmethod
+    def percentile(values, percent):
+        if len(values) < 2:
+            return values[0]
+        return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+    def print_table(self, results):
+        self.stdout.write(f'{"route":<28} {"user":<9} {"status":>6} {"p50":>8} {"p95":>8} {"p99":>8} {"queries":>7}')
+        for row in results:
+            self.stdout.write(
+                f'{row["name"]:<28} {row["user"]:<9} {row["status"]:>6} {row["p50_ms"]:>8.2f} '
+                f'{row["p95_ms"]:>8.2f} {row["p99_ms"]:>8.2f} {row["queries"]:>7}'
+            )
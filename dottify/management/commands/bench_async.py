@@ -0,0 +1,69 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+
+from dottify.models import Album
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the async read endpoints (/api/async/...) with their sync DRF '
+        'counterparts by firing concurrent requests through the ASGI handler'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        album = Album.objects.order_by('pk').values_list('pk', flat=True).first()
+        endpoints = [('statistics', 'statistics/'), ('album list', 'albums/'), ('playlist list', 'playlists/')]
+        if album is not None:
+            endpoints += [('album detail', f'albums/{album}/'), ('album songs', f'albums/{album}/songs/')]
+        else:
+            self.stdout.write(self.style.WARNING('No albums: skipping the album detail endpoints'))
+
+        self.stdout.write(f'{"endpoint":<14} {"mode":<6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8}')
+        for name, path in endpoints:
+            for mode, url in (('sync', f'/api/{path}'), ('async', f'/api/async/{path}')):
+                # async_to_sync keeps sync views and ORM calls on this thread's connection
+                elapsed, latencies = async_to_sync(self.run_batch)(
+                    url, options['requests'], options['concurrency']
+                )
+                self.stdout.write(
+                    f'{name:<14} {mode:<6} {len(latencies) / elapsed:>9.1f} '
+                    f'{self.percentile(latencies, 50):>8.2f} {self.percentile(latencies, 95):>8.2f}'
+                )
+
+    async def run_batch(self, url, count, concurrency):
+        """Fires count GETs at url, at most concurrency at a time. Returns (seconds, latencies in ms)."""
+        client = AsyncClient()
+        response = await client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url} answered {response.status_code}')
+
+        gate = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with gate:
+                started = time.perf_counter()
+                await client.get(url)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(count)))
+        return time.perf_counter() - started, latencies
+
+    @staticmethod
+    def percentile(values, percent):
+        if len(values) < 2:
+            return values[0] if values else 0.0
+        return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
@@ -0,0 +1,171 @@
+import random
+import statistics
+import tempfile
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from dottify.sqlite import CONN_MAX_AGE, production_database
+
+SONGS = 50
+
+
+def default_database(name):
+    """What a DATABASES entry gets when it only names the file."""
+    return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+
+
+PROFILES = {
+    'default': default_database,
+    # As served under WSGI, with persistent connections
+    'production': partial(production_database, conn_max_age=CONN_MAX_AGE),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure SQLite write throughput and reader latency under concurrent writes, '
+        'with Django\'s default settings and with the production profile (dottify.sqlite), '
+        'each on a fresh scratch database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Threads recording ratings')
+        parser.add_argument('--readers', type=int, default=4, help='Threads reading song averages meanwhile')
+        parser.add_argument('--writes', type=int, default=200, help='Ratings each writer records')
+        parser.add_argument('--profile', action='append', choices=list(PROFILES), help='Profiles to run (default: all)')
+
+    def handle(self, *args, **options):
+        if min(options['writers'], options['writes']) < 1 or options['readers'] < 0:
+            raise CommandError('--writers and --writes must be positive, --readers not negative')
+
+        self.stdout.write(
+            f'{"profile":<11} {"writes/s":>9} {"locked":>7} {"reads/s":>9} {"read p50 ms":>12} {"read p95 ms":>12}'
+        )
+        for profile in options['profile'] or PROFILES:
+            with tempfile.TemporaryDirectory() as directory:
+                result = self.run_profile(
+                    profile, Path(directory) / 'bench.sqlite3',
+                    options['writers'], options['readers'], options['writes']
+                )
+            elapsed, writes, locked, latencies = result
+            self.stdout.write(
+                f'{profile:<11} {writes / elapsed:>9.1f} {locked:>7} {len(latencies) / elapsed:>9.1f} '
+                f'{self.percentile(latencies, 50):>12.2f} {self.percentile(latencies, 95):>12.2f}'
+            )
+
+    def run_profile(self, profile, path, writers, readers, writes):
+        """Returns (seconds, ratings recorded, writes that failed as locked, read latencies in ms)."""
+        alias = f'bench_sqlite_{profile}'
+        # A scratch alias for this run only, with the defaults Django fills in
+        connections.settings[alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            alias: PROFILES[profile](path),
+        })[alias]
+        try:
+            self.create_schema(alias)
+            done = threading.Event()
+            counts = {'writes': 0, 'locked': 0}
+            latencies = []
+            lock = threading.Lock()
+
+            def write():
+                recorded = locked = 0
+                for _ in range(writes):
+                    try:
+                        self.record_rating(alias, random.randrange(SONGS), random.randint(1, 5))
+                        recorded += 1
+                    except OperationalError:
+                        locked += 1
+                    # End of "request": a connection older than CONN_MAX_AGE is closed
+                    connections[alias].close_if_unusable_or_obsolete()
+                with lock:
+                    counts['writes'] += recorded
+                    counts['locked'] += locked
+
+            def read():
+                timings = []
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        self.song_averages(alias)
+                    except OperationalError:
+                        continue
+                    timings.append((time.perf_counter() - started) * 1000)
+                    connections[alias].close_if_unusable_or_obsolete()
+                with lock:
+                    latencies.extend(timings)
+
+            reader_threads = [self.start(read, alias) for _ in range(readers)]
+            started = time.perf_counter()
+            for thread in [self.start(write, alias) for _ in range(writers)]:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            done.set()
+            for thread in reader_threads:
+                thread.join()
+            return elapsed, counts['writes'], counts['locked'], latencies
+        finally:
+            connections[alias].close()
+            del connections.settings[alias]
+
+    @staticmethod
+    def start(target, alias):
+        def run():
+            try:
+                target()
+            finally:
+                # Connections are per thread
+                connections[alias].close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def create_schema(alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE rating (id INTEGER PRIMARY KEY, song_id INTEGER NOT NULL, '
+                'stars INTEGER NOT NULL, created_at REAL NOT NULL)'
+            )
+            cursor.execute('CREATE INDEX rating_song ON rating (song_id)')
+            cursor.execute(
+                'CREATE TABLE summary (song_id INTEGER PRIMARY KEY, '
+                'count INTEGER NOT NULL, total INTEGER NOT NULL)'
+            )
+            cursor.executemany('INSERT INTO summary VALUES (%s, 0, 0)', [(song,) for song in range(SONGS)])
+
+    @staticmethod
+    def record_rating(alias, song, stars):
+        """As aggregates.apply_ratings does: read the song's summary, then insert and update."""
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute('SELECT count, total FROM summary WHERE song_id = %s', [song])
+            cursor.fetchone()
+            cursor.execute(
+                'INSERT INTO rating (song_id, stars, created_at) VALUES (%s, %s, %s)', [song, stars, time.time()]
+            )
+            cursor.execute(
+                'UPDATE summary SET count = count + 1, total = total + %s WHERE song_id = %s', [stars, song]
+            )
+
+    @staticmethod
+    def song_averages(alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'SELECT song_id, CAST(total AS REAL) / count FROM summary WHERE count > 0 '
+                'ORDER BY total DESC LIMIT 20'
+            )
+            cursor.fetchall()
+            cursor.execute('SELECT COUNT(*) FROM rating WHERE song_id = %s', [random.randrange(SONGS)])
+            cursor.fetchone()
+
+    @staticmethod
+    def percentile(values, percent):
+        if len(values) < 2:
+            return values[0] if values else 0.0
+        return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from dottify.images import generate_cover_variants
+from dottify.models import Album
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized WebP/JPEG album cover variants for existing media'
+
+    def add_arguments(self, parser):
+        parser.add_argument('album_ids', nargs='*', type=int, help='Only these albums (default: all)')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-render variants even if their files already exist'
+        )
+
+    def handle(self, *args, **options):
+        albums = Album.objects.order_by('pk')
+        if options['album_ids']:
+            albums = albums.filter(pk__in=options['album_ids'])
+
+        done = failed = 0
+        for album_id in albums.values_list('pk', flat=True).iterator():
+            try:
+                generate_cover_variants(album_id, force=options['force'])
+                done += 1
+            except (OSError, ValueError) as exc:
+                # Missing or unreadable files shouldn't stop the backfill
+                failed += 1
+                self.stderr.write(f'Album {album_id}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated cover variants for {done} album(s), {failed} failed'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dottify import aggregates
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-song rating aggregates from the Rating table, or verify them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the stored aggregates with Rating and report any differences'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            problems = aggregates.verify()
+            for problem in problems:
+                self.stderr.write(problem)
+            if problems:
+                raise CommandError(f'{len(problems)} rating aggregate(s) do not match the Rating table')
+            self.stdout.write(self.style.SUCCESS('Rating aggregates match the Rating table'))
+            return
+
+        bucket_count, song_count = aggregates.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {bucket_count} rating bucket(s) for {song_count} song(s)'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from dottify import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over albums, artists and tracks'
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            self.stdout.write('The database is not SQLite, so there is no full-text index to rebuild')
+            return
+
+        album_count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {album_count} album(s)'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from dottify import stats
+
+
+class Command(BaseCommand):
+    help = 'Recount the catalogue statistics snapshot and correct any drift'
+
+    def handle(self, *args, **options):
+        drift = stats.reconcile()
+        for name, (stored, actual) in drift.items():
+            self.stdout.write(f'{name}: {stored} -> {actual}')
+
+        if drift:
+            self.stdout.write(self.style.WARNING(f'Corrected {len(drift)} drifted counter(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Statistics snapshot matches the database'))
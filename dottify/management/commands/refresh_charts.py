@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from dottify import charts
+
+
+class Command(BaseCommand):
+    help = (
+        'Bring the song and album charts up to date with the ratings created since the last refresh, '
+        'or recompute them from the Rating table with --rebuild'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Discard the chart entries and compute them again from Rating'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            entry_count = charts.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the charts: {entry_count} song entries'))
+            return
+
+        charts.refresh()
+        state = charts.load_state()
+        self.stdout.write(self.style.SUCCESS(
+            f'Charts refreshed to {state.day}, up to rating {state.rating_watermark}'
+        ))
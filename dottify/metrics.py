@@ -0,0 +1,183 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from . import fragments
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """
+    A Prometheus style histogram with one series per view name. Observing is
+    a bisect and a few additions under a lock, cheap enough for every request.
+    Each process keeps its own, as with any in-process Prometheus client.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(view)
+            if series is None:
+                # Per bucket counts (plus +Inf), sum, count
+                series = self._series[view] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {view: (list(counts), total, count) for view, (counts, total, count) in self._series.items()}
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for view, (counts, total, count) in sorted(self.snapshot().items()):
+            label = f'view="{escape_label(view)}"'
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram(
+    'dottify_request_duration_seconds', 'Time spent handling a request.', SECONDS_BUCKETS
+)
+QUERY_COUNT = Histogram('dottify_request_queries', 'Database queries run per request.', QUERY_BUCKETS)
+SQL_SECONDS = Histogram('dottify_request_sql_seconds', 'Time spent in database queries per request.', SECONDS_BUCKETS)
+RENDER_SECONDS = Histogram(
+    'dottify_request_render_seconds', 'Time spent rendering templates or API responses.', SECONDS_BUCKETS
+)
+RESPONSE_BYTES = Histogram('dottify_response_size_bytes', 'Size of response bodies.', SIZE_BUCKETS)
+
+HISTOGRAMS = (REQUEST_SECONDS, QUERY_COUNT, SQL_SECONDS, RENDER_SECONDS, RESPONSE_BYTES)
+
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+def exposition():
+    """Every metric in the Prometheus text format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.exposition()
+
+    counters = fragments.get_counters()
+    lines += ['# HELP dottify_fragment_cache_total Album page fragment cache lookups.',
+              '# TYPE dottify_fragment_cache_total counter']
+    lines += [f'dottify_fragment_cache_total{{result="{name}"}} {counters[name]}' for name in ('hits', 'misses')]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
+
+
+# --- Recording ---
+
+class QueryRecorder:
+    """execute_wrapper that counts the queries of one request and times them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = QueryRecorder()
+        self.wrappers = ExitStack()
+        self.render_started = None
+        self.render_seconds = 0.0
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Records, per resolved URL name, the query count, SQL time, render time and
+    response size of each request into the histograms served at /metrics, and
+    reports the same numbers in a Server-Timing header (unless
+    DOTTIFY_METRICS_SERVER_TIMING is off). Goes first in MIDDLEWARE so the
+    queries of the other middleware are counted too.
+
+    The query wrappers are installed from process_request, which Django runs on
+    the thread that serves the request's queries in async stacks as well.
+    """
+
+    def process_request(self, request):
+        metrics = request._dottify_metrics = RequestMetrics()
+        for connection in connections.all():
+            metrics.wrappers.enter_context(connection.execute_wrapper(metrics.queries))
+
+    def process_template_response(self, request, response):
+        metrics = getattr(request, '_dottify_metrics', None)
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.rendered(metrics))
+        return response
+
+    @staticmethod
+    def rendered(metrics):
+        metrics.render_seconds = time.perf_counter() - metrics.render_started
+
+    def process_response(self, request, response):
+        metrics = getattr(request, '_dottify_metrics', None)
+        if metrics is None:
+            return response
+        metrics.wrappers.close()
+        total = time.perf_counter() - metrics.started
+
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unresolved'
+        REQUEST_SECONDS.observe(view, total)
+        QUERY_COUNT.observe(view, metrics.queries.count)
+        SQL_SECONDS.observe(view, metrics.queries.seconds)
+        RENDER_SECONDS.observe(view, metrics.render_seconds)
+        if not response.streaming:
+            RESPONSE_BYTES.observe(view, len(response.content))
+
+        if getattr(settings, 'DOTTIFY_METRICS_SERVER_TIMING', True):
+            timing = (
+                f'db;desc="{metrics.queries.count} queries";dur={metrics.queries.seconds * 1000:.2f}, '
+                f'render;dur={metrics.render_seconds * 1000:.2f}, total;dur={total * 1000:.2f}'
+            )
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+        return response
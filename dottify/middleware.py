@@ -0,0 +1,18 @@
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from .identity import resolve_identity
+
+
+class IdentityMiddleware(MiddlewareMixin):
+    """
+    Adds request.identity: the user's DottifyUser profile and groups, loaded
+    lazily on first use and at most once per request. Must come after
+    SessionMiddleware and AuthenticationMiddleware.
+
+    Like Django's own middleware it works in both sync and async stacks, so
+    async views aren't forced onto a thread.
+    """
+
+    def process_request(self, request):
+        request.identity = SimpleLazyObject(lambda: resolve_identity(request))
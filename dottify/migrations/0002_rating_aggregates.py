@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:25
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dottify', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongRatingSummary',
+            fields=[
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='dottify.song')),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('stars_sum', models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=12)),
+                ('window_start', models.DateField()),
+                ('recent_count', models.PositiveIntegerField(default=0)),
+                ('recent_stars_sum', models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RatingBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('stars', models.DecimalField(decimal_places=1, max_digits=2)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('stars_sum', models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=12)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_buckets', to='dottify.song')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('song', 'day', 'stars'), name='unique_rating_bucket_per_song_day_stars')],
+            },
+        ),
+    ]
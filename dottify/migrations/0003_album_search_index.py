@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:29
+
+import django.db.models.deletion
+import dottify.fields
+from django.db import migrations, models
+
+
+def create_fts_table(apps, schema_editor):
+    # FTS5 is SQLite specific; other backends fall back to plain lookups
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS dottify_album_fts USING fts5("
+        "title, artist_name, song_titles, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    # Title matches weigh most, then the artist, then track titles
+    schema_editor.execute(
+        "INSERT INTO dottify_album_fts(dottify_album_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')"
+    )
+    schema_editor.execute(
+        "INSERT INTO dottify_album_fts(rowid, title, artist_name, song_titles) "
+        "SELECT a.id, a.title, a.artist_name, "
+        "COALESCE((SELECT group_concat(s.title, ' ') FROM dottify_song s WHERE s.album_id = a.id), '') "
+        "FROM dottify_album a"
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS dottify_album_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dottify', '0002_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumSearchEntry',
+            fields=[
+                ('album', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='dottify.album')),
+                ('title', models.TextField()),
+                ('artist_name', models.TextField()),
+                ('song_titles', models.TextField()),
+                ('document', dottify.fields.FullTextField(db_column='dottify_album_fts')),
+                ('rank', models.FloatField(null=True)),
+            ],
+            options={
+                'db_table': 'dottify_album_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:32
+
+from django.db import migrations, models
+
+
+def create_snapshot(apps, schema_editor):
+    DottifyUser = apps.get_model('dottify', 'DottifyUser')
+    Album = apps.get_model('dottify', 'Album')
+    Playlist = apps.get_model('dottify', 'Playlist')
+    Song = apps.get_model('dottify', 'Song')
+    CatalogStatistics = apps.get_model('dottify', 'CatalogStatistics')
+    db = schema_editor.connection.alias
+
+    songs = Song.objects.using(db).aggregate(count=models.Count('id'), length=models.Sum('length'))
+    CatalogStatistics.objects.using(db).create(
+        pk=1,
+        user_count=DottifyUser.objects.using(db).count(),
+        album_count=Album.objects.using(db).count(),
+        public_playlist_count=Playlist.objects.using(db).filter(visibility=2).count(),
+        song_count=songs['count'],
+        song_length_sum=songs['length'] or 0,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dottify', '0003_album_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_count', models.PositiveIntegerField(default=0)),
+                ('album_count', models.PositiveIntegerField(default=0)),
+                ('public_playlist_count', models.PositiveIntegerField(default=0)),
+                ('song_count', models.PositiveIntegerField(default=0)),
+                ('song_length_sum', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_snapshot, migrations.RunPython.noop),
+    ]
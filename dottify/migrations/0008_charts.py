@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dottify', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_watermark', models.PositiveBigIntegerField(default=0)),
+                ('day', models.DateField()),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AlbumChartEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.PositiveSmallIntegerField()),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('stars_sum', models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=12)),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chart_entries', to='dottify.album')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', 'rating_count'], name='album_chart_volume_idx')],
+                'constraints': [models.UniqueConstraint(fields=('window', 'album'), name='unique_album_chart_entry')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SongChartEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.PositiveSmallIntegerField()),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('stars_sum', models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=12)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chart_entries', to='dottify.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', 'rating_count'], name='song_chart_volume_idx')],
+                'constraints': [models.UniqueConstraint(fields=('window', 'song'), name='unique_song_chart_entry')],
+            },
+        ),
+    ]
@@ -8,6 +8,60 @@ from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import User
+from .fields import FullTextField
+
+
+class LoadedValuesMixin:
+    """
+    Remembers the field values an instance was loaded or last saved with,
+    so signal receivers can tell what an edit changed without another query.
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if value is not models.DEFERRED
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # post_save receivers have run by now and saw the previous values
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+        }
+
+
+class VersionedModel(models.Model):
+    """
+    Adds a version counter and modification time for conditional GETs.
+    Saving bumps both; changes to related rows bump them with touch().
+    """
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        bump = not self._state.adding
+        if bump:
+            # Bumped in the database, as touch() does, so an instance loaded
+            # before a touch() can't write back the version that touch made
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def touch(cls, **filters):
+        """Bumps the version of every row matching filters, without loading them."""
+        return cls.objects.filter(**filters).update(
+            version=models.F('version') + 1,
+            updated_at=timezone.now()
+        )
 
 
 class DottifyUser(models.Model):
@@ -29,7 +83,7 @@ def get_max_release_date():
     return timezone.now().date() + timedelta(days=6 * 30)
 
 
-class Album(models.Model):
+class Album(LoadedValuesMixin, VersionedModel):
 
     class Format(models.TextChoices):
         SINGLE = 'SNGL', _('Single')
@@ -61,6 +115,10 @@ class Album(models.Model):
     release_date = models.DateField(validators=[MaxValueValidator(limit_value=get_max_release_date)], null=False, blank=False)
     slug = models.SlugField(null=True, blank=True)
 
+    # Resized copies of cover_image written by dottify.images:
+    # {'source': <cover name>, 'webp': [[width, name], ...], 'jpeg': [...]}
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -68,6 +126,10 @@ class Album(models.Model):
                 name='unique_album_by_artist_and_format'
             )
         ]
+        indexes = [
+            # An artist's albums, paged by id (home page, SongForm choices)
+            models.Index(fields=['artist_account', 'id'], name='album_artist_account_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # Ensure the slug is generated if it's new OR if the title has changed
@@ -75,11 +137,56 @@ class Album(models.Model):
             self.slug = slugify(self.title)
         super().save(*args, **kwargs)
 
+    def cover_variant_urls(self, image_format):
+        """[(width, url), ...] of the cover's resized copies, if they match the current cover."""
+        variants = self.cover_variants or {}
+        if not self.cover_image or variants.get('source') != self.cover_image.name:
+            return []
+        storage = self.cover_image.storage
+        return [(width, storage.url(name)) for width, name in variants.get(image_format, [])]
+
+    def cover_srcset(self, image_format):
+        return ', '.join(f'{url} {width}w' for width, url in self.cover_variant_urls(image_format))
+
+    @property
+    def cover_webp_srcset(self):
+        return self.cover_srcset('webp')
+
+    @property
+    def cover_jpeg_srcset(self):
+        return self.cover_srcset('jpeg')
+
     def __str__(self):
         return _("%(title)s by %(artist_name)s") % {'title': self.title, 'artist_name': self.artist_name}
 
 
-class Song(models.Model):
+class AlbumSearchEntry(models.Model):
+    """
+    Row of the SQLite FTS5 index over album titles, artist names and track titles.
+    The virtual table is created by migration and kept in sync by dottify.search.
+    """
+    album = models.OneToOneField(
+        Album,
+        on_delete=models.DO_NOTHING,  # Entries are removed by dottify.search
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_entry'
+    )
+    title = models.TextField()
+    artist_name = models.TextField()
+    song_titles = models.TextField()
+
+    # FTS5 hidden columns: the table-named one is matched against, rank orders by bm25
+    document = FullTextField(db_column='dottify_album_fts')
+    rank = models.FloatField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'dottify_album_fts'
+
+
+class Song(LoadedValuesMixin, VersionedModel):
     title = models.CharField(max_length=800, blank=False, null=False)
     length = models.PositiveIntegerField(
         validators=[MinValueValidator(10)],
@@ -107,6 +214,10 @@ class Song(models.Model):
             )
         ]
         ordering = ['album', 'position']
+        indexes = [
+            # An album's tracks in order, matching SongPagination's key
+            models.Index(fields=['album', 'position', 'id'], name='song_album_position_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """
@@ -126,7 +237,7 @@ class Song(models.Model):
         super().save(*args, **kwargs)
 
 
-class Playlist(models.Model):
+class Playlist(LoadedValuesMixin, VersionedModel):
     class Visibility(models.IntegerChoices):
         HIDDEN = 0, _('Hidden') # Default
         UNLISTED = 1, _('Unlisted')
@@ -153,6 +264,12 @@ class Playlist(models.Model):
         null=False
     )
 
+    class Meta:
+        indexes = [
+            # Public playlists paged by PlaylistPagination's key
+            models.Index(fields=['visibility', 'created_at', 'id'], name='playlist_visibility_idx'),
+        ]
+
     def __str__(self):
         # Displays the name and the owner for clarity
         return _("%(name)s (Owner: %(owner_display_name)s)") % {
@@ -169,7 +286,7 @@ def validate_half_step(value):
         )
 
 
-class Rating(models.Model):
+class Rating(LoadedValuesMixin, models.Model):
 
     song = models.ForeignKey(
         'Song',
@@ -191,6 +308,12 @@ class Rating(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)  # For 90-day calculation
 
+    class Meta:
+        indexes = [
+            # A song's ratings within a date range
+            models.Index(fields=['song', 'created_at'], name='rating_song_created_idx'),
+        ]
+
     def __str__(self):
         return _("Rating: %(stars)s for Song: %(song_title)s") % {
             'stars': self.stars, 
@@ -198,7 +321,129 @@ class Rating(models.Model):
         }
 
 
+class RatingBucket(models.Model):
+    """
+    Number and sum of ratings a song received on one day for one half-star value.
+    """
+    song = models.ForeignKey(
+        Song,
+        on_delete=models.CASCADE,
+        related_name='rating_buckets'
+    )
+    day = models.DateField()
+    stars = models.DecimalField(max_digits=2, decimal_places=1)
+    count = models.PositiveIntegerField(default=0)
+    stars_sum = models.DecimalField(max_digits=12, decimal_places=1, default=Decimal('0.0'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['song', 'day', 'stars'],
+                name='unique_rating_bucket_per_song_day_stars'
+            )
+        ]
+
+
+class SongRatingSummary(models.Model):
+    """
+    Running totals of a song's ratings, all time and since window_start.
+    Maintained by dottify.aggregates so averages can be read without scanning Rating.
+    """
+    song = models.OneToOneField(
+        Song,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rating_summary'
+    )
+    rating_count = models.PositiveIntegerField(default=0)
+    stars_sum = models.DecimalField(max_digits=12, decimal_places=1, default=Decimal('0.0'))
+
+    # Only buckets on or after window_start are counted as recent
+    window_start = models.DateField()
+    recent_count = models.PositiveIntegerField(default=0)
+    recent_stars_sum = models.DecimalField(max_digits=12, decimal_places=1, default=Decimal('0.0'))
+
+    @property
+    def all_time_average(self):
+        if not self.rating_count:
+            return None
+        return float(self.stars_sum) / self.rating_count
+
+    @property
+    def recent_average(self):
+        if not self.recent_count:
+            return None
+        return float(self.recent_stars_sum) / self.recent_count
+
+
+class ChartEntry(models.Model):
+    """
+    Number and sum of the ratings received in the last `window` days, up to
+    ChartState.day. Maintained by dottify.charts so charts are read, not aggregated.
+    """
+    window = models.PositiveSmallIntegerField()
+    rating_count = models.PositiveIntegerField(default=0)
+    stars_sum = models.DecimalField(max_digits=12, decimal_places=1, default=Decimal('0.0'))
+
+    class Meta:
+        abstract = True
+
+    @property
+    def average(self):
+        if not self.rating_count:
+            return None
+        return float(self.stars_sum) / self.rating_count
+
+
+class SongChartEntry(ChartEntry):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='chart_entries')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'song'], name='unique_song_chart_entry')
+        ]
+        indexes = [
+            # Top songs by rating volume
+            models.Index(fields=['window', 'rating_count'], name='song_chart_volume_idx'),
+        ]
+
+
+class AlbumChartEntry(ChartEntry):
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='chart_entries')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'album'], name='unique_album_chart_entry')
+        ]
+        indexes = [
+            models.Index(fields=['window', 'rating_count'], name='album_chart_volume_idx'),
+        ]
+
+
+class ChartState(models.Model):
+    """
+    Single row recording how far the chart entries have got: they count every
+    Rating up to rating_watermark, over windows ending on `day`.
+    """
+    SINGLETON_PK = 1
+
+    rating_watermark = models.PositiveBigIntegerField(default=0)
+    day = models.DateField()
+    refreshed_at = models.DateTimeField()
+
+
+class CommentQuerySet(models.QuerySet):
+    def with_authors(self):
+        """Joins each comment's user and DottifyUser profile for get_user_display_name."""
+        return self.select_related('user__dottify_profile').only(
+            'id', 'album_id', 'comment_text', 'created_at',
+            'user__id', 'user__username', 'user__dottify_profile__id', 'user__dottify_profile__display_name'
+        )
+
+
 class Comment(models.Model):
+    objects = CommentQuerySet.as_manager()
+
     album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -209,11 +454,39 @@ class Comment(models.Model):
         null=False
     )
 
+    class Meta:
+        indexes = [
+            # An album's comments newest first, matching CommentPagination's key
+            models.Index(fields=['album', 'created_at', 'id'], name='comment_album_created_idx'),
+        ]
+
     def get_user_display_name(self):
+        # No query when loaded with select_related('user__dottify_profile')
         try:
-            return DottifyUser.objects.get(user=self.user).display_name
+            return self.user.dottify_profile.display_name
         except DottifyUser.DoesNotExist:
             return self.user.username  # Fallback
 
     def __str__(self):
         return self.comment_text
+
+
+class CatalogStatistics(models.Model):
+    """
+    Single row of catalogue counters behind /api/statistics/.
+    Kept up to date incrementally by dottify.stats rather than counted per request.
+    """
+    SINGLETON_PK = 1
+
+    user_count = models.PositiveIntegerField(default=0)
+    album_count = models.PositiveIntegerField(default=0)
+    public_playlist_count = models.PositiveIntegerField(default=0)
+    song_count = models.PositiveIntegerField(default=0)
+    song_length_sum = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def song_length_average(self):
+        if not self.song_count:
+            return 0.0
+        return self.song_length_sum / self.song_count
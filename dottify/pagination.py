@@ -0,0 +1,231 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(values, reverse=False):
+    """Opaque, URL safe cursor holding the key of a boundary row."""
+    payload = json.dumps({'k': values, 'r': int(reverse)}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, ordering, cursor):
+    """
+    Returns (key values, reverse) for a cursor made by encode_cursor.
+    Raises ValueError for anything that wasn't.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        raw_values, reverse = payload['k'], bool(payload['r'])
+        if len(raw_values) != len(ordering):
+            raise ValueError(cursor)
+        values = [
+            None if raw is None else _field(model, name.lstrip('-')).to_python(raw)
+            for name, raw in zip(ordering, raw_values)
+        ]
+    except (ValueError, KeyError, TypeError, ValidationError) as exc:
+        raise ValueError(cursor) from exc
+    return values, reverse
+
+
+def row_key(obj, ordering):
+    return [getattr(obj, name.lstrip('-')) for name in ordering]
+
+
+def _equal(name, value):
+    return Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+
+def _beyond(name, lookup, value, nullable):
+    """
+    Rows whose name lies strictly beyond value in the direction of lookup
+    ('gt' or 'lt'), with NULLs sorting before every value; None if there are none.
+    """
+    if value is None:
+        return Q(**{f'{name}__isnull': False}) if lookup == 'gt' else None
+    condition = Q(**{f'{name}__{lookup}': value})
+    if lookup == 'lt' and nullable:
+        condition |= Q(**{f'{name}__isnull': True})
+    return condition
+
+
+def keyset_filter(ordering, values, reverse=False, nullable=()):
+    """
+    Rows strictly after (or before, when reverse) the given key, expanded as
+    (a > x) OR (a = x AND b > y) OR ... so each branch can use an index range.
+    Names prefixed with '-' sort descending. Names in nullable may hold NULL,
+    which sorts before every value, as key_order() orders them.
+    """
+    names = [name.lstrip('-') for name in ordering]
+    condition = Q()
+    for index, name in enumerate(names):
+        descending = ordering[index].startswith('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        beyond = _beyond(name, lookup, values[index], name in nullable)
+        if beyond is None:
+            continue
+        branch = Q()
+        for prefix, value in zip(names[:index], values[:index]):
+            branch &= _equal(prefix, value)
+        condition |= branch & beyond
+    return condition
+
+
+def key_order(ordering, nullable=()):
+    """order_by() arguments for ordering, putting NULLs of nullable names first (last when descending)."""
+    order_by = []
+    for name in ordering:
+        attname = name.lstrip('-')
+        if attname not in nullable:
+            order_by.append(name)
+        elif name.startswith('-'):
+            order_by.append(F(attname).desc(nulls_last=True))
+        else:
+            order_by.append(F(attname).asc(nulls_first=True))
+    return order_by
+
+
+def _flip(name):
+    return name[1:] if name.startswith('-') else f'-{name}'
+
+
+def _keyset_query(queryset, ordering, page_size, cursor):
+    nullable = {
+        name.lstrip('-') for name in ordering if _field(queryset.model, name.lstrip('-')).null
+    }
+    reverse = False
+    if cursor is not None:
+        values, reverse = decode_cursor(queryset.model, ordering, cursor)
+        queryset = queryset.filter(keyset_filter(ordering, values, reverse, nullable))
+
+    order_by = [_flip(name) for name in ordering] if reverse else ordering
+    return queryset.order_by(*key_order(order_by, nullable))[:page_size + 1], reverse
+
+
+def _keyset_result(rows, ordering, page_size, cursor, reverse):
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    # Walking backwards, "more" rows lie before the page and the cursor row after it
+    has_next, has_previous = (cursor is not None, has_more) if reverse else (has_more, cursor is not None)
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(row_key(rows[-1], ordering))
+    if rows and has_previous:
+        previous_cursor = encode_cursor(row_key(rows[0], ordering), reverse=True)
+    return rows, next_cursor, previous_cursor
+
+
+def keyset_page(queryset, ordering, page_size, cursor=None):
+    """
+    One page of queryset ordered by the ordering attnames ('-' for descending), starting after cursor.
+    Returns (rows, next cursor or None, previous cursor or None).
+    """
+    queryset, reverse = _keyset_query(queryset, ordering, page_size, cursor)
+    return _keyset_result(list(queryset), ordering, page_size, cursor, reverse)
+
+
+async def akeyset_page(queryset, ordering, page_size, cursor=None):
+    """keyset_page for async views."""
+    queryset, reverse = _keyset_query(queryset, ordering, page_size, cursor)
+    rows = [row async for row in queryset]
+    return _keyset_result(rows, ordering, page_size, cursor, reverse)
+
+
+def requested_page_size(params, name, default, maximum):
+    """Client chosen page size from the query parameters, capped at maximum."""
+    try:
+        requested = int(params[name])
+    except (KeyError, ValueError):
+        return default
+    if requested <= 0:
+        return default
+    return min(requested, maximum)
+
+
+def link_header(url, cursor_param, next_cursor, previous_cursor):
+    """Link header value advertising the neighbouring pages of url, or None."""
+    links = []
+    for rel, cursor in (('next', next_cursor), ('prev', previous_cursor)):
+        if cursor is not None:
+            links.append(f'<{replace_query_param(url, cursor_param, cursor)}>; rel="{rel}"')
+    return ', '.join(links) or None
+
+
+def _field(model, attname):
+    for field in model._meta.concrete_fields:
+        if field.attname == attname:
+            return field
+    raise KeyError(attname)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a stable, unique key so every page costs the same.
+
+    The response body stays a plain list, as the API has always returned;
+    the neighbouring pages are advertised in a Link header (rel="next" / "prev").
+    """
+    # Model attnames, the last of which must be unique
+    ordering = ('id',)
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        try:
+            rows, self.next_cursor, self.previous_cursor = keyset_page(
+                queryset, self.ordering, page_size,
+                request.query_params.get(self.cursor_query_param)
+            )
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        return rows
+
+    def get_page_size(self, request):
+        """Client chosen page size, capped at max_page_size."""
+        return requested_page_size(
+            request.query_params, self.page_size_query_param, self.page_size, self.max_page_size
+        )
+
+    def get_paginated_response(self, data):
+        link = link_header(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor, self.previous_cursor
+        )
+        return Response(data, headers={'Link': link} if link else None)
+
+    def get_paginated_response_schema(self, schema):
+        return schema
+
+
+class SongPagination(KeysetPagination):
+    ordering = ('album_id', 'position', 'id')
+
+
+class PlaylistPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+class CommentPagination(KeysetPagination):
+    # Newest first
+    ordering = ('-created_at', '-id')
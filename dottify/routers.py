@@ -0,0 +1,111 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingState:
+    """Where the current request's reads go, and whether it has written yet."""
+
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+_state = ContextVar('dottify_db_routing', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DOTTIFY_READ_REPLICAS', []))
+
+
+def get_lag_tolerance():
+    """Seconds a replica may trail the primary; clients that wrote read from the primary for this long."""
+    return getattr(settings, 'DOTTIFY_REPLICA_LAG_TOLERANCE', 5)
+
+
+def get_pin_cookie():
+    return getattr(settings, 'DOTTIFY_REPLICA_PIN_COOKIE', 'dottify_primary_until')
+
+
+def pinned_to_primary(request):
+    """Whether the client wrote recently enough that a replica may not have its change yet."""
+    try:
+        return float(request.COOKIES[get_pin_cookie()]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of safe requests (see ReplicaRoutingMiddleware) to one of
+    DOTTIFY_READ_REPLICAS, and everything else to the primary: writes, reads
+    after the request's first write, reads inside a transaction and anything
+    outside a request (commands, worker threads).
+
+    The primary is named explicitly rather than left to Django's default,
+    which would follow an instance loaded from a replica back to it.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # A replica can't see what the transaction has written
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        pool = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """
+    Picks a replica for each GET/HEAD/OPTIONS request, unless the client is
+    pinned to the primary after a recent write. A response to a request that
+    wrote sets the pin cookie for DOTTIFY_REPLICA_LAG_TOLERANCE seconds, so
+    clients read their own writes. Goes before SessionMiddleware so session
+    and user lookups are routed too.
+
+    Streaming responses read their rows after the request has finished, from
+    the primary.
+    """
+
+    def process_request(self, request):
+        replicas = get_replicas()
+        replica = None
+        if replicas and request.method in SAFE_METHODS and not pinned_to_primary(request):
+            replica = random.choice(replicas)
+        request._dottify_routing = (_state.set(RoutingState(replica)), _state.get())
+
+    def process_response(self, request, response):
+        token, state = getattr(request, '_dottify_routing', (None, None))
+        if state is None:
+            return response
+        if state.wrote:
+            tolerance = get_lag_tolerance()
+            response.set_cookie(
+                get_pin_cookie(), str(time.time() + tolerance), max_age=tolerance, httponly=True, samesite='Lax'
+            )
+        try:
+            _state.reset(token)
+        except ValueError:
+            # Reset from another context (async stacks); just clear it
+            _state.set(None)
+        return response
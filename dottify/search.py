@@ -0,0 +1,105 @@
+import re
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Album, AlbumSearchEntry, Song
+
+FTS_TABLE = AlbumSearchEntry._meta.db_table
+ALBUM_TABLE = Album._meta.db_table
+SONG_TABLE = Song._meta.db_table
+
+
+def fts_enabled():
+    """The FTS5 index only exists on SQLite."""
+    return connection.vendor == 'sqlite'
+
+
+def build_match_expression(text):
+    """
+    Turns free text into an FTS5 query: every word must match as a prefix.
+    Words are quoted so user input can't inject FTS5 operators.
+    """
+    terms = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+# --- Keeping the index in sync ---
+
+def index_album(album_id):
+    """(Re)writes the index entry of one album, or drops it if the album is gone."""
+    index_albums([album_id])
+
+
+def index_albums(album_ids):
+    """index_album for several albums, in a fixed number of queries."""
+    if not fts_enabled():
+        return
+
+    album_ids = list(album_ids)
+    albums = Album.objects.filter(pk__in=album_ids).values_list('pk', 'title', 'artist_name')
+    song_titles = defaultdict(list)
+    for album_id, title in Song.objects.filter(album_id__in=album_ids).values_list('album_id', 'title'):
+        song_titles[album_id].append(title)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[album_id] for album_id in album_ids])
+        rows = [[pk, title, artist_name, ' '.join(song_titles[pk])] for pk, title, artist_name in albums]
+        if rows:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE}(rowid, title, artist_name, song_titles) VALUES (%s, %s, %s, %s)', rows
+            )
+
+
+def remove_album(album_id):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [album_id])
+
+
+def rebuild_index():
+    """Repopulates the whole index from Album and Song. Returns the number of albums indexed."""
+    if not fts_enabled():
+        return 0
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, title, artist_name, song_titles) '
+            f'SELECT a.id, a.title, a.artist_name, '
+            f"COALESCE((SELECT group_concat(s.title, ' ') FROM {SONG_TABLE} s WHERE s.album_id = a.id), '') "
+            f'FROM {ALBUM_TABLE} a'
+        )
+        # Merge the segments written above so queries touch as few b-trees as possible
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+# --- Querying ---
+
+def filter_albums(queryset, text):
+    """Albums in queryset whose title, artist or track titles match text as prefixes."""
+    expression = build_match_expression(text)
+    if not expression:
+        return queryset.none()
+
+    if not fts_enabled():
+        condition = Q()
+        for term in re.findall(r'\w+', text):
+            condition &= (
+                Q(title__icontains=term) | Q(artist_name__icontains=term) | Q(tracks__title__icontains=term)
+            )
+        return queryset.filter(condition).distinct()
+
+    return queryset.filter(search_entry__document__match=expression)
+
+
+def search_albums(queryset, text):
+    """Like filter_albums, but ordered best match first."""
+    results = filter_albums(queryset, text)
+    if not fts_enabled():
+        return results
+    return results.order_by('search_entry__rank', 'pk')
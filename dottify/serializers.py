@@ -1,16 +1,194 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models, transaction
+from django.db.models import Max, Prefetch
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 from rest_framework.validators import UniqueTogetherValidator
 from django.utils.translation import gettext_lazy as _
-from .models import Album, Song, Playlist, DottifyUser
+from . import ingest
+from .aggregates import get_rating_summary
+from .identity import get_identity
+from .models import Album, Comment, Song, Playlist, Rating, validate_half_step
+from .signals import after_bulk_insert
+
+
+def track_title_rows(album_ids):
+    """(album_id, title) rows of several albums' tracks, by position."""
+    return (
+        Song.objects
+        .filter(album_id__in=album_ids)
+        .order_by('album_id', 'position')
+        .values_list('album_id', 'title')
+    )
+
+
+def load_track_titles(album_ids):
+    """Track titles of several albums in one query, as {album_id: [title, ...]} by position."""
+    titles = defaultdict(list)
+    for album_id, title in track_title_rows(album_ids):
+        titles[album_id].append(title)
+    return titles
+
+
+async def aload_track_titles(album_ids):
+    """load_track_titles for async views."""
+    titles = defaultdict(list)
+    async for album_id, title in track_title_rows(album_ids):
+        titles[album_id].append(title)
+    return titles
+
+
+def _query_names(request, param):
+    return {name.strip() for value in request.GET.getlist(param) for name in value.split(',') if name.strip()}
+
+
+def requested_fieldset(request):
+    """
+    (fields, omit) of a read request's ?fields=a,b and ?omit=c,d. fields is
+    None when not given, meaning every field. Writes are never trimmed.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, set()
+    return _query_names(request, 'fields') or None, _query_names(request, 'omit')
+
+
+def _source_columns(model, field):
+    """only() paths a serializer field reads through its source, or None if unknown."""
+    if field.source == '*':
+        return None
+    path = []
+    for attr in field.source_attrs:
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        if model_field.many_to_many or model_field.one_to_many:
+            # Loaded by a prefetch, not from this row
+            return ()
+        path.append(model_field.name)
+        if not model_field.is_relation:
+            break
+        model = model_field.related_model
+    return ('__'.join(path),)
+
+
+def _select_related_paths(select_related, prefix=''):
+    """Deepest paths of a query's select_related tree."""
+    if not isinstance(select_related, dict):
+        return []
+    paths = []
+    for name, children in select_related.items():
+        path = prefix + name
+        paths += _select_related_paths(children, path + '__') or [path]
+    return paths
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=a,b limits a GET response to those fields and ?omit=c,d leaves
+    some out. Only the outermost serializer (or each item of a list) is
+    trimmed, not nested ones. sparse_queryset() then loads just the columns
+    the remaining fields read.
+    """
+
+    # only() paths read by fields whose source isn't a model field
+    sparse_columns = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        wanted, omitted = requested_fieldset(self.context.get('request'))
+        if (wanted is None and not omitted) or not self._is_outermost():
+            return fields
+        return {
+            name: field for name, field in fields.items()
+            if (wanted is None or name in wanted) and name not in omitted
+        }
+
+    def _is_outermost(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    @classmethod
+    def requested_fields(cls, request):
+        """Names of the fields a response to request includes."""
+        return set(cls(context={'request': request}).fields)
+
+    @classmethod
+    def sparse_queryset(cls, queryset, request, *always):
+        """
+        queryset loading only the columns the requested fields read, plus the
+        primary key and always (e.g. the pagination key). Joins that no
+        remaining field reads are dropped.
+        """
+        wanted, omitted = requested_fieldset(request)
+        if wanted is None and not omitted:
+            return queryset
 
+        paths = {queryset.model._meta.pk.name, *always}
+        for name, field in cls(context={'request': request}).fields.items():
+            columns = cls.sparse_columns.get(name)
+            if columns is None:
+                columns = _source_columns(queryset.model, field)
+            if columns is None:
+                # Can't tell what the field reads; load everything
+                return queryset
+            paths.update(columns)
 
-class AlbumSerializer(serializers.ModelSerializer):
+        def is_read(relation):
+            return any(path == relation or path.startswith(relation + '__') for path in paths)
+
+        joins = []
+        for relation in _select_related_paths(queryset.query.select_related):
+            parts = relation.split('__')
+            joins += [
+                prefix for prefix in ('__'.join(parts[:depth]) for depth in range(len(parts), 0, -1))
+                if is_read(prefix)
+            ][:1]
+
+        queryset = queryset.only(*paths)
+        if queryset.query.select_related:
+            queryset = queryset.select_related(None)
+            if joins:
+                queryset = queryset.select_related(*joins)
+        return queryset
+
+
+class AlbumListSerializer(serializers.ListSerializer):
+    """Loads the track titles of the whole page up front instead of once per album."""
+
+    def to_representation(self, data):
+        albums = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if 'song_set' not in self.child.fields:
+            return super().to_representation(albums)
+        self.child.track_titles = load_track_titles([album.pk for album in albums])
+        try:
+            return super().to_representation(albums)
+        finally:
+            self.child.track_titles = None
+
+
+class AlbumSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     song_set = serializers.SerializerMethodField()
+    cover_srcset = serializers.SerializerMethodField()
+
+    sparse_columns = {'song_set': (), 'cover_srcset': ('cover_image', 'cover_variants')}
+
+    # Filled in by AlbumListSerializer for list responses
+    track_titles = None
 
     class Meta:
         model = Album
+        list_serializer_class = AlbumListSerializer
         fields = [
-            'id', 'cover_image', 'title', 'artist_name', 'retail_price', 'format', 'release_date', 'slug', 'song_set'
+            'id', 'cover_image', 'cover_srcset', 'title', 'artist_name', 'retail_price', 'format', 'release_date',
+            'slug', 'song_set'
         ]
         read_only_fields = ['artist_account', 'slug']
 
@@ -22,15 +200,27 @@ class AlbumSerializer(serializers.ModelSerializer):
             )
         ]
 
+    def get_cover_srcset(self, obj):
+        """{'webp': 'url 160w, ...', 'jpeg': ...} for the resized cover copies, once generated."""
+        request = self.context.get('request')
+        srcset = {}
+        for image_format in ('webp', 'jpeg'):
+            urls = obj.cover_variant_urls(image_format)
+            if request is not None:
+                urls = [(width, request.build_absolute_uri(url)) for width, url in urls]
+            srcset[image_format] = ', '.join(f'{url} {width}w' for width, url in urls)
+        return srcset
+
     def get_song_set(self, obj):
-        return [song.title for song in obj.tracks.all()]
+        if self.track_titles is not None:
+            return self.track_titles.get(obj.pk, [])
+        # Single album: still read the titles as plain rows
+        return list(obj.tracks.order_by('position').values_list('title', flat=True))
 
     def create(self, validated_data):
-        user = self.context['request'].user
+        dottify_user = get_identity(self.context['request']).profile
 
-        try:
-            dottify_user = DottifyUser.objects.get(user=user)
-        except DottifyUser.DoesNotExist:
+        if dottify_user is None:
             # Is a safety net since this should ideally be caught by permissions
             raise serializers.ValidationError({"artist_account": _("No DottifyUser profile found for the logged-in user.")})
 
@@ -39,46 +229,254 @@ class AlbumSerializer(serializers.ModelSerializer):
         return Album.objects.create(**validated_data)
 
 
-class SongSerializer(serializers.ModelSerializer):
+class SongSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    all_time_rating = serializers.SerializerMethodField()
+    recent_rating = serializers.SerializerMethodField()
+
+    sparse_columns = {'all_time_rating': ('rating_summary',), 'recent_rating': ('rating_summary',)}
+
     # Ensuring position is provided during creation, others should be done automatically
     class Meta:
         model = Song
-        fields = ['id', 'title', 'length', 'album']
+        fields = ['id', 'title', 'length', 'album', 'all_time_rating', 'recent_rating']
         read_only_fields = ['position']
 
+    def _rating_summary(self, obj):
+        # Both rating fields share one summary lookup per song
+        if not hasattr(obj, '_rating_summary_cache'):
+            obj._rating_summary_cache = get_rating_summary(obj)
+        return obj._rating_summary_cache
+
+    def get_all_time_rating(self, obj):
+        summary = self._rating_summary(obj)
+        return summary.all_time_average if summary else None
+
+    def get_recent_rating(self, obj):
+        summary = self._rating_summary(obj)
+        return summary.recent_average if summary else None
+
     # Enforce Route 7 security requirement
     def create(self, validated_data):
-        user = self.context['request'].user
+        identity = get_identity(self.context['request'])
         album = validated_data.get('album')
 
-        # Group name localized
-        is_admin = user.groups.filter(name=_('DottifyAdmin')).exists()
-
-        if not is_admin:
-            try:
-                album_owner_user = album.artist_account.user
-            except AttributeError:
+        if not identity.is_admin:
+            if album.artist_account_id is None:
                 # Album is missing an artist_account link
                 raise serializers.ValidationError({"album": _("The album ownership cannot be verified.")})
 
-            if album_owner_user != user:
+            if identity.profile is None or album.artist_account_id != identity.profile.pk:
                 # If the user is not an Admin AND not the owner -> reject
                 raise serializers.ValidationError({"album": _("You are not authorized to add a song to this album.")})
 
         return Song.objects.create(**validated_data)
 
 
-class PlaylistSerializer(serializers.ModelSerializer):
+class TrackListSerializer(serializers.ListSerializer):
+    """
+    Validates a whole tracklist for one album (given in context['album']) and
+    inserts it with a single bulk_create, numbering positions in memory.
+    Errors are reported per row index.
+    """
+    max_tracks = 500
 
-    owner = serializers.CharField(source='owner.display_name', read_only=True)
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [_("Expected a list of songs.")]
+            })
+        if len(data) > self.max_tracks:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    _("At most %(count)s songs can be added at once.") % {'count': self.max_tracks}
+                ]
+            })
+
+        rows, errors = [], {}
+        for index, item in enumerate(data):
+            try:
+                rows.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors[index] = exc.detail
+                rows.append(None)
+
+        # Song titles must be unique within an album: one query for the whole list
+        titles = [row['title'] for row in rows if row]
+        taken = set(
+            Song.objects.filter(album=self.context['album'], title__in=titles).values_list('title', flat=True)
+        )
+        for index, row in enumerate(rows):
+            if row is None:
+                continue
+            if row['title'] in taken:
+                errors[index] = {'title': [_("A song with this title already exists on this album.")]}
+            taken.add(row['title'])
 
-    songs = serializers.HyperlinkedRelatedField(
-        many=True,
-        read_only=True,
-        view_name='song-detail'  # Automatically router generated
+        if errors:
+            raise serializers.ValidationError(errors)
+        return rows
+
+    def create(self, validated_data):
+        album = self.context['album']
+
+        with transaction.atomic():
+            last_position = Song.objects.filter(album=album).aggregate(Max('position'))['position__max'] or 0
+            songs = Song.objects.bulk_create([
+                Song(album=album, position=last_position + offset, **row)
+                for offset, row in enumerate(validated_data, start=1)
+            ])
+
+            # bulk_create skips the signals that maintain derived data
+            after_bulk_insert(Song, songs)
+
+        return songs
+
+
+class TrackSerializer(serializers.ModelSerializer):
+    """One row of a bulk tracklist upload; the album comes from the URL."""
+
+    class Meta:
+        model = Song
+        fields = ['id', 'title', 'length', 'position']
+        read_only_fields = ['id', 'position']
+        list_serializer_class = TrackListSerializer
+
+
+class RatingIngestListSerializer(serializers.ListSerializer):
+    """
+    Validates a burst of ratings, checking all their songs with one query, and
+    queues them on the rating buffer (dottify.ingest) rather than inserting
+    them. Errors are reported per row index.
+    """
+    max_ratings = 1000
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [_("Expected a list of ratings.")]
+            })
+        if len(data) > self.max_ratings:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    _("At most %(count)s ratings can be sent at once.") % {'count': self.max_ratings}
+                ]
+            })
+
+        rows, errors = [], {}
+        for index, item in enumerate(data):
+            try:
+                rows.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors[index] = exc.detail
+                rows.append(None)
+
+        songs = set(
+            Song.objects.filter(pk__in={row['song_id'] for row in rows if row}).values_list('pk', flat=True)
+        )
+        for index, row in enumerate(rows):
+            if row is not None and row['song_id'] not in songs:
+                errors[index] = {'song': [_("No song with this id.")]}
+
+        if errors:
+            raise serializers.ValidationError(errors)
+        return rows
+
+    def create(self, validated_data):
+        ingest.get_buffer().add((row['song_id'], row['stars']) for row in validated_data)
+        return validated_data
+
+
+class RatingIngestSerializer(serializers.ModelSerializer):
+    """One posted rating: stars from 0 to 5 in half steps, as Rating allows."""
+    song = serializers.IntegerField(source='song_id', min_value=1)
+    stars = serializers.DecimalField(
+        max_digits=2, decimal_places=1, min_value=Decimal('0.0'), max_value=Decimal('5.0'),
+        validators=[validate_half_step]
     )
 
+    class Meta:
+        model = Rating
+        fields = ['song', 'stars']
+        list_serializer_class = RatingIngestListSerializer
+
+
+def requested_expansions(request):
+    """Names given in ?expand=a,b (or repeated ?expand=) of a request, as a set."""
+    if request is None:
+        return set()
+    return _query_names(request, 'expand')
+
+
+class SongURLField(serializers.RelatedField):
+    """
+    song-detail URLs built from a template that is reversed once per serializer,
+    rather than calling reverse() for every song of every playlist.
+    """
+    view_name = 'song-detail'
+    placeholder = 'song-pk'
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('read_only', True)
+        super().__init__(**kwargs)
+        self._url_parts = None
+
+    def to_representation(self, value):
+        if self._url_parts is None:
+            request = self.context.get('request')
+            url = reverse(self.view_name, kwargs={'pk': self.placeholder},
+                          request=request, format=self.context.get('format'))
+            self._url_parts = url.rsplit(self.placeholder, 1)
+        prefix, suffix = self._url_parts
+        return f'{prefix}{value.pk}{suffix}'
+
+
+class PlaylistSongSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """A playlist's song inline, for ?expand=songs."""
+    url = SongURLField(source='*')
+
+    class Meta:
+        model = Song
+        fields = ['id', 'url', 'title', 'length']
+        read_only_fields = fields
+
+
+class PlaylistSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+
+    owner = serializers.CharField(source='owner.display_name', read_only=True)
+
+    # Automatically router generated song-detail URLs
+    songs = SongURLField(many=True)
+
     class Meta:
         model = Playlist
         fields = ['id', 'name', 'created_at', 'visibility', 'owner', 'songs']
-        read_only_fields = fields
\ No newline at end of file
+        read_only_fields = fields
+
+    @staticmethod
+    def prepare_queryset(queryset, request):
+        """
+        Joins the owners and prefetches the songs, so a page of playlists takes
+        a fixed number of queries; only the song columns the response shows are read.
+        """
+        queryset = queryset.select_related('owner')
+        if 'songs' not in PlaylistSerializer.requested_fields(request):
+            return queryset
+        song_fields = ['id', 'title', 'length'] if 'songs' in requested_expansions(request) else ['id']
+        return queryset.prefetch_related(Prefetch('songs', queryset=Song.objects.only(*song_fields)))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if 'songs' in requested_expansions(self.context.get('request')):
+            fields['songs'] = PlaylistSongSerializer(many=True, read_only=True)
+        return fields
+
+
+class CommentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    user_display_name = serializers.CharField(source='get_user_display_name', read_only=True)
+
+    sparse_columns = {'user_display_name': ('user__username', 'user__dottify_profile__display_name')}
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'comment_text', 'created_at', 'user_display_name']
+        read_only_fields = fields
@@ -0,0 +1,396 @@
+from django.contrib.auth.models import Group, User
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import aggregates, charts, images, search, stats
+from .identity import invalidate_identity
+from .models import Album, Comment, DottifyUser, Playlist, Rating, Song
+
+
+def _deleted_directly(origin, model):
+    """
+    True when the delete started from the model itself rather than cascading
+    from a parent, whose derived data is removed along with it.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+# --- Previous values of edited rows ---
+
+# Fields whose stored values the receivers below need to undo an edit
+TRACKED_FIELDS = {
+    Album: ('artist_account_id', 'cover_image'),
+    Rating: ('song_id', 'stars', 'created_at'),
+    Song: ('album_id', 'length'),
+    Playlist: ('visibility',),
+}
+
+
+def _previous(instance):
+    """Tracked field values as stored before this save, or None if unknown."""
+    previous = getattr(instance, '_loaded_values', None) or {}
+    fields = TRACKED_FIELDS[type(instance)]
+    if not all(name in previous for name in fields):
+        return None
+    return tuple(previous[name] for name in fields)
+
+
+def _current(instance):
+    return tuple(getattr(instance, name) for name in TRACKED_FIELDS[type(instance)])
+
+
+def remember_previous_values(sender, instance, raw, **kwargs):
+    # Instances that weren't fully loaded from the database (e.g. built with a pk)
+    # still need their stored values so an edit can be undone in derived data
+    if raw or instance._state.adding or _previous(instance):
+        return
+    stored = sender.objects.filter(pk=instance.pk).values(*TRACKED_FIELDS[sender]).first()
+    if stored:
+        instance._loaded_values = {**getattr(instance, '_loaded_values', {}), **stored}
+
+
+for tracked_model in TRACKED_FIELDS:
+    pre_save.connect(remember_previous_values, sender=tracked_model)
+
+
+# --- Rating aggregates ---
+
+@receiver(post_save, sender=Rating)
+def update_rating_aggregates_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return  # Fixtures are loaded raw; run rebuild_rating_aggregates afterwards
+
+    current = _current(instance)
+    previous = None if created else _previous(instance)
+    if previous == current:
+        return
+    if previous:
+        aggregates.apply_ratings([previous], sign=-1)
+    aggregates.apply_ratings([current])
+
+
+@receiver(post_delete, sender=Rating)
+def update_rating_aggregates_on_delete(sender, instance, origin=None, **kwargs):
+    if not _deleted_directly(origin, Rating):
+        return
+    aggregates.apply_ratings([_previous(instance) or _current(instance)], sign=-1)
+
+
+# --- Charts ---
+
+@receiver(post_save, sender=Rating)
+def update_charts_on_save(sender, instance, created, raw, **kwargs):
+    # New ratings are picked up by the next charts.refresh()
+    if raw or created:
+        return
+    previous, current = _previous(instance), _current(instance)
+    if previous != current:
+        charts.apply_rating_change(instance.pk, previous, current)
+
+
+@receiver(post_delete, sender=Rating)
+def update_charts_on_delete(sender, instance, origin=None, **kwargs):
+    # A deleted song or album takes its chart entries with it
+    if _deleted_directly(origin, Rating):
+        charts.apply_rating_change(instance.pk, _previous(instance) or _current(instance))
+
+
+@receiver(post_save, sender=Song)
+def move_song_chart_counts_on_save(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    previous = _previous(instance)
+    if previous and previous[0] != instance.album_id:
+        charts.move_song(instance.pk, previous[0], instance.album_id)
+
+
+@receiver(pre_delete, sender=Song)
+def remove_song_chart_counts_on_delete(sender, instance, origin=None, **kwargs):
+    # Read before the song's own entries cascade away; an album being
+    # deleted takes its entries with it
+    if _deleted_directly(origin, Song):
+        charts.move_song(instance.pk, (_previous(instance) or _current(instance))[0])
+
+
+# --- Full-text search index ---
+
+@receiver(post_save, sender=Album)
+def index_album_on_save(sender, instance, raw, **kwargs):
+    if not raw:
+        search.index_album(instance.pk)
+
+
+@receiver(post_delete, sender=Album)
+def remove_album_from_index(sender, instance, **kwargs):
+    search.remove_album(instance.pk)
+
+
+@receiver(post_save, sender=Song)
+def index_song_album_on_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    search.index_album(instance.album_id)
+    # A song moved to another album leaves its title behind in the old one
+    previous = _previous(instance)
+    if previous and previous[0] != instance.album_id:
+        search.index_album(previous[0])
+
+
+@receiver(post_delete, sender=Song)
+def index_song_album_on_delete(sender, instance, origin=None, **kwargs):
+    # When the album itself is being deleted its entry goes with it
+    if _deleted_directly(origin, Song):
+        search.index_album(instance.album_id)
+
+
+# --- Catalogue statistics snapshot ---
+# Deletes are counted whatever started them, cascades included
+
+@receiver(post_save, sender=DottifyUser)
+def count_user_on_save(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        stats.adjust(user_count=1)
+
+
+@receiver(post_delete, sender=DottifyUser)
+def count_user_on_delete(sender, instance, **kwargs):
+    stats.adjust(user_count=-1)
+
+
+@receiver(post_save, sender=Album)
+def count_album_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.adjust(album_count=1)
+    previous = None if created else _previous(instance)
+    stats.invalidate_artist_album_count(instance.artist_account_id, previous and previous[0])
+
+
+@receiver(post_delete, sender=Album)
+def count_album_on_delete(sender, instance, **kwargs):
+    stats.adjust(album_count=-1)
+    stats.invalidate_artist_album_count(instance.artist_account_id)
+
+
+def _is_public(visibility):
+    return int(visibility) == Playlist.Visibility.PUBLIC
+
+
+@receiver(post_save, sender=Playlist)
+def count_playlist_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = None if created else _previous(instance)
+    was_public = bool(previous) and _is_public(previous[0])
+    stats.adjust(public_playlist_count=int(_is_public(instance.visibility)) - int(was_public))
+
+
+@receiver(post_delete, sender=Playlist)
+def count_playlist_on_delete(sender, instance, **kwargs):
+    visibility = (_previous(instance) or _current(instance))[0]
+    if _is_public(visibility):
+        stats.adjust(public_playlist_count=-1)
+
+
+@receiver(post_save, sender=Song)
+def count_song_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.adjust(song_count=1, song_length_sum=instance.length)
+        return
+    previous = _previous(instance)
+    if previous:
+        stats.adjust(song_length_sum=instance.length - previous[1])
+
+
+@receiver(post_delete, sender=Song)
+def count_song_on_delete(sender, instance, **kwargs):
+    length = (_previous(instance) or _current(instance))[1]
+    stats.adjust(song_count=-1, song_length_sum=-length)
+
+
+# --- Cached request identities ---
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_identity_on_group_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_identity(instance.pk)
+    elif action == 'pre_clear':
+        invalidate_identity(*instance.user_set.values_list('pk', flat=True))
+    else:
+        invalidate_identity(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+def invalidate_identity_on_group_rename(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_identity(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_identity_on_group_delete(sender, instance, **kwargs):
+    invalidate_identity(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=DottifyUser)
+@receiver(post_delete, sender=DottifyUser)
+def invalidate_identity_on_profile_change(sender, instance, **kwargs):
+    invalidate_identity(instance.user_id)
+
+
+# --- Cover image variants ---
+
+@receiver(post_save, sender=Album)
+def schedule_cover_variants_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    cover_name = instance.cover_image.name if instance.cover_image else None
+    if not images.has_own_cover(cover_name):
+        # Variants of a previous cover are ignored once it no longer matches
+        return
+    previous = None if created else _previous(instance)
+    if created or previous is None or previous[1] != cover_name:
+        images.schedule_cover_variants(instance.pk)
+
+
+# --- Versions for conditional GETs ---
+# Saving a versioned row bumps its own version; these bump the rows whose
+# representation includes it.
+
+@receiver(post_save, sender=Album)
+def touch_songs_on_album_save(sender, instance, created, raw, **kwargs):
+    # Song pages show their album's title and link
+    if not (created or raw):
+        Song.touch(album_id=instance.pk)
+
+
+@receiver(post_save, sender=Song)
+def touch_album_on_song_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    previous = _previous(instance)
+    album_ids = {instance.album_id, previous[0] if previous else instance.album_id}
+    Album.touch(pk__in=album_ids)
+    Playlist.touch(songs=instance)
+
+
+@receiver(pre_delete, sender=Song)
+def touch_playlists_on_song_delete(sender, instance, **kwargs):
+    # Playlist memberships are removed without an m2m_changed signal
+    Playlist.touch(songs=instance)
+
+
+@receiver(post_delete, sender=Song)
+def touch_album_on_song_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(origin, Song):
+        Album.touch(pk=instance.album_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_album_on_comment_change(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or (origin is not None and not _deleted_directly(origin, Comment)):
+        return
+    Album.touch(pk=instance.album_id)
+
+
+@receiver(m2m_changed, sender=Playlist.songs.through)
+def touch_playlist_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        Playlist.touch(pk=instance.pk)
+    elif action == 'pre_clear':
+        Playlist.touch(songs=instance)
+    else:
+        Playlist.touch(pk__in=pk_set)
+
+
+@receiver(post_save, sender=DottifyUser)
+def touch_on_display_name_change(sender, instance, created, raw, **kwargs):
+    # Playlists show their owner's name, album pages their commenters' names
+    if created or raw:
+        return
+    Playlist.touch(owner=instance)
+    Album.touch(pk__in=Comment.objects.filter(user__dottify_profile=instance).values('album_id'))
+
+
+# --- Bulk inserts ---
+# bulk_create sends no signals. Every bulk path (track uploads, the data
+# wizard importer, the rating buffer, the seed command) calls
+# after_bulk_insert() instead, so what the receivers above do for a created
+# row lives here too, next to them.
+
+_BULK_INSERT_HANDLERS = {}
+
+
+def _after_bulk_insert_of(model):
+    def register(handler):
+        _BULK_INSERT_HANDLERS[model] = handler
+        return handler
+    return register
+
+
+def after_bulk_insert(model, rows):
+    """What the post_save (or m2m_changed) receivers do for created rows of model, for a whole batch."""
+    rows = list(rows)
+    handler = _BULK_INSERT_HANDLERS.get(model)
+    if rows and handler is not None:
+        handler(rows)
+
+
+@_after_bulk_insert_of(DottifyUser)
+def _profiles_inserted(profiles):
+    stats.adjust(user_count=len(profiles))
+    invalidate_identity(*(profile.user_id for profile in profiles))
+
+
+@_after_bulk_insert_of(User.groups.through)
+def _group_memberships_inserted(memberships):
+    invalidate_identity(*{membership.user_id for membership in memberships})
+
+
+@_after_bulk_insert_of(Album)
+def _albums_inserted(albums):
+    stats.adjust(album_count=len(albums))
+    stats.invalidate_artist_album_count(*{album.artist_account_id for album in albums})
+    search.index_albums(album.pk for album in albums)
+    for album in albums:
+        if images.has_own_cover(album.cover_image.name):
+            images.schedule_cover_variants(album.pk)
+
+
+@_after_bulk_insert_of(Song)
+def _songs_inserted(songs):
+    album_ids = {song.album_id for song in songs}
+    stats.adjust(song_count=len(songs), song_length_sum=sum(song.length for song in songs))
+    search.index_albums(album_ids)
+    Album.touch(pk__in=album_ids)
+
+
+@_after_bulk_insert_of(Rating)
+def _ratings_inserted(ratings):
+    # New ratings are picked up by the next charts.refresh()
+    aggregates.apply_ratings(_current(rating) for rating in ratings)
+
+
+@_after_bulk_insert_of(Comment)
+def _comments_inserted(comments):
+    Album.touch(pk__in={comment.album_id for comment in comments})
+
+
+@_after_bulk_insert_of(Playlist)
+def _playlists_inserted(playlists):
+    stats.adjust(public_playlist_count=sum(_is_public(playlist.visibility) for playlist in playlists))
+
+
+@_after_bulk_insert_of(Playlist.songs.through)
+def _playlist_songs_inserted(memberships):
+    Playlist.touch(pk__in={membership.playlist_id for membership in memberships})
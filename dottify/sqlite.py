@@ -0,0 +1,59 @@
+# The production SQLite profile: settings for a database file that serves
+# many concurrent requests, e.g. ratings, comments and track uploads at once.
+#
+# - WAL lets readers carry on while a write is in progress, and writers no
+#   longer wait for readers to finish.
+# - Transactions begin IMMEDIATE, taking the write lock up front. A deferred
+#   transaction that reads and then writes can't wait for the lock (SQLite
+#   would deadlock), so it fails with "database is locked" however long the
+#   busy timeout; an immediate one just queues for up to the timeout.
+# - synchronous=NORMAL is safe under WAL: a power cut may lose the last
+#   commits, but never corrupts the file.
+# - Under WSGI, connections can persist across requests (conn_max_age), so
+#   the pragmas and the page cache aren't set up again for every request.
+#   Leave it at 0 under ASGI: sync code runs on a thread per request there,
+#   so persistent connections are never reused and pile up until collected.
+#
+# manage.py bench_sqlite compares it with Django's defaults.
+
+# Seconds a connection waits for the write lock before giving up
+BUSY_TIMEOUT = 20
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # Negative sizes are in KiB: 64 MiB of page cache per connection
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    # Keep the WAL file from growing unchecked between checkpoints
+    'journal_size_limit': 64 * 1024 * 1024,
+}
+
+# Seconds a connection may be reused for, when running under WSGI
+CONN_MAX_AGE = 600
+
+
+def init_command(pragmas=None):
+    """The pragmas as the ;-separated init_command Django runs on every new connection."""
+    pragmas = PRAGMAS if pragmas is None else pragmas
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())
+
+
+def production_database(name, conn_max_age=0, **overrides):
+    """
+    A DATABASES entry for the SQLite file name, in the production profile.
+    Connections are closed after each request unless conn_max_age is given.
+    """
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'OPTIONS': {
+            'timeout': BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': init_command(),
+        },
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        **overrides,
+    }
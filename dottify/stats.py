@@ -0,0 +1,127 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Album, CatalogStatistics, DottifyUser, Playlist, Song
+
+CACHE_KEY = 'dottify:statistics'
+
+COUNTER_FIELDS = ('user_count', 'album_count', 'public_playlist_count', 'song_count', 'song_length_sum')
+
+
+def get_max_age():
+    """Seconds a served snapshot may be reused before the row is read again."""
+    return getattr(settings, 'DOTTIFY_STATISTICS_MAX_AGE', 30)
+
+
+def count_from_tables():
+    """The counters as they would be computed from scratch."""
+    songs = Song.objects.aggregate(count=Count('id'), length=Sum('length'))
+    return {
+        'user_count': DottifyUser.objects.count(),
+        'album_count': Album.objects.count(),
+        'public_playlist_count': Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC).count(),
+        'song_count': songs['count'],
+        'song_length_sum': songs['length'] or 0,
+    }
+
+
+def load_snapshot():
+    """The snapshot row, recreated from the tables if it has gone missing."""
+    snapshot = CatalogStatistics.objects.filter(pk=CatalogStatistics.SINGLETON_PK).first()
+    if snapshot is None:
+        snapshot, _created = CatalogStatistics.objects.get_or_create(
+            pk=CatalogStatistics.SINGLETON_PK,
+            defaults=count_from_tables()
+        )
+    return snapshot
+
+
+def invalidate():
+    cache.delete(CACHE_KEY)
+    # Readers in between may have cached pre-commit values; drop those too
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
+
+
+def adjust(**deltas):
+    """Applies counter deltas, e.g. adjust(song_count=1, song_length_sum=200)."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    updated = CatalogStatistics.objects.filter(pk=CatalogStatistics.SINGLETON_PK).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated:
+        # Recounting already includes the change being applied
+        load_snapshot()
+    invalidate()
+
+
+def snapshot_data(snapshot):
+    return {
+        'user_count': snapshot.user_count,
+        'album_count': snapshot.album_count,
+        'public_playlist_count': snapshot.public_playlist_count,
+        'song_length_average': float(snapshot.song_length_average),
+    }
+
+
+def get_statistics():
+    """API payload, served from the cache for up to get_max_age() seconds."""
+    data = cache.get(CACHE_KEY)
+    if data is None:
+        data = snapshot_data(load_snapshot())
+        cache.set(CACHE_KEY, data, get_max_age())
+    return data
+
+
+async def aget_statistics():
+    """get_statistics for async views, using the async cache and ORM APIs."""
+    data = await cache.aget(CACHE_KEY)
+    if data is None:
+        snapshot = await CatalogStatistics.objects.filter(pk=CatalogStatistics.SINGLETON_PK).afirst()
+        if snapshot is None:
+            snapshot = await sync_to_async(load_snapshot)()
+        data = snapshot_data(snapshot)
+        await cache.aset(CACHE_KEY, data, get_max_age())
+    return data
+
+
+def reconcile():
+    """
+    Overwrites the snapshot with freshly counted values.
+    Returns {field: (stored, actual)} for every counter that had drifted.
+    """
+    with transaction.atomic():
+        actual = count_from_tables()
+        snapshot = load_snapshot()
+        drift = {
+            name: (getattr(snapshot, name), actual[name])
+            for name in COUNTER_FIELDS
+            if getattr(snapshot, name) != actual[name]
+        }
+        if drift:
+            CatalogStatistics.objects.filter(pk=snapshot.pk).update(**actual)
+    invalidate()
+    return drift
+
+
+# --- Per-artist album counts for the home page ---
+
+def _artist_album_count_key(profile_id):
+    return f'dottify:artist-album-count:{profile_id}'
+
+
+def artist_album_count(profile_id):
+    return cache.get_or_set(
+        _artist_album_count_key(profile_id),
+        lambda: Album.objects.filter(artist_account_id=profile_id).count(),
+        get_max_age()
+    )
+
+
+def invalidate_artist_album_count(*profile_ids):
+    cache.delete_many([_artist_album_count_key(pk) for pk in profile_ids if pk is not None])
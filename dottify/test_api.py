@@ -1,8 +1,28 @@
-from rest_framework.test import APITestCase
+import csv
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User, Group
-from .models import Album, DottifyUser
+from . import aggregates, charts, ingest, routers, stats
+from .aggregates import normalise_stars
+from .models import Album, AlbumChartEntry, DottifyUser, Playlist, Rating, Song, SongChartEntry
+from .pagination import KeysetPagination
 
 class CustomTestSheetD_API(APITestCase):
     def setUp(self):
@@ -53,3 +73,799 @@ class CustomTestSheetD_API(APITestCase):
         # Verify the album title WAS changed
         self.album.refresh_from_db()
         self.assertEqual(self.album.title, 'Updated Title by Owner')
+
+
+class KeysetPaginationAPITests(APITestCase):
+    def setUp(self):
+        for index in range(5):
+            album = Album.objects.create(
+                title=f'Album {index}', artist_name='Paged Artist',
+                format='SNGL', release_date='2023-01-01', retail_price='5.00'
+            )
+            Song.objects.create(title=f'Track {index}', album=album, length=100)
+
+    def follow(self, url, rel='next'):
+        """Collects every page reachable from url through the Link header."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            links = dict((r, u) for u, r in re.findall(r'<([^>]+)>; rel="(\w+)"', response.get('Link', '')))
+            url = links.get(rel)
+        return pages
+
+    def test_album_list_pages_cover_every_album_once(self):
+        """Page size is honoured and following next links yields every album in id order."""
+        pages = self.follow('/api/albums/?page_size=2')
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        ids = [album['id'] for page in pages for album in page]
+        self.assertEqual(ids, list(Album.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_previous_link_walks_back(self):
+        """The prev link of the last page returns the preceding page."""
+        response = self.client.get('/api/songs/?page_size=2')
+        next_url = re.search(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+        second_page = self.client.get(next_url)
+        prev_url = re.search(r'<([^>]+)>; rel="prev"', second_page['Link']).group(1)
+
+        self.assertEqual(self.client.get(prev_url).json(), response.json())
+
+    def test_song_pages_step_over_null_positions(self):
+        """Songs without a position sort first in their album and page like any other."""
+        Song.objects.create(title='Bonus', album=Song.objects.get(title='Track 1').album, length=100)
+        Song.objects.filter(title__in=['Track 1', 'Track 3']).update(position=None)
+        songs = Song.objects.values_list('album_id', 'position', 'id')
+        expected = [pk for _album, _position, pk in sorted(
+            songs, key=lambda song: (song[0], song[1] is not None, song[1] or 0, song[2])
+        )]
+
+        pages = self.follow('/api/songs/?page_size=1')
+        self.assertEqual([song['id'] for page in pages for song in page], expected)
+
+        # And back again from the last page
+        last = self.client.get('/api/songs/?page_size=1')
+        for _ in range(len(expected) - 1):
+            last = self.client.get(re.search(r'<([^>]+)>; rel="next"', last['Link']).group(1))
+        prev_url = re.search(r'<([^>]+)>; rel="prev"', last['Link']).group(1)
+        pages = self.follow(prev_url, rel='prev')
+        self.assertEqual([song['id'] for page in pages for song in page], expected[-2::-1])
+
+    def test_page_size_is_capped_and_bad_cursor_rejected(self):
+        """Clients cannot exceed the server cap, and forged cursors give 404."""
+        with mock.patch.object(KeysetPagination, 'max_page_size', 3):
+            response = self.client.get('/api/albums/?page_size=1000')
+        self.assertEqual(len(response.json()), 3)
+
+        response = self.client.get('/api/albums/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_album_list_query_count_does_not_grow_with_albums(self):
+        """Track titles for a page of albums are loaded in one query, in position order."""
+        album = Album.objects.get(title='Album 0')
+        Song.objects.create(title='Second Track', album=album, length=100)
+
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get('/api/albums/?page_size=2')
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get('/api/albums/?page_size=5')
+
+        self.assertEqual(len(small_page), len(large_page))
+        self.assertLessEqual(len(large_page), 2)
+        self.assertEqual(response.json()[0]['song_set'], ['Track 0', 'Second Track'])
+
+    def test_album_api_search_uses_full_text_index(self):
+        """?search= matches track titles and prefixes, and survives an index rebuild."""
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        response = self.client.get('/api/albums/?search=trac 3')
+        self.assertEqual([album['title'] for album in response.json()], ['Album 3'])
+
+
+class StatisticsSnapshotAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='listener', password='password')
+        self.profile = DottifyUser.objects.create(user=user, display_name='Listener')
+        self.album = Album.objects.create(
+            title='Stats Album', artist_name='Stats Artist',
+            format='SNGL', release_date='2023-01-01', retail_price='5.00'
+        )
+        Song.objects.create(title='Short', album=self.album, length=100)
+        Song.objects.create(title='Long', album=self.album, length=300)
+        self.playlist = Playlist.objects.create(name='Mix', owner=self.profile, visibility=Playlist.Visibility.PUBLIC)
+
+    def test_statistics_follow_writes_without_counting(self):
+        """The endpoint reflects saves, edits and cascading deletes from the snapshot alone."""
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/statistics/').json()
+        self.assertEqual(data, {
+            'user_count': 1, 'album_count': 1, 'public_playlist_count': 1, 'song_length_average': 200.0
+        })
+
+        self.playlist.visibility = Playlist.Visibility.HIDDEN
+        self.playlist.save()
+        self.album.delete()
+
+        data = self.client.get('/api/statistics/').json()
+        self.assertEqual(data['public_playlist_count'], 0)
+        self.assertEqual(data['album_count'], 0)
+        self.assertEqual(data['song_length_average'], 0.0)
+
+    def test_reconcile_statistics_corrects_drift(self):
+        """Bulk writes that skip signals are repaired by the reconcile command."""
+        Album.objects.bulk_create([Album(
+            title='Bulk Album', artist_name='Bulk Artist', release_date='2023-01-01'
+        )])
+
+        call_command('reconcile_statistics', stdout=StringIO())
+
+        self.assertEqual(self.client.get('/api/statistics/').json()['album_count'], 2)
+        self.assertEqual(stats.reconcile(), {})
+
+
+class BulkTrackUploadAPITests(APITestCase):
+    def setUp(self):
+        self.artist_group = Group.objects.create(name='Artist')
+        self.artist_user = User.objects.create_user(username='artist', password='password')
+        self.artist_user.groups.add(self.artist_group)
+        self.other_user = User.objects.create_user(username='other', password='password')
+        self.other_user.groups.add(self.artist_group)
+
+        profile = DottifyUser.objects.create(user=self.artist_user, display_name='Bulk Artist')
+        DottifyUser.objects.create(user=self.other_user, display_name='Other Artist')
+        self.album = Album.objects.create(
+            title='Long Player', artist_name='Bulk Artist', artist_account=profile,
+            format='DLUX', release_date='2023-01-01', retail_price='9.99'
+        )
+        Song.objects.create(title='Opener', album=self.album, length=120)
+        self.url = f'/api/albums/{self.album.pk}/songs/'
+
+    def test_bulk_upload_assigns_positions_in_few_queries(self):
+        """A 30 track list is inserted in one go, numbered after the existing tracks."""
+        self.client.login(username='artist', password='password')
+        tracks = [{'title': f'Track {index}', 'length': 100 + index} for index in range(30)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, tracks, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertLess(len(queries), 20)
+        positions = list(self.album.tracks.order_by('position').values_list('position', flat=True))
+        self.assertEqual(positions, list(range(1, 32)))
+        self.assertEqual(response.json()[-1]['position'], 31)
+
+    def test_bulk_upload_reports_errors_per_row_and_inserts_nothing(self):
+        """Invalid and duplicate rows are reported by index and the whole list is rejected."""
+        self.client.login(username='artist', password='password')
+        tracks = [
+            {'title': 'Fine', 'length': 100},
+            {'title': 'Too Short', 'length': 5},
+            {'title': 'Opener', 'length': 100},
+            {'title': 'Fine', 'length': 200},
+        ]
+
+        response = self.client.post(self.url, tracks, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sorted(response.json()), ['1', '2', '3'])
+        self.assertEqual(self.album.tracks.count(), 1)
+
+    def test_bulk_upload_requires_album_owner(self):
+        """Artists cannot add tracks to someone else's album."""
+        self.client.login(username='other', password='password')
+        response = self.client.post(self.url, [{'title': 'Intruder', 'length': 100}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.album.tracks.count(), 1)
+
+
+class ConditionalGetAPITests(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='poller', password='password')
+        self.profile = DottifyUser.objects.create(user=user, display_name='Poller')
+        self.album = Album.objects.create(
+            title='Polled Album', artist_name='Polled Artist',
+            format='SNGL', release_date='2023-01-01', retail_price='5.00'
+        )
+        self.song = Song.objects.create(title='Polled Song', album=self.album, length=200)
+        self.playlist = Playlist.objects.create(name='Polled', owner=self.profile, visibility=Playlist.Visibility.PUBLIC)
+
+    def assertRevalidates(self, url):
+        """A repeated GET with the ETag is a 304 answered by one query; returns the ETag."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers['ETag'], etag)
+        return etag
+
+    def test_album_etag_follows_tracks_and_comments(self):
+        url = f'/api/albums/{self.album.pk}/'
+        etag = self.assertRevalidates(url)
+
+        Song.objects.create(title='Another Song', album=self.album, length=100)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Another Song', response.json()['song_set'])
+
+        etag = response.headers['ETag']
+        self.album.comments.create(user=self.profile.user, comment_text='Nice')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_album_last_modified(self):
+        url = f'/api/albums/{self.album.pk}/'
+        last_modified = self.client.get(url).headers['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_saving_an_instance_loaded_before_a_touch_changes_the_etag(self):
+        url = f'/api/albums/{self.album.pk}/'
+        stale = Album.objects.get(pk=self.album.pk)
+        # Touches the album
+        Song.objects.create(title='Another Song', album=self.album, length=100)
+        etag = self.client.get(url).headers['ETag']
+
+        stale.title = 'Renamed Album'
+        stale.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['title'], 'Renamed Album')
+
+    def test_song_etag_follows_ratings(self):
+        url = f'/api/songs/{self.song.pk}/'
+        etag = self.assertRevalidates(url)
+
+        Rating.objects.create(song=self.song, stars=4)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['all_time_rating'], 4.0)
+
+    def test_playlist_list_etag_follows_membership_and_visibility(self):
+        url = '/api/playlists/'
+        etag = self.assertRevalidates(url)
+
+        self.playlist.songs.add(self.song)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response.headers['ETag']
+        self.playlist.visibility = Playlist.Visibility.HIDDEN
+        self.playlist.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [])
+
+    def test_playlist_etag_follows_owner_rename(self):
+        url = f'/api/playlists/{self.playlist.pk}/'
+        etag = self.assertRevalidates(url)
+
+        self.profile.display_name = 'Renamed'
+        self.profile.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class PlaylistListAPITests(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='curator', password='password')
+        self.profile = DottifyUser.objects.create(user=user, display_name='Curator')
+        album = Album.objects.create(
+            title='Mix Source', artist_name='Mix Artist',
+            format='SNGL', release_date='2023-01-01', retail_price='5.00'
+        )
+        self.songs = [Song.objects.create(title=f'Mix Song {i}', album=album, length=100 + i) for i in range(3)]
+
+    def add_playlists(self, count):
+        for _ in range(count):
+            playlist = Playlist.objects.create(name='Mix', owner=self.profile, visibility=Playlist.Visibility.PUBLIC)
+            playlist.songs.add(*self.songs)
+
+    def test_playlist_list_query_count_does_not_grow_with_playlists(self):
+        self.add_playlists(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/playlists/')
+        self.add_playlists(4)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/playlists/')
+
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(response.json()), 6)
+        self.assertEqual(response.json()[0]['owner'], 'Curator')
+        self.assertEqual(
+            response.json()[0]['songs'],
+            [f'http://testserver{reverse("song-detail", args=[song.pk])}' for song in self.songs]
+        )
+
+    def test_expand_songs_embeds_title_and_length(self):
+        self.add_playlists(1)
+        response = self.client.get('/api/playlists/?expand=songs')
+
+        song = self.songs[0]
+        self.assertEqual(response.json()[0]['songs'][0], {
+            'id': song.pk, 'url': f'http://testserver{reverse("song-detail", args=[song.pk])}',
+            'title': 'Mix Song 0', 'length': 100,
+        })
+        # Expanded and plain listings are cached separately
+        self.assertNotEqual(response.headers['ETag'], self.client.get('/api/playlists/').headers['ETag'])
+
+
+class SparseFieldsetAPITests(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='mobile', password='password')
+        self.profile = DottifyUser.objects.create(user=user, display_name='Mobile')
+        self.album = Album.objects.create(
+            title='Sparse Album', artist_name='Sparse Artist',
+            format='SNGL', release_date='2023-01-01', retail_price='5.00'
+        )
+        self.song = Song.objects.create(title='Sparse Song', album=self.album, length=200)
+        Rating.objects.create(song=self.song, stars=4)
+        self.album.comments.create(user=user, comment_text='Lean')
+        playlist = Playlist.objects.create(name='Sparse Mix', owner=self.profile, visibility=Playlist.Visibility.PUBLIC)
+        playlist.songs.add(self.song)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), [query['sql'] for query in queries]
+
+    def test_album_fields_skip_tracks_and_unread_columns(self):
+        data, queries = self.get('/api/albums/?fields=id,title')
+        self.assertEqual(data, [{'id': self.album.pk, 'title': 'Sparse Album'}])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('cover_image', queries[0])
+
+        data, queries = self.get(f'/api/albums/{self.album.pk}/?omit=cover_image,cover_srcset')
+        self.assertEqual(data['song_set'], ['Sparse Song'])
+        self.assertNotIn('cover_srcset', data)
+
+    def test_song_fields_skip_rating_join(self):
+        data, queries = self.get(f'/api/albums/{self.album.pk}/songs/?fields=title')
+        self.assertEqual(data, [{'title': 'Sparse Song'}])
+        self.assertFalse(any('ratingsummary' in sql for sql in queries))
+
+        data, _queries = self.get(f'/api/songs/{self.song.pk}/?fields=id,all_time_rating')
+        self.assertEqual(data, {'id': self.song.pk, 'all_time_rating': 4.0})
+
+    def test_comment_and_playlist_fields(self):
+        data, _queries = self.get(f'/api/albums/{self.album.pk}/comments/?fields=user_display_name')
+        self.assertEqual(data, [{'user_display_name': 'Mobile'}])
+
+        data, queries = self.get('/api/playlists/?fields=name,owner')
+        self.assertEqual(data, [{'name': 'Sparse Mix', 'owner': 'Mobile'}])
+        self.assertFalse(any('dottify_playlist_songs' in sql for sql in queries))
+
+    async def test_async_endpoints_honour_fields(self):
+        response = await self.async_client.get('/api/async/albums/?fields=id,title')
+        self.assertEqual(response.json(), [{'id': self.album.pk, 'title': 'Sparse Album'}])
+        response = await self.async_client.get(f'/api/async/albums/{self.album.pk}/songs/?omit=all_time_rating')
+        self.assertEqual(response.json()[0]['recent_rating'], 4.0)
+
+
+class CatalogExportAPITests(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='partner', password='password')
+        self.profile = DottifyUser.objects.create(user=user, display_name='Partner')
+        self.album = Album.objects.create(
+            title='Exported', artist_name='Export Artist',
+            format='SNGL', release_date='2023-01-01', retail_price='5.00'
+        )
+        Album.objects.create(title='Empty', artist_name='Export Artist', release_date='2023-02-01')
+        self.first = Song.objects.create(title='First', album=self.album, length=100)
+        self.second = Song.objects.create(title='Second', album=self.album, length=200)
+        playlist = Playlist.objects.create(name='Shared', owner=self.profile, visibility=Playlist.Visibility.PUBLIC)
+        playlist.songs.add(self.second)
+        playlist.songs.add(self.first)
+        Playlist.objects.create(name='Hidden', owner=self.profile, visibility=Playlist.Visibility.HIDDEN)
+
+    def stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_album_ndjson_embeds_tracks_in_order(self):
+        response, body = self.stream('/api/export/albums/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        documents = [json.loads(line) for line in body.splitlines()]
+
+        self.assertEqual([document['title'] for document in documents], ['Exported', 'Empty'])
+        self.assertEqual(documents[0]['retail_price'], '5.00')
+        self.assertEqual(documents[0]['tracks'], [
+            {'id': self.first.pk, 'title': 'First', 'length': 100, 'position': 1},
+            {'id': self.second.pk, 'title': 'Second', 'length': 200, 'position': 2},
+        ])
+        self.assertEqual(documents[1]['tracks'], [])
+
+    def test_export_reads_two_queries_whatever_the_size(self):
+        for index in range(5):
+            album = Album.objects.create(title=f'Bulk {index}', artist_name='Bulk', release_date='2023-01-01')
+            Song.objects.create(title='Track', album=album, length=100)
+        with self.settings(DOTTIFY_EXPORT_CHUNK_SIZE=2), CaptureQueriesContext(connection) as queries:
+            _response, body = self.stream('/api/export/albums/')
+        self.assertEqual(len(body.splitlines()), 7)
+        self.assertEqual(len(queries), 2)
+
+    def test_album_csv_has_a_row_per_track(self):
+        _response, body = self.stream('/api/export/albums/?format=csv')
+        rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(rows[0][:2], ['id', 'title'])
+        self.assertEqual([(row[1], row[-3]) for row in rows[1:]], [('Exported', 'First'), ('Exported', 'Second'), ('Empty', '')])
+
+    def test_playlist_export_lists_public_playlists_and_song_ids(self):
+        _response, body = self.stream('/api/export/playlists/')
+        documents = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(documents[0]['owner'], 'Partner')
+        self.assertEqual(documents[0]['songs'], [self.second.pk, self.first.pk])
+
+        _response, body = self.stream('/api/export/playlists/?format=csv')
+        self.assertEqual(body.splitlines()[1].split(',')[-1], f'{self.second.pk} {self.first.pk}')
+
+        self.assertEqual(self.client.get('/api/export/playlists/?format=xml').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(DOTTIFY_CHART_MIN_VOTES=2)
+class ChartAPITests(APITestCase):
+    def setUp(self):
+        self.album = Album.objects.create(title='Charting', artist_name='Chart Artist', release_date='2023-01-01')
+        self.other_album = Album.objects.create(title='One Hit', artist_name='Other', release_date='2023-01-01')
+        self.first = Song.objects.create(title='First', album=self.album, length=100)
+        self.second = Song.objects.create(title='Second', album=self.album, length=100)
+        self.single = Song.objects.create(title='Single', album=self.other_album, length=100)
+
+    def rate(self, song, stars, days_ago=0):
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(days=days_ago)):
+            return Rating.objects.create(song=song, stars=stars)
+
+    def assert_entries_match_ratings(self):
+        state = charts.load_state()
+        expected = {
+            key: (count, total) for key, (count, total) in
+            charts.compute_from_ratings(state.day, state.rating_watermark).items() if count
+        }
+        stored = {
+            (entry.song_id, entry.window): (entry.rating_count, normalise_stars(entry.stars_sum))
+            for entry in SongChartEntry.objects.all()
+        }
+        self.assertEqual(stored, expected)
+
+        # Album entries are kept incrementally, as the sums of their songs'
+        albums = dict(Song.objects.values_list('pk', 'album_id'))
+        expected_albums = defaultdict(lambda: (0, Decimal('0.0')))
+        for (song_id, window), (count, total) in expected.items():
+            album_count, album_total = expected_albums[(albums[song_id], window)]
+            expected_albums[(albums[song_id], window)] = (album_count + count, album_total + total)
+        stored_albums = {
+            (entry.album_id, entry.window): (entry.rating_count, normalise_stars(entry.stars_sum))
+            for entry in AlbumChartEntry.objects.all()
+        }
+        self.assertEqual(stored_albums, dict(expected_albums))
+
+    def chart(self, path):
+        response = self.client.get(f'/api/charts/{path}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(entry['title'], entry['rating_count'], entry['average']) for entry in response.json()['results']]
+
+    def test_charts_rank_by_average_among_songs_with_enough_votes(self):
+        for stars in (5, 5):
+            self.rate(self.first, stars)
+        for stars in (4, 4, 4):
+            self.rate(self.second, stars)
+        self.rate(self.single, 5)
+
+        self.assertEqual(self.chart('songs/'), [('First', 2, 5.0), ('Second', 3, 4.0)])
+        self.assertEqual(self.chart('songs/?by=volume&limit=2'), [('Second', 3, 4.0), ('First', 2, 5.0)])
+        self.assertEqual(self.chart('albums/'), [('Charting', 5, 4.4)])
+        self.assertEqual(self.chart('albums/?by=volume'), [('Charting', 5, 4.4), ('One Hit', 1, 5.0)])
+
+    def test_windows_only_count_their_days(self):
+        self.rate(self.first, 5, days_ago=3)
+        self.rate(self.first, 3, days_ago=20)
+        self.rate(self.first, 1, days_ago=60)
+        self.rate(self.first, 1, days_ago=120)
+
+        self.assertEqual(self.chart('songs/?by=volume&window=7'), [('First', 1, 5.0)])
+        self.assertEqual(self.chart('songs/?by=volume&window=30'), [('First', 2, 4.0)])
+        self.assertEqual(self.chart('songs/?window=90'), [('First', 3, 3.0)])
+
+    def test_chart_reads_the_rollups_not_ratings(self):
+        self.rate(self.first, 5)
+        self.rate(self.first, 4)
+        self.chart('songs/')
+        with CaptureQueriesContext(connection) as queries:
+            self.chart('songs/?by=volume')
+            self.chart('albums/')
+        self.assertFalse([query for query in queries if 'dottify_rating"' in query['sql']])
+
+    def test_incremental_refresh_matches_a_rebuild(self):
+        today = timezone.localdate()
+        old = self.rate(self.first, 4, days_ago=5)
+        self.rate(self.second, 2, days_ago=25)
+        self.rate(self.single, 3, days_ago=80)
+        charts.refresh()
+        self.assert_entries_match_ratings()
+
+        # New ratings, and changes to ones already counted
+        self.rate(self.second, 5)
+        self.rate(self.single, 1)
+        old.stars = 1
+        old.save()
+        Rating.objects.get(song=self.single, stars=3).delete()
+        charts.refresh()
+        self.assert_entries_match_ratings()
+
+        # Days drop out of the windows as they move on
+        for days in (3, 10, 30, 100):
+            with self.subTest(days=days):
+                charts.refresh(today + timedelta(days=days))
+                self.assert_entries_match_ratings()
+        self.assertFalse(SongChartEntry.objects.exists())
+
+    def test_album_entries_follow_moved_and_deleted_songs(self):
+        self.rate(self.first, 4)
+        self.rate(self.second, 2)
+        charts.refresh()
+
+        self.second.album = self.other_album
+        self.second.save()
+        self.assert_entries_match_ratings()
+        self.first.delete()
+        self.assert_entries_match_ratings()
+        self.assertEqual(self.chart('albums/?by=volume'), [('One Hit', 1, 2.0)])
+
+    def test_stale_charts_are_refreshed_off_the_request(self):
+        self.rate(self.first, 5)
+        with self.settings(DOTTIFY_CHART_REFRESH_ASYNC=True), \
+                mock.patch.object(charts.threading, 'Thread') as thread:
+            response = self.client.get('/api/charts/songs/')
+        self.assertEqual(response.json()['results'], [])
+        thread.assert_called_once_with(target=charts._refresh_in_background, name='dottify-charts', daemon=True)
+        charts._refreshing.release()
+
+    def test_chart_parameters_are_validated(self):
+        for query in ('window=14', 'window=week', 'by=plays', 'limit=0', 'limit=500'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/charts/songs/?{query}')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(DOTTIFY_RATING_BUFFER_ASYNC=False, DOTTIFY_RATING_BUFFER_SIZE=3, DOTTIFY_RATING_BUFFER_DELAY=60)
+class RatingIngestAPITests(APITestCase):
+    def setUp(self):
+        album = Album.objects.create(title='Rated', artist_name='Artist', release_date='2023-01-01')
+        self.song = Song.objects.create(title='Rated Song', album=album, length=100)
+        self.buffer = ingest.RatingBuffer()
+        patcher = mock.patch.object(ingest, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        return self.client.post('/api/ratings/', data, format='json')
+
+    def test_ratings_are_buffered_and_written_in_one_batch(self):
+        response = self.post({'song': self.song.pk, 'stars': '4.5'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json(), {'accepted': 1})
+        self.post({'song': self.song.pk, 'stars': 3})
+        self.assertFalse(Rating.objects.exists())
+
+        # The third fills the buffer
+        with CaptureQueriesContext(connection) as queries:
+            self.post([{'song': self.song.pk, 'stars': 5}])
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "dottify_rating"')]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertEqual(Rating.objects.count(), 3)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.rating_summary.rating_count, 3)
+        self.assertEqual(aggregates.verify(), [])
+
+    def test_invalid_ratings_are_rejected_before_buffering(self):
+        response = self.post([
+            {'song': self.song.pk, 'stars': 4},
+            {'song': self.song.pk, 'stars': '4.3'},
+            {'song': self.song.pk, 'stars': 6},
+            {'song': self.song.pk + 100, 'stars': 2},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()), {'1', '2', '3'})
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_overdue_and_remaining_ratings_are_flushed(self):
+        self.post({'song': self.song.pk, 'stars': 1})
+        with self.settings(DOTTIFY_RATING_BUFFER_DELAY=0):
+            self.post({'song': self.song.pk, 'stars': 2})
+        self.assertEqual(Rating.objects.count(), 2)
+
+        # As at interpreter exit
+        self.post({'song': self.song.pk, 'stars': 3})
+        self.buffer.close()
+        self.assertEqual(Rating.objects.count(), 3)
+
+    def test_writer_thread_writes_batches(self):
+        written = threading.Event()
+
+        def write(batch):
+            written.set()
+            return len(batch)
+
+        with self.settings(DOTTIFY_RATING_BUFFER_ASYNC=True, DOTTIFY_RATING_BUFFER_DELAY=0.05), \
+                mock.patch.object(ingest, 'write_ratings', side_effect=write) as write_ratings:
+            self.post({'song': self.song.pk, 'stars': 4})
+            self.assertTrue(written.wait(5))
+            self.buffer.close()
+        write_ratings.assert_called_once_with([(self.song.pk, Decimal('4.0'))])
+
+    def test_failed_batches_are_kept_and_retried(self):
+        with mock.patch.object(ingest, 'write_ratings', side_effect=OperationalError('database is locked')):
+            self.post([{'song': self.song.pk, 'stars': stars} for stars in (1, 2, 3)])
+        self.assertEqual(len(self.buffer), 3)
+        self.assertFalse(Rating.objects.exists())
+
+        self.post({'song': self.song.pk, 'stars': 4})
+        self.assertEqual(self.buffer.flush(), 4)
+        self.assertEqual(list(Rating.objects.order_by('pk').values_list('stars', flat=True)), [1, 2, 3, 4])
+
+    def test_batches_are_dropped_and_counted_once_out_of_retries(self):
+        with self.settings(DOTTIFY_RATING_BUFFER_RETRIES=1), \
+                mock.patch.object(ingest, 'write_ratings', side_effect=OperationalError('database is locked')):
+            self.post([{'song': self.song.pk, 'stars': stars} for stars in (1, 2, 3)])
+            self.buffer.flush()
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.dropped, 3)
+
+    def test_full_buffer_answers_service_unavailable(self):
+        self.post({'song': self.song.pk, 'stars': 1})
+        with self.settings(DOTTIFY_RATING_BUFFER_LIMIT=2):
+            response = self.post([{'song': self.song.pk, 'stars': 2}, {'song': self.song.pk, 'stars': 3}])
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(len(self.buffer), 1)
+
+    def test_writer_thread_survives_failed_batches(self):
+        written = threading.Event()
+        attempts = []
+
+        def write(batch):
+            attempts.append(batch)
+            if len(attempts) == 1:
+                raise ValueError('aggregates out of step')
+            written.set()
+            return len(batch)
+
+        with self.settings(DOTTIFY_RATING_BUFFER_ASYNC=True, DOTTIFY_RATING_BUFFER_DELAY=0.05), \
+                mock.patch.object(ingest, 'write_ratings', side_effect=write):
+            self.post({'song': self.song.pk, 'stars': 4})
+            self.assertTrue(written.wait(5))
+            self.assertTrue(self.buffer._thread.is_alive())
+            self.buffer.close()
+        self.assertEqual(self.buffer.dropped, 0)
+
+
+# A TestCase keeps every test inside a transaction, which the router reads
+# from the primary, so these commit for real
+@override_settings(DOTTIFY_READ_REPLICAS=['replica'])
+class ReplicaRoutingAPITests(APITransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        user = User.objects.create_user(username='writer', password='password')
+        DottifyUser.objects.create(user=user, display_name='Writer')
+        Album.objects.create(title='Primary Copy', artist_name='Artist', release_date='2023-01-01')
+        # The replica's test database is a separate one, with its own rows
+        Album.objects.using('replica').bulk_create([
+            Album(title='Replica Copy', artist_name='Artist', release_date='2023-01-01', slug='replica-copy')
+        ])
+
+    def titles(self):
+        response = self.client.get('/api/albums/?fields=title')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [album['title'] for album in response.json()]
+
+    def test_safe_requests_read_from_the_replica(self):
+        self.assertEqual(self.titles(), ['Replica Copy'])
+        with self.settings(DOTTIFY_READ_REPLICAS=[]):
+            self.assertEqual(self.titles(), ['Primary Copy'])
+
+    def test_clients_read_their_own_writes_from_the_primary(self):
+        response = self.client.post('/accounts/login/', {'username': 'writer', 'password': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIn(routers.get_pin_cookie(), response.cookies)
+
+        response = self.client.post('/api/albums/', {
+            'title': 'Fresh', 'artist_name': 'Writer', 'format': 'SNGL',
+            'release_date': '2023-03-01', 'retail_price': '5.00',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.titles(), ['Primary Copy', 'Fresh'])
+
+        # Once the replica has had time to catch up, reads go back to it
+        with mock.patch.object(routers.time, 'time', return_value=time.time() + 60):
+            self.assertEqual(self.titles(), ['Replica Copy'])
+
+    def test_reads_after_a_write_or_inside_a_transaction_use_the_primary(self):
+        router = routers.ReplicaRouter()
+        token = routers._state.set(routers.RoutingState('replica'))
+        try:
+            self.assertEqual(router.db_for_read(Album), 'replica')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Album), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(Album), 'replica')
+
+            self.assertEqual(router.db_for_write(Album), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(Album), DEFAULT_DB_ALIAS)
+        finally:
+            routers._state.reset(token)
+        # Outside a request everything uses the primary
+        self.assertEqual(router.db_for_read(Album), DEFAULT_DB_ALIAS)
+
+    def test_instances_read_from_the_replica_follow_the_request_to_the_primary(self):
+        token = routers._state.set(routers.RoutingState('replica'))
+        try:
+            album = Album.objects.get(title='Replica Copy')
+            self.assertEqual(album._state.db, 'replica')
+            self.assertEqual(album.song_set.all().db, 'replica')
+
+            Album.objects.create(title='Written', artist_name='Artist', release_date='2023-01-01')
+            # Related reads and saves of the replica's instance now go to the primary
+            self.assertEqual(album.song_set.all().db, DEFAULT_DB_ALIAS)
+            self.assertEqual(routers.ReplicaRouter().db_for_write(Album, instance=album), DEFAULT_DB_ALIAS)
+        finally:
+            routers._state.reset(token)
+
+
+class AsyncReadAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='async', password='password')
+        profile = DottifyUser.objects.create(user=user, display_name='Async Listener')
+        self.album = Album.objects.create(
+            title='Async Album', artist_name='Async Artist',
+            format='SNGL', release_date='2023-01-01', retail_price='5.00'
+        )
+        Album.objects.create(title='Second Album', artist_name='Other Artist', release_date='2023-02-01')
+        song = Song.objects.create(title='Async Song', album=self.album, length=200)
+        Song.objects.create(title='Another Async Song', album=self.album, length=100)
+        Rating.objects.create(song=song, stars=3)
+        playlist = Playlist.objects.create(name='Async Mix', owner=profile, visibility=Playlist.Visibility.PUBLIC)
+        playlist.songs.add(song)
+        Playlist.objects.create(name='Hidden Mix', owner=profile, visibility=Playlist.Visibility.HIDDEN)
+
+    async def test_async_endpoints_match_sync_ones(self):
+        song = await Song.objects.filter(title='Async Song').afirst()
+        playlist = await Playlist.objects.filter(name='Async Mix').afirst()
+        paths = [
+            'statistics/', 'albums/', 'albums/?search=async', f'albums/{self.album.pk}/',
+            f'albums/{self.album.pk}/songs/', f'albums/{self.album.pk}/songs/{song.pk}/',
+            'playlists/', f'playlists/{playlist.pk}/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                expected = await self.async_client.get(f'/api/{path}')
+                response = await self.async_client.get(f'/api/async/{path}')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_async_pagination_and_errors(self):
+        response = await self.async_client.get('/api/async/albums/?page_size=1')
+        self.assertEqual([album['title'] for album in response.json()], ['Async Album'])
+        next_url = re.search(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+        response = await self.async_client.get(next_url)
+        self.assertEqual([album['title'] for album in response.json()], ['Second Album'])
+
+        response = await self.async_client.get('/api/async/albums/?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get('/api/async/playlists/999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.post('/api/async/albums/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_bench_async_command(self):
+        out = StringIO()
+        call_command('bench_async', requests=4, concurrency=2, stdout=out)
+        self.assertIn('album songs', out.getvalue())
+        self.assertEqual(out.getvalue().count(' async '), 5)
@@ -1,9 +1,29 @@
+import shutil
+import tempfile
+
 from django.utils import timezone
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from .models import Album, Song, DottifyUser, Comment, Rating
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from data_wizard import registry
+from data_wizard.models import Run
+from data_wizard.sources.models import FileSource
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .models import Album, Song, DottifyUser, Comment, Rating, SongRatingSummary
+from . import aggregates, images, search, sqlite, stats
+from .aggregates import get_rating_summary
+from .datagen import DatasetGenerator
+from .images import generate_cover_variants
+from .importer import SongImporter
+from datetime import timedelta
 from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
 
 class CustomTestSheetA(TestCase):
@@ -64,3 +84,218 @@ class CustomTestSheetA(TestCase):
         Rating(song=self.song, stars=0).full_clean()
         Rating(song=self.song, stars=2.0).full_clean()
         Rating(song=self.song, stars=4.5).full_clean()
+
+
+    # --- Rating Aggregate Tests ---
+    def test_rating_aggregates_follow_saves_edits_and_deletes(self):
+        """The song summary must track creates, star edits and deletes."""
+        first = Rating.objects.create(song=self.song, stars=Decimal('5.0'))
+        Rating.objects.create(song=self.song, stars=Decimal('2.0'))
+
+        summary = get_rating_summary(self.song)
+        self.assertEqual(summary.rating_count, 2)
+        self.assertAlmostEqual(summary.all_time_average, 3.5)
+
+        first = Rating.objects.get(pk=first.pk)
+        first.stars = Decimal('3.0')
+        first.save()
+        first.delete()
+
+        summary = get_rating_summary(Song.objects.get(pk=self.song.pk))
+        self.assertEqual(summary.rating_count, 1)
+        self.assertAlmostEqual(summary.recent_average, 2.0)
+        self.assertEqual(aggregates.verify(), [])
+
+    def test_rating_window_rolls_forward_without_raw_ratings(self):
+        """Buckets older than 90 days drop out of the recent average only."""
+        rating = Rating.objects.create(song=self.song, stars=Decimal('4.5'))
+        summary = get_rating_summary(self.song)
+
+        later = timezone.localdate(rating.created_at) + timedelta(days=aggregates.RECENT_WINDOW_DAYS + 1)
+        summary = aggregates.roll_window(summary, today=later)
+
+        self.assertEqual(summary.recent_count, 0)
+        self.assertIsNone(summary.recent_average)
+        self.assertAlmostEqual(summary.all_time_average, 4.5)
+
+    def test_rebuild_rating_aggregates_command(self):
+        """The rebuild command must restore aggregates that drifted from Rating."""
+        Rating.objects.create(song=self.song, stars=Decimal('1.5'))
+        SongRatingSummary.objects.filter(song=self.song).update(rating_count=7)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rating_aggregates', '--verify', stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        call_command('rebuild_rating_aggregates', '--verify', stdout=StringIO())
+        self.assertEqual(SongRatingSummary.objects.get(song=self.song).rating_count, 1)
+
+
+@override_settings(DOTTIFY_COVER_VARIANTS_ASYNC=False)
+class CoverVariantTests(TestCase):
+    """Tests for the resized cover images generated after an upload."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(buffer, 'PNG')
+        self.upload = SimpleUploadedFile('cover.png', buffer.getvalue(), content_type='image/png')
+
+    def test_cover_upload_generates_webp_and_jpeg_variants(self):
+        """Saving a new cover renders every width in both formats, next to the original."""
+        with self.captureOnCommitCallbacks(execute=True):
+            album = Album.objects.create(
+                title='Covered', artist_name='Artist', release_date=timezone.now().date(),
+                cover_image=self.upload
+            )
+
+        album.refresh_from_db()
+        widths = [width for width, _url in album.cover_variant_urls('webp')]
+        self.assertEqual(widths, [160, 320, 640])
+        self.assertIn('cover.320w.webp 320w', album.cover_webp_srcset)
+
+        with album.cover_image.storage.open(album.cover_variants['jpeg'][0][1]) as variant:
+            self.assertEqual(Image.open(variant).size, (160, 120))
+
+    def test_default_cover_gets_no_variants(self):
+        """Albums left on the shared default cover schedule no rendering job."""
+        with mock.patch.object(images, 'schedule_cover_variants') as schedule:
+            Album.objects.create(title='Plain', artist_name='Artist', release_date=timezone.now().date())
+            Album.objects.create(title='Bare', artist_name='Artist', release_date=timezone.now().date(),
+                                 cover_image=None)
+        schedule.assert_not_called()
+
+    def test_variants_of_a_replaced_cover_are_ignored(self):
+        """Variants recorded for an old cover are not offered for the new one."""
+        album = Album.objects.create(
+            title='Covered', artist_name='Artist', release_date=timezone.now().date(),
+            cover_image=self.upload
+        )
+        generate_cover_variants(album.pk)
+        album.refresh_from_db()
+
+        album.cover_image.name = 'another.png'
+        self.assertEqual(album.cover_srcset('jpeg'), '')
+
+
+class DatasetGeneratorTests(TestCase):
+    def test_dataset_is_deterministic_and_consistent(self):
+        counts = DatasetGenerator(scale=0.2, seed=7).generate()
+        self.assertEqual(counts['albums'], Album.objects.count())
+        self.assertEqual(counts['songs'], Song.objects.count())
+
+        # Derived data was maintained for the bulk inserted rows
+        self.assertEqual(aggregates.verify(), [])
+        self.assertEqual(stats.reconcile(), {})
+
+        # Generated timestamps are kept, without touching the shared field definitions
+        self.assertTrue(Rating.objects.filter(created_at__lt=timezone.now() - timedelta(days=2)).exists())
+        self.assertTrue(Rating._meta.get_field('created_at').auto_now_add)
+
+        fingerprint = list(Song.objects.order_by('pk').values_list('title', 'length', 'position'))
+        Album.objects.all().delete()
+        User.objects.all().delete()
+        DatasetGenerator(scale=0.2, seed=7).generate()
+        self.assertEqual(list(Song.objects.order_by('pk').values_list('title', 'length', 'position')), fingerprint)
+
+
+@override_settings(DOTTIFY_IMPORT_CHUNK_SIZE=25)
+class BulkImportTests(TestCase):
+    """Tests for the chunked data wizard import in dottify.importer."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.user = User.objects.create_superuser(username='importer', password='password')
+        self.album = Album.objects.create(title='Imported', artist_name='Artist', release_date='2020-01-01')
+        Song.objects.create(title='Existing', album=self.album, length=100)
+
+    def run_import(self, model_name, csv):
+        source = FileSource.objects.create(file=SimpleUploadedFile('import.csv', csv.encode()))
+        serializer = next(s['class_name'] for s in registry.get_serializers() if s['name'] == model_name)
+        run = Run.objects.create(user=self.user, content_object=source, serializer=serializer)
+        return run, run.run_all(run.get_auto_import_tasks())
+
+    def test_song_import_numbers_positions_and_skips_bad_rows(self):
+        rows = ''.join(f'Track {i},{100 + i},{self.album.pk}\n' for i in range(60))
+        run, status = self.run_import('Song', f'title,length,album\n{rows}Existing,200,{self.album.pk}\nShort,5,{self.album.pk}\n')
+
+        self.assertEqual(status['current'], 62)
+        self.assertEqual(run.record_count, 60)
+        self.assertEqual([skip['row'] for skip in status['skipped']], [62, 63])
+        self.assertIn('already exists', status['skipped'][0]['reason'])
+        self.assertIn('length', status['skipped'][1]['reason'])
+
+        positions = list(self.album.tracks.values_list('position', flat=True))
+        self.assertEqual(positions, list(range(1, 62)))
+        self.assertEqual(run.record_set.filter(success=True).count(), 60)
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_row_inserted_meanwhile_only_fails_itself(self):
+        """A duplicate the batch check missed (e.g. saved concurrently) costs its own row, not the chunk."""
+        rows = ''.join(f'Track {i},{100 + i},{self.album.pk}\n' for i in range(5))
+        with mock.patch.object(SongImporter, 'skip_duplicates'):
+            run, status = self.run_import('Song', f'title,length,album\n{rows}Existing,200,{self.album.pk}\n')
+
+        self.assertEqual(run.record_count, 5)
+        self.assertEqual([skip['row'] for skip in status['skipped']], [7])
+        self.assertIn('UNIQUE', status['skipped'][0]['reason'])
+        self.assertEqual(list(self.album.tracks.values_list('position', flat=True)), list(range(1, 7)))
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_import_queries_grow_per_chunk_not_per_row(self):
+        def import_queries(count, offset):
+            rows = ''.join(f'Track {offset + i},{100 + i},{self.album.pk}\n' for i in range(count))
+            with CaptureQueriesContext(connection) as queries:
+                self.run_import('Song', f'title,length,album\n{rows}')
+            return len(queries)
+
+        # The first run maps the columns, later ones reuse the mapping
+        import_queries(1, 1000)
+        # Same number of chunks, eight times the rows
+        self.assertEqual(import_queries(3, 0), import_queries(25, 100))
+
+    def test_album_import_maintains_slug_and_search_index(self):
+        run, status = self.run_import(
+            'Album', 'title,artist_name,release_date,retail_price,format\n'
+            'Night Drive,Synth Band,2021-05-01,9.99,SNGL\n'
+            'Night Drive,Synth Band,2021-05-01,9.99,SNGL\n'
+        )
+        self.assertEqual(run.record_count, 1)
+        album = Album.objects.get(title='Night Drive')
+        self.assertEqual(album.slug, 'night-drive')
+        self.assertEqual(stats.reconcile(), {})
+        if search.fts_enabled():
+            self.assertEqual(list(search.filter_albums(Album.objects.all(), 'synth')), [album])
+
+
+class SQLiteProfileTests(TestCase):
+    def test_connections_use_the_production_profile(self):
+        self.assertEqual(connection.settings_dict['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertGreater(connection.settings_dict['CONN_MAX_AGE'], 0)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64000)
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_connections_only_persist_when_asked(self):
+        # ASGI settings leave it off; see dottify.sqlite
+        self.assertEqual(sqlite.production_database('db.sqlite3')['CONN_MAX_AGE'], 0)
+        self.assertEqual(sqlite.production_database('db.sqlite3', conn_max_age=60)['CONN_MAX_AGE'], 60)
+
+    def test_bench_sqlite_command(self):
+        out = StringIO()
+        # The command adds a scratch alias per profile, from its own threads
+        scratch = {'bench_sqlite_default', 'bench_sqlite_production'}
+        with mock.patch.object(type(self), 'databases', self.databases | scratch):
+            call_command('bench_sqlite', writers=3, readers=1, writes=10, stdout=out)
+        rows = {line.split()[0]: line.split()[1:] for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(set(rows), {'default', 'production'})
+        # Queued for the lock rather than failed
+        self.assertEqual(rows['production'][1], '0')
@@ -0,0 +1,88 @@
+# dottify/test_query_plans.py
+
+import re
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from .aggregates import recent_window_start
+from .models import Album, Comment, DottifyUser, Playlist, Rating, RatingBucket, Song
+from .pagination import (
+    CommentPagination, PlaylistPagination, SongPagination, _keyset_query, encode_cursor, row_key
+)
+
+
+def page_query(queryset, ordering, cursor_from=None):
+    """The SQL keyset_page runs, optionally for the page after the row cursor_from."""
+    cursor = None
+    if cursor_from is not None:
+        cursor = encode_cursor(row_key(cursor_from, ordering))
+    return _keyset_query(queryset, ordering, 25, cursor)[0]
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class HotQueryPlanTests(TestCase):
+    """
+    Every hot query must reach its rows through an index: no full table scan,
+    and no temporary sort for the paged ones.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='planner', password='password')
+        cls.profile = DottifyUser.objects.create(user=user, display_name='Planner')
+        cls.album = Album.objects.create(
+            title='Plan Album', artist_name='Plan Artist', release_date='2023-01-01', artist_account=cls.profile
+        )
+        cls.song = Song.objects.create(title='Plan Song', album=cls.album, length=100)
+        cls.playlist = Playlist.objects.create(name='Plan', owner=cls.profile, visibility=Playlist.Visibility.PUBLIC)
+        cls.comment = Comment.objects.create(album=cls.album, user=user, comment_text='Planned')
+        Rating.objects.create(song=cls.song, stars=4)
+
+    def query_plan(self, queryset):
+        # Each explain() line is "<id> <parent> <notused> <detail>"
+        return [re.sub(r'^\d+ \d+ \d+ ', '', line) for line in queryset.explain().splitlines()]
+
+    def assertUsesIndexes(self, queryset, sorted_by_index=True):
+        plan = self.query_plan(queryset)
+        scans = [step for step in plan if step.startswith('SCAN ') and ' USING ' not in step]
+        self.assertEqual(scans, [], f'Full table scan in plan: {plan}')
+        if sorted_by_index:
+            sorts = [step for step in plan if 'TEMP B-TREE' in step]
+            self.assertEqual(sorts, [], f'Temporary sort in plan: {plan}')
+
+    def test_rating_window_query(self):
+        cutoff = timezone.now() - timedelta(days=90)
+        self.assertUsesIndexes(Rating.objects.filter(song=self.song, created_at__gte=cutoff), sorted_by_index=False)
+        self.assertUsesIndexes(
+            RatingBucket.objects.filter(song=self.song, day__lt=recent_window_start()), sorted_by_index=False
+        )
+
+    def test_public_playlist_pages(self):
+        public = Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC)
+        self.assertUsesIndexes(page_query(public, PlaylistPagination.ordering))
+        self.assertUsesIndexes(page_query(public, PlaylistPagination.ordering, self.playlist))
+
+    def test_artist_album_queries(self):
+        albums = Album.objects.filter(artist_account=self.profile)
+        self.assertUsesIndexes(page_query(albums, ('id',)))
+        self.assertUsesIndexes(page_query(albums, ('id',), self.album))
+        # SongForm's album choices
+        self.assertUsesIndexes(albums, sorted_by_index=False)
+
+    def test_album_comment_pages(self):
+        comments = Comment.objects.filter(album=self.album).with_authors()
+        self.assertUsesIndexes(page_query(comments, CommentPagination.ordering))
+        self.assertUsesIndexes(page_query(comments, CommentPagination.ordering, self.comment))
+
+    def test_album_song_queries(self):
+        songs = Song.objects.filter(album=self.album)
+        self.assertUsesIndexes(page_query(songs, SongPagination.ordering))
+        self.assertUsesIndexes(page_query(songs, SongPagination.ordering, self.song))
+        # Default ordering, and the next position lookup in Song.save()
+        self.assertUsesIndexes(songs)
+        self.assertUsesIndexes(songs.order_by('-position')[:1])
@@ -1,11 +1,20 @@
 # dottify/test_views.py
 
-from django.test import TestCase, Client
-from django.urls import reverse
+import re
+import tempfile
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, resolve, reverse
 from django.contrib.auth.models import User, Group
 from datetime import timedelta
 from django.utils import timezone
+from . import fragments, metrics
+from .identity import current_version
+from .management.commands.bench import Command as BenchCommand, collect_routes
 from .models import Album, Song, DottifyUser, Rating, Comment, Playlist
+from .views import HomeView
 
 
 class CustomTestSheetCAndD(TestCase):
@@ -129,4 +138,229 @@ class CustomTestSheetCAndD(TestCase):
 
         # All-Time Avg: 4.0. Recent Avg: 3.0
         self.assertContains(response, 'Average rating of all time: 4.0')
-        self.assertContains(response, 'Recent rating average (last 90 days): 4.0')
\ No newline at end of file
+        self.assertContains(response, 'Recent rating average (last 90 days): 4.0')
+    def test_album_search_matches_prefixes_artists_and_tracks(self):
+        """Search must prefix-match titles, artist names and song titles, best match first."""
+        self.client.login(username='general', password='password')
+
+        response = self.client.get(reverse('album_search') + '?q=Uniq')
+        self.assertEqual(list(response.context['albums']), [self.other_album])
+
+        response = self.client.get(reverse('album_search') + '?q=other artist')
+        self.assertEqual(list(response.context['albums']), [self.other_album])
+
+        Song.objects.create(title='Album Anthem', album=self.other_album, length=200)
+        response = self.client.get(reverse('album_search') + '?q=anthem')
+        self.assertEqual(list(response.context['albums']), [self.other_album])
+
+    def test_album_search_index_follows_renames_and_deletes(self):
+        """Renamed and deleted albums must not be found under their old data."""
+        self.client.login(username='general', password='password')
+        self.other_album.title = 'Renamed Record'
+        self.other_album.save()
+
+        self.assertContains(self.client.get(reverse('album_search') + '?q=renamed'), '(1 found)')
+        self.assertContains(self.client.get(reverse('album_search') + '?q=unique'), '(0 found)')
+
+        self.other_album.delete()
+        self.assertContains(self.client.get(reverse('album_search') + '?q=renamed'), '(0 found)')
+
+    # --- Request Identity Tests ---
+
+    def test_identity_is_cached_in_session_across_requests(self):
+        """Profile and groups are read once, then reused until they change."""
+        self.client.login(username='artist', password='password')
+        self.client.get(reverse('song_create'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('song_create'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('auth_user_groups' in query['sql'] for query in queries.captured_queries))
+
+    def test_identity_follows_group_changes(self):
+        """Removing a user from a group takes effect on their next request."""
+        self.client.login(username='artist', password='password')
+        self.assertEqual(self.client.get(reverse('song_create')).status_code, 200)
+
+        self.artist_user.groups.remove(self.artist_group)
+
+        self.assertEqual(self.client.get(reverse('song_create')).status_code, 403)
+
+    def test_identity_version_is_replaced_again_on_commit(self):
+        """A token handed out before the group change commits must not outlive it."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.artist_user.groups.remove(self.artist_group)
+            stale = current_version(self.artist_user.pk)
+
+        self.assertNotEqual(current_version(self.artist_user.pk), stale)
+
+    # --- Home Page Listing Tests ---
+
+    def test_home_admin_query_count_is_constant(self):
+        """Playlist owners are joined in, so more playlists do not mean more queries."""
+        owner = DottifyUser.objects.get(user=self.general_user)
+        Playlist.objects.create(name='First List', owner=owner)
+        self.client.login(username='admin', password='password')
+        self.client.get(reverse('home'))
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('home'))
+        for index in range(5):
+            Playlist.objects.create(name=f'List {index}', owner=owner)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('home'))
+
+        self.assertEqual(len(few), len(many))
+        self.assertContains(response, 'List 4 (Owner: General Profile)')
+
+    def test_home_sections_page_independently(self):
+        """Each section shows one page and links to the next via its own cursor."""
+        with mock.patch.object(HomeView, 'section_size', 1):
+            response = self.client.get(reverse('home'))
+            self.assertEqual(len(response.context['albums']), 1)
+            self.assertContains(response, 'Total results found: 2')
+
+            response = self.client.get(response.context['albums_next_url'])
+        self.assertEqual(response.context['albums'], [self.other_album])
+        self.assertIsNone(response.context['albums_next_url'])
+
+    # --- Album Comment Tests ---
+
+    def test_album_detail_comment_queries_are_constant(self):
+        """Comment authors are joined in, so more comments do not mean more queries."""
+        url = reverse('album_detail', kwargs={'pk': self.album.pk, 'slug': self.album.slug})
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        for index in range(5):
+            Comment.objects.create(album=self.album, user=self.admin_user, comment_text=f'Admin note {index}')
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(len(few), len(many))
+        # Display name for profiles, username as the fallback
+        self.assertContains(response, 'By <strong>General Profile</strong>')
+        self.assertContains(response, 'By <strong>admin</strong>')
+
+    def test_album_comments_api_pages_newest_first(self):
+        """The comments endpoint returns newest comments first and links to older ones."""
+        for index in range(3):
+            Comment.objects.create(album=self.album, user=self.general_user, comment_text=f'Later {index}')
+
+        response = self.client.get(f'/api/albums/{self.album.pk}/comments/?page_size=2')
+        self.assertEqual([c['comment_text'] for c in response.json()], ['Later 2', 'Later 1'])
+
+        next_url = response['Link'].split('>')[0].lstrip('<')
+        older = self.client.get(next_url).json()
+        self.assertEqual([c['comment_text'] for c in older], ['Later 0', 'Great album for testing!'])
+        self.assertEqual(older[0]['user_display_name'], 'General Profile')
+
+    # --- Conditional GET Tests ---
+
+    def test_album_detail_revalidates_per_user(self):
+        """An unchanged album page is a 304; a new comment or another user gets the page again."""
+        url = reverse('album_detail', kwargs={'pk': self.album.pk, 'slug': self.album.slug})
+        etag = self.client.get(url).headers['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.login(username='general', password='password')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.client.logout()
+        Comment.objects.create(album=self.album, user=self.admin_user, comment_text='Fresh')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Fresh')
+
+    def test_song_detail_follows_album_rename(self):
+        url = reverse('song_detail', kwargs={'pk': self.song.pk})
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.album.title = 'Renamed Album'
+        self.album.save()
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), 'Renamed Album')
+
+    # --- Fragment Cache Tests ---
+
+    def test_album_fragments_are_cached_until_tracks_or_comments_change(self):
+        url = reverse('album_detail', kwargs={'pk': self.album.pk, 'slug': self.album.slug})
+        fragments.reset_counters()
+        self.client.get(url)
+        self.assertEqual(fragments.get_counters(), {'hits': 0, 'misses': 2})
+
+        # Only the album row (and session/auth lookups) remain on a hit
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(fragments.get_counters(), {'hits': 2, 'misses': 2})
+        self.assertFalse(any('dottify_song' in query['sql'] or 'dottify_comment' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertContains(response, 'Test Song')
+
+        Song.objects.create(title='Bonus Track', album=self.album, length=90)
+        self.assertContains(self.client.get(url), 'Bonus Track')
+        Comment.objects.get(comment_text='Great album for testing!').delete()
+        self.assertContains(self.client.get(url), 'No comments.')
+        self.assertEqual(fragments.get_counters()['misses'], 6)
+
+    def test_album_comment_fragment_ignores_unrelated_query_strings(self):
+        url = reverse('album_detail', kwargs={'pk': self.album.pk, 'slug': self.album.slug})
+        self.client.get(url)
+        fragments.reset_counters()
+        self.client.get(url + '?utm_source=newsletter')
+        self.assertEqual(fragments.get_counters(), {'hits': 2, 'misses': 0})
+
+    def test_album_fragments_with_file_based_cache(self):
+        url = reverse('album_detail', kwargs={'pk': self.album.pk, 'slug': self.album.slug})
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'fragments': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }, DOTTIFY_FRAGMENT_CACHE='fragments'):
+            fragments.reset_counters()
+            first = self.client.get(url)
+            second = self.client.get(url)
+            self.assertEqual(fragments.get_counters(), {'hits': 2, 'misses': 2})
+        self.assertEqual(first.content, second.content)
+
+    # --- Benchmark Route Coverage ---
+
+    def test_bench_reaches_every_route(self):
+        """manage.py bench can build a working URL for every named dottify route."""
+        command = BenchCommand()
+        objects = command.sample_objects()
+        Playlist.objects.create(name='Bench Mix', owner=DottifyUser.objects.first(),
+                                visibility=Playlist.Visibility.PUBLIC)
+        objects['playlist'] = Playlist.objects.get(name='Bench Mix')
+
+        for pattern, name in collect_routes(get_resolver('dottify.urls')):
+            with self.subTest(route=name):
+                url = command.route_url(pattern, name, objects)
+                self.assertIsNotNone(url)
+                self.assertEqual(resolve(url.split('?')[0]).url_name, name)
+
+    def test_bench_reads_streaming_bodies(self):
+        """Streamed routes are timed and counted over their whole body, not just the headers."""
+        results = {row['name']: row for row in BenchCommand().bench_routes(1)}
+        self.assertEqual(results['album-export']['status'], 200)
+        self.assertGreater(results['album-export']['queries'], 0)
+
+    # --- Metrics Tests ---
+
+    def test_metrics_record_queries_per_view(self):
+        metrics.reset()
+        url = reverse('album_detail', kwargs={'pk': self.album.pk, 'slug': self.album.slug})
+        response = self.client.get(url)
+
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'^db;desc="\d+ queries";dur=\d+\.\d+, render;dur=\d+\.\d+, total;dur=\d+\.\d+$')
+        query_count = int(re.search(r'"(\d+) queries"', timing).group(1))
+        self.assertGreater(query_count, 0)
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn(f'dottify_request_queries_sum{{view="album_detail"}} {query_count}', body)
+        self.assertIn('dottify_request_queries_count{view="album_detail"} 1', body)
+        self.assertIn(f'dottify_response_size_bytes_sum{{view="album_detail"}} {len(response.content)}', body)
+        self.assertIn('dottify_fragment_cache_total{result="misses"}', body)
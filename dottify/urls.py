@@ -2,13 +2,18 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_nested import routers
 
+from . import async_views, export
+from .metrics import metrics_view
 from dottify.views import AlbumCreateView, AlbumDeleteView, AlbumDetailView, AlbumSearchView, AlbumUpdateView, HomeView, SongCreateView, SongDeleteView, SongDetailView, SongUpdateView, UserDetailView
 from .api_views import (
     AlbumViewSet,
+    NestedCommentViewSet,
     NestedSongViewSet,
     SongViewSet,
     PlaylistViewSet,
-    StatisticsAPIView
+    StatisticsAPIView,
+    ChartAPIView,
+    RatingIngestAPIView
 )
 
 router = routers.DefaultRouter()
@@ -24,13 +29,37 @@ album_router = routers.NestedDefaultRouter(router, r'albums', lookup='album')
 # Nested album specific songs /[album_id]/songs and /song_id
 album_router.register(r'songs', NestedSongViewSet, basename='album-songs')
 
+# Nested album comments /[album_id]/comments, newest first
+album_router.register(r'comments', NestedCommentViewSet, basename='album-comments')
+
+# Async mirrors of the read-only endpoints, for ASGI deployments
+async_urlpatterns = [
+    path('statistics/', async_views.statistics, name='async-statistics'),
+    path('albums/', async_views.album_list, name='async-album-list'),
+    path('albums/<int:pk>/', async_views.album_detail, name='async-album-detail'),
+    path('albums/<int:album_pk>/songs/', async_views.album_song_list, name='async-album-songs-list'),
+    path('albums/<int:album_pk>/songs/<int:pk>/', async_views.album_song_detail, name='async-album-songs-detail'),
+    path('playlists/', async_views.playlist_list, name='async-playlist-list'),
+    path('playlists/<int:pk>/', async_views.playlist_detail, name='async-playlist-detail'),
+]
+
 urlpatterns = [
+    path('api/async/', include(async_urlpatterns)),
     path('api/', include(router.urls)),
     path('api/', include(album_router.urls)),
     path('api/statistics/', StatisticsAPIView.as_view(), name='statistics'),
+    # Ratings are buffered and written in batches; see dottify.ingest
+    path('api/ratings/', RatingIngestAPIView.as_view(), name='rating-ingest'),
+    # Top rated songs and albums, ?window=7|30|90&by=average|volume&limit=
+    path('api/charts/songs/', ChartAPIView.as_view(kind='songs'), name='song-chart'),
+    path('api/charts/albums/', ChartAPIView.as_view(kind='albums'), name='album-chart'),
+    # Whole catalogue, streamed as NDJSON or ?format=csv
+    path('api/export/albums/', export.album_export, name='album-export'),
+    path('api/export/playlists/', export.playlist_export, name='playlist-export'),
 ]
 
 urlpatterns += [
+    path('metrics', metrics_view, name='metrics'),
     path('datawizard/', include('data_wizard.urls', namespace='data_wizard_ns')),
     path('accounts/', include('django.contrib.auth.urls'))
 ]
@@ -0,0 +1,8 @@
+from itertools import islice
+
+
+def chunks(iterable, size):
+    """Lists of up to size items, so rows read or generated never all sit in memory."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -1,38 +1,60 @@
 from django.http import HttpResponseForbidden
 from django.views.generic import DetailView, ListView, UpdateView, CreateView, DeleteView
 from django.shortcuts import redirect
+from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Avg
-from django.utils import timezone
-from datetime import timedelta
+from rest_framework.utils.urls import replace_query_param
+from . import stats
+from .aggregates import get_rating_summary
+from .conditional import album_validators, page_parts, song_validators
 from .models import Album, Playlist, Song, DottifyUser
 from .forms import AlbumForm, SongForm
+from .fragments import album_fragment
+from .identity import get_identity
+from .pagination import CommentPagination, PlaylistPagination, keyset_page
+from .search import search_albums
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
 
+def keyset_section(request, queryset, ordering, size, param, path=None):
+    """
+    One keyset page of queryset for an HTML listing, driven by the ?<param>= cursor.
+    Returns (rows, next page URL, previous page URL), built on path (by default
+    the request's full path, query string included).
+    """
+    try:
+        rows, next_cursor, previous_cursor = keyset_page(queryset, ordering, size, request.GET.get(param))
+    except ValueError:
+        # A mangled cursor just starts the listing from the beginning
+        rows, next_cursor, previous_cursor = keyset_page(queryset, ordering, size)
+
+    path = request.get_full_path() if path is None else path
+    next_url = replace_query_param(path, param, next_cursor) if next_cursor else None
+    previous_url = replace_query_param(path, param, previous_cursor) if previous_cursor else None
+    return rows, next_url, previous_url
+
+
 class ArtistOrAdminRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
     """
     Checks if the user is authenticated and in the 'Artist'
     or the 'DottifyAdmin' group.
     """
     def test_func(self):
-        user = self.request.user
-        is_artist = user.groups.filter(name=_('Artist')).exists()
-        is_admin = user.groups.filter(name=_('DottifyAdmin')).exists()
-        return is_artist or is_admin
+        identity = get_identity(self.request)
+        return identity.is_artist or identity.is_admin
 
 
 class ArtistRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
     def test_func(self):
-        return self.request.user.groups.filter(name=_('Artist')).exists()
+        return get_identity(self.request).is_artist
 
 
 class DottifyAdminRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
     def test_func(self):
-        return self.request.user.groups.filter(name=_('DottifyAdmin')).exists()
+        return get_identity(self.request).is_admin
 
 
 class ContentOwnerOrAdminMixin(LoginRequiredMixin, UserPassesTestMixin):
@@ -53,8 +75,7 @@ class ContentOwnerOrAdminMixin(LoginRequiredMixin, UserPassesTestMixin):
         user = self.request.user
 
         # 1. Admin Check
-        is_admin = user.groups.filter(name=_('DottifyAdmin')).exists()
-        if is_admin:
+        if get_identity(self.request).is_admin:
             return True  # Admins always pass
 
         # 2. Owner Check
@@ -77,8 +98,19 @@ class AlbumDetailView(DetailView):
     template_name = 'dottify/album_detail.html'
     context_object_name = 'album'
 
+    comments_page_size = 20
+    comments_cursor_param = 'comments_cursor'
+
     # Required slug redirection/URL check
     def get(self, request, *args, **kwargs):
+        # Revalidating clients get a 304 from the version alone; the slug is
+        # part of the URL, so a stale one never matches a current ETag
+        validators = album_validators(kwargs['pk'], *page_parts(request))
+        if validators is not None:
+            not_modified = validators.not_modified(request)
+            if not_modified is not None:
+                return not_modified
+
         self.object = self.get_object()
 
         required_slug = self.object.slug
@@ -91,7 +123,38 @@ class AlbumDetailView(DetailView):
             )
 
         context = self.get_context_data(object=self.object)
-        return self.render_to_response(context)
+        response = self.render_to_response(context)
+        return validators.apply(response) if validators is not None else response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        # Both blocks are cached per album version; a hit needs no query at all.
+        # Comments vary by their cursor alone, so other query strings can't
+        # fill the cache with copies
+        context['tracks_html'] = album_fragment(self.object, 'tracks', self.render_tracks)
+        context['comments_html'] = album_fragment(
+            self.object, 'comments', self.render_comments,
+            variant=self.request.GET.get(self.comments_cursor_param, '')
+        )
+        return context
+
+    def render_tracks(self):
+        return render_to_string('dottify/includes/album_tracks.html', {'album': self.object})
+
+    def render_comments(self):
+        # Newest comments first, authors' display names joined in the same query
+        comments, next_url, previous_url = keyset_section(
+            self.request, self.object.comments.with_authors(), CommentPagination.ordering,
+            self.comments_page_size, self.comments_cursor_param,
+            # The links are cached with the page, so they carry the cursor only
+            path=self.request.path
+        )
+        return render_to_string('dottify/includes/album_comments.html', {
+            'comments': comments,
+            'comments_next_url': next_url,
+            'comments_previous_url': previous_url,
+        })
 
 
 class SongDetailView(DetailView):
@@ -99,15 +162,23 @@ class SongDetailView(DetailView):
     template_name = 'dottify/song_detail.html'
     context_object_name = 'song'
 
+    def get(self, request, *args, **kwargs):
+        validators = song_validators(kwargs['pk'], *page_parts(request))
+        if validators is not None:
+            not_modified = validators.not_modified(request)
+            if not_modified is not None:
+                return not_modified
+        response = super().get(request, *args, **kwargs)
+        return validators.apply(response) if validators is not None else response
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         song = self.object
 
-        all_time_avg = song.rating_set.aggregate(Avg('stars'))['stars__avg']
-
-        # 90-Day Average
-        ninety_days_ago_time = timezone.now() - timedelta(days=90)
-        recent_avg = song.rating_set.filter(created_at__gte=ninety_days_ago_time).aggregate(Avg('stars'))['stars__avg']
+        # All-time and 90-day averages come from the maintained summary row
+        summary = get_rating_summary(song)
+        all_time_avg = summary.all_time_average if summary else None
+        recent_avg = summary.recent_average if summary else None
 
         # format N.N or 'N.A'
         def format_rating(avg_value):
@@ -153,6 +224,9 @@ class HomeView(ListView):
     template_name = 'dottify/home.html'
     context_object_name = 'albums'
 
+    # Rows per section; each section pages independently via ?<section>_cursor=
+    section_size = 25
+
     # Controlling all data getting passed to the template
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -160,23 +234,27 @@ class HomeView(ListView):
         albums_qs = Album.objects.none()
         playlists_qs = Playlist.objects.none()
         songs_qs = Song.objects.none()
+        album_count = 0
 
         user = self.request.user
-
-        is_admin = user.is_authenticated and user.groups.filter(name=_('DottifyAdmin')).exists()
-        is_artist = user.is_authenticated and user.groups.filter(name=_('Artist')).exists()
+        identity = get_identity(self.request)
 
         if user.is_authenticated:
-            dottify_user = DottifyUser.objects.get(user=user)
+            dottify_user = identity.profile
 
-            if is_admin:
+            if identity.is_admin:
                 # 1. Admin Logic (All data)
                 albums_qs = Album.objects.all()
                 playlists_qs = Playlist.objects.all()
                 songs_qs = Song.objects.all()
-            elif is_artist:
+                album_count = stats.get_statistics()['album_count']
+            elif dottify_user is None:
+                # Without a profile there is nothing of their own to list
+                pass
+            elif identity.is_artist:
                 # 2. Artist Logic (Only own albums)
                 albums_qs = Album.objects.filter(artist_account=dottify_user)
+                album_count = stats.artist_album_count(dottify_user.pk)
             else:
                 # 3. General User Logic (Only own playlists)
                 playlists_qs = Playlist.objects.filter(owner=dottify_user)
@@ -184,14 +262,25 @@ class HomeView(ListView):
             # 4. Logic for Anonymous Users (albums and public playlists)
             albums_qs = Album.objects.all()
             playlists_qs = Playlist.objects.filter(visibility=Playlist.Visibility.PUBLIC)
+            album_count = stats.get_statistics()['album_count']
+
+        # Only the columns home.html renders (plus the page keys); owners are joined in.
+        # Playlists page like the API so public ones walk the visibility index in order
+        sections = {
+            'albums': (albums_qs.only('id', 'title', 'artist_name', 'slug'), ('id',)),
+            'playlists': (
+                playlists_qs.select_related('owner').only('id', 'name', 'created_at', 'owner', 'owner__display_name'),
+                PlaylistPagination.ordering
+            ),
+            'songs': (songs_qs.only('id', 'title'), ('id',)),
+        }
+        for name, (queryset, ordering) in sections.items():
+            context[name], context[f'{name}_next_url'], context[f'{name}_previous_url'] = keyset_section(
+                self.request, queryset, ordering, self.section_size, f'{name}_cursor'
+            )
 
-        context['albums'] = albums_qs
-        context['playlists'] = playlists_qs
-        context['songs'] = songs_qs
-
-        total_count = albums_qs.count()
-        # This is a number, so we keep the key as is.
-        context['total_results_found'] = total_count
+        # Counts come from the maintained snapshot / cache rather than COUNT(*)
+        context['total_results_found'] = album_count
         return context
 
 
@@ -207,8 +296,8 @@ class AlbumSearchView(LoginRequiredMixin, ListView):
         query = self.request.GET.get('q')
 
         if query:
-            # 'title__icontains' ORM lookup for case-insensitive containment.
-            queryset = queryset.filter(title__icontains=query)
+            # Full-text prefix match over titles, artists and tracks, best match first
+            queryset = search_albums(queryset, query)
 
         self.query = query
         return queryset
@@ -227,9 +316,8 @@ class AlbumCreateView(ArtistOrAdminRequiredMixin, CreateView):
 
     def form_valid(self, form):
         # REQUIRED LOGIC -> Automatically set the 'artist_account' field
-        try:
-            dottify_user = DottifyUser.objects.get(user=self.request.user)
-        except DottifyUser.DoesNotExist:
+        dottify_user = get_identity(self.request).profile
+        if dottify_user is None:
             form.add_error(None, _("You do not have an associated Dottify profile to create albums."))
             return self.form_invalid(form)
 
@@ -286,23 +374,22 @@ class SongCreateView(ArtistOrAdminRequiredMixin, CreateView):
     success_url = reverse_lazy('home')
 
     def get_form_kwargs(self):
-        """Pass the current user for filtering"""
+        """Pass the current identity for filtering"""
         kwargs = super().get_form_kwargs()
-        kwargs['user'] = self.request.user
+        kwargs['identity'] = get_identity(self.request)
         return kwargs
 
     def form_valid(self, form):
-        user = self.request.user
+        identity = get_identity(self.request)
         selected_album = form.cleaned_data.get('album')
 
         # --- Post Authorization Check (Route 7) ---
-        if user.groups.filter(name=_('Artist')).exists():
-            try:
-                dottify_user = DottifyUser.objects.get(user=user)
-            except DottifyUser.DoesNotExist:
+        if identity.is_artist:
+            dottify_user = identity.profile
+            if dottify_user is None:
                 return HttpResponseForbidden(_("User profile not found. Cannot create songs."))
 
-            if selected_album.artist_account != dottify_user:                
+            if selected_album.artist_account_id != dottify_user.pk:
                 return HttpResponseForbidden(_("You can only create songs for your own albums."))
 
         # If the user is an Admin, or is a matching Artist, proceed
@@ -315,9 +402,9 @@ class SongUpdateView(ContentOwnerOrAdminMixin, UpdateView):
     template_name = 'dottify/song_form.html'
 
     def get_form_kwargs(self):
-        """Pass the current user for filtering"""
+        """Pass the current identity for filtering"""
         kwargs = super().get_form_kwargs()
-        kwargs['user'] = self.request.user
+        kwargs['identity'] = get_identity(self.request)
         return kwargs
 
     # Implementation required by ContentOwnerOrAdminMixin
@@ -1,9 +1,29 @@
 import data_wizard
+from data_wizard import registry
+
+from .importer import BULK_IMPORT_TASKS
 from .models import DottifyUser, Album, Song, Playlist, Rating, Comment
 
-data_wizard.register(DottifyUser)
-data_wizard.register(Album)
-data_wizard.register(Song)
+
+def register_bulk(model):
+    """
+    Registers model as data_wizard.register(model) would, but imported in
+    chunks by dottify.importer. The generated serializer keeps its name, so
+    runs and column mappings saved before still resolve.
+    """
+    serializer = registry.create_serializer(model)
+
+    class Meta(serializer.Meta):
+        data_wizard = {'auto_import_tasks': BULK_IMPORT_TASKS}
+
+    serializer.Meta = Meta
+    data_wizard.register(model._meta.verbose_name.title(), serializer)
+
+
+register_bulk(DottifyUser)
+register_bulk(Album)
+register_bulk(Song)
+# Playlists bring their songs along, which the bulk path doesn't handle
 data_wizard.register(Playlist)
-data_wizard.register(Rating)
-data_wizard.register(Comment)
\ No newline at end of file
+register_bulk(Rating)
+register_bulk(Comment)